@@ -0,0 +1,123 @@
+"""
+管理后台统计：各表总数和近 N 天每日新增用聚合查询一次算出，结果作为快照缓存
+
+快照过期后仍先返回旧快照，同时由后台线程重新计算；只有第一次请求需要等待计算。
+"""
+import time
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, User, MealRecord, Message, AIFeedback
+
+# 参与每日统计的表：序列名 -> 模型
+DAILY_SERIES = {
+    'users': User,
+    'meals': MealRecord,
+    'ai_feedbacks': AIFeedback,
+    'messages': Message,
+}
+
+
+def _count(model, *criteria):
+    return db.select(db.func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+
+def compute_stats(days=30):
+    """计算统计数据（两条查询：各项总数、近 days 天按天分组的新增数）"""
+    today = datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+
+    totals = db.session.query(
+        _count(User).label('users'),
+        _count(MealRecord).label('meals'),
+        _count(AIFeedback).label('ai_feedbacks'),
+        _count(AIFeedback, AIFeedback.feedback_type == 'like').label('likes'),
+        _count(AIFeedback, AIFeedback.feedback_type == 'dislike').label('dislikes'),
+        _count(Message).label('messages'),
+    ).one()
+
+    daily = db.union_all(*[
+        db.select(db.literal(name).label('series'), db.func.date(model.created_at).label('day'),
+                  db.func.count().label('n'))
+        .where(db.func.date(model.created_at) >= since)
+        .group_by(db.func.date(model.created_at))
+        for name, model in DAILY_SERIES.items()
+    ])
+    dates = [(since + timedelta(days=i)).isoformat() for i in range(days)]
+    series = {name: dict.fromkeys(dates, 0) for name in DAILY_SERIES}
+    for name, day, n in db.session.execute(daily):
+        day = str(day)
+        if day in series[name]:
+            series[name][day] = n
+
+    today_key = today.isoformat()
+    return {
+        'users': {'total': totals.users, 'today': series['users'][today_key]},
+        'meals': {'total': totals.meals, 'today': series['meals'][today_key]},
+        'ai_feedbacks': {'total': totals.ai_feedbacks, 'likes': totals.likes, 'dislikes': totals.dislikes},
+        'messages': {'total': totals.messages, 'today': series['messages'][today_key]},
+        'daily': {
+            'dates': dates,
+            'series': {name: list(counts.values()) for name, counts in series.items()}
+        },
+    }
+
+
+class AdminStatsSnapshot:
+    """统计数据快照，超过 ttl 秒后在后台刷新"""
+
+    def __init__(self, app, ttl=60, days=30):
+        self.app = app
+        self.ttl = ttl
+        self.days = days
+        self._snapshot = None  # (计算完成时间 monotonic, 生成时间 datetime, 数据)
+        self._pending = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='admin-stats')
+        self.counters = {'hits': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def get(self):
+        """返回统计数据和生成时间；没有快照时同步计算"""
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self._store(compute_stats(self.days))
+        else:
+            with self._lock:
+                self.counters['hits'] += 1
+            if time.monotonic() - snapshot[0] > self.ttl:
+                self._schedule()
+        return dict(snapshot[2], generated_at=snapshot[1].strftime('%Y-%m-%d %H:%M:%S'))
+
+    def _store(self, data):
+        snapshot = (time.monotonic(), datetime.utcnow(), data)
+        with self._lock:
+            self._snapshot = snapshot
+            self.counters['refreshes'] += 1
+        return snapshot
+
+    def _schedule(self):
+        with self._lock:
+            if self._pending:
+                return
+            self._pending = True
+        self._executor.submit(self._refresh)
+
+    def _refresh(self):
+        try:
+            with self.app.app_context():
+                self._store(compute_stats(self.days))
+        except Exception:
+            with self._lock:
+                self.counters['refresh_errors'] += 1
+        finally:
+            with self._lock:
+                self._pending = False
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            if self._snapshot:
+                counters['age'] = round(time.monotonic() - self._snapshot[0], 1)
+        return counters
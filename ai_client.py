@@ -0,0 +1,192 @@
+"""
+魔搭 API 客户端管理（进程级共享连接池）
+"""
+import os
+import atexit
+import asyncio
+import threading
+import importlib.util
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class ClientManager:
+    """进程内共享的 OpenAI 客户端，复用 keep-alive 连接，线程安全"""
+
+    def __init__(self, base_url, api_key, max_connections=20, max_keepalive_connections=10,
+                 keepalive_expiry=60.0, connect_timeout=10.0, read_timeout=120.0, http2=False):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        # HTTP/2 依赖 h2 包，未安装时退回 HTTP/1.1
+        self.http2 = http2 and importlib.util.find_spec('h2') is not None
+        self._client = None
+        self._http_client = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, base_url, api_key):
+        """根据环境变量创建客户端管理器"""
+        return cls(
+            base_url=base_url,
+            api_key=api_key,
+            max_connections=_env_int('AI_POOL_MAX_CONNECTIONS', 20),
+            max_keepalive_connections=_env_int('AI_POOL_MAX_KEEPALIVE', 10),
+            keepalive_expiry=_env_float('AI_POOL_KEEPALIVE_EXPIRY', 60.0),
+            connect_timeout=_env_float('AI_CONNECT_TIMEOUT', 10.0),
+            read_timeout=_env_float('AI_READ_TIMEOUT', 120.0),
+            http2=_env_bool('AI_HTTP2', False)
+        )
+
+    def get_client(self):
+        """获取共享客户端，首次调用时创建"""
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                self._http_client = httpx.Client(
+                    verify=True,
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    http2=self.http2
+                )
+                self._client = OpenAI(
+                    base_url=self.base_url,
+                    api_key=self.api_key,
+                    timeout=self.timeout,
+                    http_client=self._http_client
+                )
+            return self._client
+
+    def close(self):
+        """关闭连接池，释放所有连接"""
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+            self._client = None
+            self._http_client = None
+
+    def register_shutdown(self):
+        """进程退出时自动关闭连接池"""
+        atexit.register(self.close)
+        return self
+
+
+class AsyncClientManager:
+    """在独立事件循环线程上运行的 AsyncOpenAI 客户端
+
+    上游模型流都是同一个事件循环里的协程，并发数由连接池上限决定而不是线程数。
+    这只省掉了生成任务的线程：提交后轮询 /api/jobs/<id> 的请求立即返回，
+    而 SSE 客户端（/stream、/api/jobs/<id>/events）仍在 JobQueue.events 中各占一个请求线程。
+    其他线程通过 submit() 提交协程。
+    """
+
+    def __init__(self, base_url, api_key, max_connections=500, max_keepalive_connections=100,
+                 keepalive_expiry=60.0, connect_timeout=10.0, read_timeout=120.0, http2=False):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.http2 = http2 and importlib.util.find_spec('h2') is not None
+        self._loop = None
+        self._client = None
+        self._http_client = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, base_url, api_key):
+        """根据环境变量创建客户端管理器"""
+        return cls(
+            base_url=base_url,
+            api_key=api_key,
+            max_connections=_env_int('AI_ASYNC_MAX_CONNECTIONS', 500),
+            max_keepalive_connections=_env_int('AI_ASYNC_MAX_KEEPALIVE', 100),
+            keepalive_expiry=_env_float('AI_POOL_KEEPALIVE_EXPIRY', 60.0),
+            connect_timeout=_env_float('AI_CONNECT_TIMEOUT', 10.0),
+            read_timeout=_env_float('AI_READ_TIMEOUT', 120.0),
+            http2=_env_bool('AI_HTTP2', False)
+        )
+
+    def _ensure_loop(self):
+        """首次使用时启动事件循环线程并创建客户端"""
+        loop = self._loop
+        if loop is not None:
+            return loop
+        with self._lock:
+            if self._loop is None:
+                self._http_client = httpx.AsyncClient(
+                    verify=True,
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    http2=self.http2
+                )
+                self._client = AsyncOpenAI(
+                    base_url=self.base_url,
+                    api_key=self.api_key,
+                    timeout=self.timeout,
+                    http_client=self._http_client
+                )
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='ai-async-loop', daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def get_client(self):
+        """获取共享的 AsyncOpenAI 客户端（只能在 submit 的协程中使用）"""
+        self._ensure_loop()
+        return self._client
+
+    def submit(self, coro):
+        """把协程提交到事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def close(self):
+        """关闭连接池并停止事件循环"""
+        with self._lock:
+            loop, http_client = self._loop, self._http_client
+            self._loop = self._client = self._http_client = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(http_client.aclose(), loop).result(timeout=5)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+
+    def register_shutdown(self):
+        """进程退出时自动关闭连接池"""
+        atexit.register(self.close)
+        return self
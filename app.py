@@ -2,29 +2,51 @@
 食友记 - Flask 后端应用（含社交功能）
 """
 import os
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, stream_with_context
 from flask_cors import CORS
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from openai import OpenAI
-import httpx
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import json
 import re
 import base64
-
-from models import db, User, MealRecord, Friendship, Message, MealReaction, AIFeedback, generate_invite_code
+import hashlib
+import time
+from functools import partial
+from concurrent.futures import Future
+
+from models import db, User, MealRecord, Friendship, Message, MealReaction, AIFeedback, generate_invite_code, \
+    backfill_meal_foods, DailyNutritionSummary, rebuild_daily_summaries, adjust_reaction_counts, \
+    repair_reaction_counts, Conversation, find_conversation, get_or_create_conversation, record_message, \
+    mark_conversation_read, bump_data_version
+import migrations
+import database
+from jobs import JobQueue, QueueFull
+from singleflight import SingleFlight
+from inbox import InboxNotifier
+import friend_index
+from admin_stats import AdminStatsSnapshot
+from ai_client import ClientManager, AsyncClientManager
+from cache import LRUCache, AnalysisCache, ImageAnalysisCache, make_analysis_key
+from image_utils import dhash, normalize_image
+from greeting import GreetingService, parse_templates
+from digest import build_weekly_digest
+from pagination import NEXT_CURSOR_HEADER, keyset_page, keyset_union_page, page_response, page_size, union_top
+import prompts
+from nutrition import NUTRIENTS, NutritionEngine, merge_with_model, score_meal
 
 # 加载环境变量
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'diet-assistant-secret-key-2024')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///diet_assistant.db'
+# 数据库（DATABASE_URL，默认 SQLite；连接调优参数见 database.py）
+database.configure(app)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # 初始化扩展
-CORS(app, supports_credentials=True)
+CORS(app, supports_credentials=True, expose_headers=[NEXT_CURSOR_HEADER])
 db.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -34,233 +56,110 @@ login_manager.login_view = 'auth_page'
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    """请求体超过 MAX_CONTENT_LENGTH"""
+    return jsonify({'error': '请求内容过大'}), 413
+
 # 魔搭 API 配置
 MODELSCOPE_BASE_URL = "https://api-inference.modelscope.cn/v1/"
 MODEL_NAME = "Qwen/Qwen3-32B"
 VL_MODEL_NAME = "Qwen/Qwen3.5-397B-A17B"
 API_KEY = os.getenv('MODELSCOPE_API_KEY', '')
 
-# 图像大小限制（base64 解码后最大 4MB）
+# 进程级共享客户端（连接池参数见 AI_POOL_* / AI_*_TIMEOUT / AI_HTTP2 环境变量）
+client_manager = ClientManager.from_env(MODELSCOPE_BASE_URL, API_KEY).register_shutdown()
+
+# 异步模式：模型流在单独的事件循环中以协程执行（AsyncOpenAI），生成任务不再占用线程；
+# 提交后轮询的请求不占线程，SSE 客户端仍在 JobQueue.events 中占用一个请求线程
+AI_ASYNC_MODE = os.getenv('AI_ASYNC_MODE', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+async_client_manager = AsyncClientManager.from_env(MODELSCOPE_BASE_URL, API_KEY).register_shutdown() \
+    if AI_ASYNC_MODE else None
+
+# 分页默认每页条数（请求可用 limit 参数调整，最大 100）
+MEALS_PAGE_SIZE = 30
+MESSAGES_PAGE_SIZE = 50
+ADMIN_PAGE_SIZE = 50
+FEED_PAGE_SIZE = 30
+
+# 图像大小限制（base64 解码后最大 4MB；multipart 上传的原图最大 10MB）
 MAX_IMAGE_SIZE = 4 * 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv('VISION_UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+# 请求体上限（原图加上表单开销）：werkzeug 在读取请求体时计数，缺少或谎报 Content-Length 的分块上传同样受限
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE + 64 * 1024
+
+# 发送给视觉模型前的图片归一化：长边像素上限和 JPEG 字节上限
+VISION_MAX_EDGE = int(os.getenv('VISION_MAX_EDGE', 1024))
+VISION_MAX_JPEG_BYTES = int(os.getenv('VISION_MAX_JPEG_BYTES', 512 * 1024))
 
 # 卡路里换算常量
 COLA_CALORIES = 270
 RICE_BOWL_CALORIES = 232
 RUNNING_KM_CALORIES = 60
 
-# 问候语系统提示词
-GREETING_PROMPT = """你是一个温暖友好的营养师助手"食友记"。请根据当前时间和用户信息，生成一句简短的问候语和鼓励话语。
-
-要求：
-1. 根据时间使用合适的问候（早上好/中午好/下午好/晚上好）
-2. 结合用户的健康目标给出鼓励
-3. 语气温暖、积极、简洁
-4. 总长度控制在50字以内
-
-直接输出问候语，不要加任何前缀或解释。"""
-
-# 饮食咨询系统提示词
-CHAT_PROMPT = """你是一个专业的营养师助手，名叫"食友记"。你可以：
-1. 回答用户关于饮食、营养、健康的问题
-2. 根据用户的健康目标（减重/增肌/保持规律饮食）提供个性化建议
-3. 制定简单的饮食计划建议
-4. 解释食物的营养价值
-5. 分析和总结用户的一周饮食记录
-
-回答要求：
-- 基于《中国居民膳食指南》给出建议
-- 语气专业但亲切
-- 回答简洁实用，控制在300字以内
-- 如果用户询问具体食物的卡路里，告诉他们可以在"记录饮食"模式输入食物来精确计算
-- 如果用户让你总结或分析饮食，请根据下方的一周饮食记录进行分析
-
-用户信息：
-- 性别：{gender}
-- 身高：{height}cm
-- 体重：{weight}kg
-- 健康目标：{goal}
-
-用户一周饮食记录：
-{meal_history}
-"""
-
-# AI 系统提示词（食物分析）
-SYSTEM_PROMPT = """你是一个专业的营养师助手，负责分析用户输入的饮食内容并计算卡路里和营养成分。
-
-## 任务流程：
-1. 识别用户描述中的所有食物项
-2. 对每个食物，判断描述是否足够明确以估算卡路里
-3. 如果存在模糊描述（如大小不明的米饭、可乐、饮料等），标记为需要澄清
-4. 对明确的食物，估算合理的卡路里值
-5. 对每个食物，估算蛋白质、脂肪、碳水化合物和膳食纤维含量（单位：克，保留1位小数）
-6. 根据《中国居民膳食指南》给出饮食建议
-
-## 需要澄清的常见情况：
-- 米饭、面条等主食未说明分量（大碗/中碗/小碗）
-- 饮料未说明大小（大杯/中杯/小杯）
-- 肉类未说明重量或分量
-- 只说"一份"、"一些"等模糊词
-
-## 输出格式要求：
-必须返回严格的JSON格式，不要包含任何其他文字说明：
-
-如果所有食物都明确：
-{
-  "status": "clear",
-  "foods": [
-    {"name": "食物名称", "quantity": "数量描述", "calories": 卡路里数值, "protein": 蛋白质克数, "fat": 脂肪克数, "carbs": 碳水克数, "fiber": 膳食纤维克数}
-  ],
-  "total_calories": 总卡路里数值,
-  "dietary_advice": "根据中国居民膳食指南的建议（2-3句话）",
-  "health_score": 健康评分0-100
-}
-
-如果存在需要澄清的食物：
-{
-  "status": "need_clarification",
-  "clear_foods": [
-    {"name": "明确的食物", "quantity": "数量", "calories": 卡路里, "protein": 蛋白质克数, "fat": 脂肪克数, "carbs": 碳水克数, "fiber": 膳食纤维克数}
-  ],
-  "ambiguous_items": [
-    {
-      "food": "食物名称",
-      "question": "请问XX是什么分量？",
-      "options": [
-        {"label": "小碗/小杯 (约Xg)", "value": "small", "calories": 数值, "protein": 数值, "fat": 数值, "carbs": 数值, "fiber": 数值},
-        {"label": "中碗/中杯 (约Xg)", "value": "medium", "calories": 数值, "protein": 数值, "fat": 数值, "carbs": 数值, "fiber": 数值},
-        {"label": "大碗/大杯 (约Xg)", "value": "large", "calories": 数值, "protein": 数值, "fat": 数值, "carbs": 数值, "fiber": 数值}
-      ]
-    }
-  ]
-}
-
-## 常见食物卡路里参考：
-- 米饭: 小碗(150g)174卡, 中碗(200g)232卡, 大碗(300g)348卡
-- 面条: 小碗200卡, 中碗300卡, 大碗400卡
-- 包子: 1个约250卡（肉包），素包约200卡
-- 馒头: 1个约220卡
-- 鸡蛋: 1个约80卡（煮），煎蛋约120卡
-- 豆浆: 1杯(250ml)约55卡（无糖），加糖约90卡
-- 牛奶: 1杯(250ml)约135卡
-- 可乐: 小杯(300ml)130卡, 中杯(500ml)215卡, 大杯(700ml)300卡
-- 红烧肉: 1份约400-500卡
-- 青菜: 1份约30-50卡
-- 鸡胸肉: 100g约133卡
-- 猪肉: 100g约395卡
-- 牛肉: 100g约250卡
-- 炒饭: 1份约500-600卡
-- 饺子: 1个约40卡，10个约400卡
-- 油条: 1根约230卡
-
-## 常见食物营养素参考（每100g）：
-- 米饭: 蛋白质2.6g, 脂肪0.3g, 碳水26g, 膳食纤维0.3g
-- 面条: 蛋白质4g, 脂肪0.5g, 碳水25g, 膳食纤维1g
-- 鸡胸肉: 蛋白质23g, 脂肪5g, 碳水1g, 膳食纤维0g
-- 鸡蛋(煮): 蛋白质13g, 脂肪10g, 碳水1.5g, 膳食纤维0g
-- 青菜: 蛋白质1.5g, 脂肪0.3g, 碳水2g, 膳食纤维1.5g
-- 豆浆(无糖): 蛋白质3.6g, 脂肪1.8g, 碳水1.2g, 膳食纤维0.1g
-- 猪肉: 蛋白质13g, 脂肪37g, 碳水0g, 膳食纤维0g
-- 牛肉: 蛋白质20g, 脂肪10g, 碳水0g, 膳食纤维0g
-- 包子(肉): 蛋白质8g, 脂肪8g, 碳水30g, 膳食纤维1g
-- 油条: 蛋白质6g, 脂肪18g, 碳水40g, 膳食纤维0.5g
-
-## 健康评分标准（基于中国居民膳食指南）：
-- 90-100分: 营养均衡，搭配合理
-- 70-89分: 基本合理，略有不足
-- 50-69分: 营养不够均衡，需要调整
-- 50分以下: 搭配不合理，建议改善
-
-记住：只输出JSON，不要有任何额外的文字！"""
-
-
-# AI 视觉识别系统提示词（食物图片分析）
-VISION_SYSTEM_PROMPT = """你是一个专业的营养师助手，负责分析用户上传的食物照片，识别其中的食物并计算卡路里和营养成分。
-
-## 任务流程：
-1. 仔细观察图片中的所有食物
-2. 识别每种食物的种类和大致分量
-3. 根据视觉估算合理的卡路里值
-4. 对每个食物，估算蛋白质、脂肪、碳水化合物和膳食纤维含量（单位：克，保留1位小数）
-5. 如果某些食物因角度、光线或遮挡难以确定，标记为需要澄清
-6. 根据《中国居民膳食指南》给出饮食建议
-
-## 识别注意事项：
-- 注意识别主食（米饭、面条、馒头等）的分量大小
-- 注意识别肉类（鸡肉、猪肉、牛肉等）的烹饪方式和分量
-- 注意识别蔬菜的种类
-- 注意识别饮料和汤品
-- 如果有包装食品，尝试读取包装信息
-
-## 输出格式要求：
-必须返回严格的JSON格式，不要包含任何其他文字说明：
-
-如果所有食物都识别清楚：
-{
-  "status": "clear",
-  "foods": [
-    {"name": "食物名称", "quantity": "数量描述（如：1碗、2个、约200g）", "calories": 卡路里数值, "protein": 蛋白质克数, "fat": 脂肪克数, "carbs": 碳水克数, "fiber": 膳食纤维克数}
-  ],
-  "total_calories": 总卡路里数值,
-  "dietary_advice": "根据中国居民膳食指南的建议（2-3句话）",
-  "health_score": 健康评分0-100
-}
-
-如果存在不确定的食物：
-{
-  "status": "need_clarification",
-  "clear_foods": [
-    {"name": "明确的食物", "quantity": "数量", "calories": 卡路里, "protein": 蛋白质克数, "fat": 脂肪克数, "carbs": 碳水克数, "fiber": 膳食纤维克数}
-  ],
-  "ambiguous_items": [
-    {
-      "food": "食物名称",
-      "question": "请问XX是什么分量？",
-      "options": [
-        {"label": "小份 (约Xg)", "value": "small", "calories": 数值, "protein": 数值, "fat": 数值, "carbs": 数值, "fiber": 数值},
-        {"label": "中份 (约Xg)", "value": "medium", "calories": 数值, "protein": 数值, "fat": 数值, "carbs": 数值, "fiber": 数值},
-        {"label": "大份 (约Xg)", "value": "large", "calories": 数值, "protein": 数值, "fat": 数值, "carbs": 数值, "fiber": 数值}
-      ]
-    }
-  ]
-}
-
-## 常见食物卡路里参考：
-- 米饭: 小碗(150g)174卡, 中碗(200g)232卡, 大碗(300g)348卡
-- 面条: 小碗200卡, 中碗300卡, 大碗400卡
-- 包子: 1个约250卡（肉包），素包约200卡
-- 馒头: 1个约220卡
-- 鸡蛋: 1个约80卡（煮），煎蛋约120卡
-- 豆浆: 1杯(250ml)约55卡（无糖），加糖约90卡
-- 牛奶: 1杯(250ml)约135卡
-- 可乐: 小杯(300ml)130卡, 中杯(500ml)215卡, 大杯(700ml)300卡
-- 红烧肉: 1份约400-500卡
-- 青菜: 1份约30-50卡
-- 鸡胸肉: 100g约133卡
-- 猪肉: 100g约395卡
-- 牛肉: 100g约250卡
-- 炒饭: 1份约500-600卡
-- 饺子: 1个约40卡，10个约400卡
-- 油条: 1根约230卡
-
-## 常见食物营养素参考（每100g）：
-- 米饭: 蛋白质2.6g, 脂肪0.3g, 碳水26g, 膳食纤维0.3g
-- 面条: 蛋白质4g, 脂肪0.5g, 碳水25g, 膳食纤维1g
-- 鸡胸肉: 蛋白质23g, 脂肪5g, 碳水1g, 膳食纤维0g
-- 鸡蛋(煮): 蛋白质13g, 脂肪10g, 碳水1.5g, 膳食纤维0g
-- 青菜: 蛋白质1.5g, 脂肪0.3g, 碳水2g, 膳食纤维1.5g
-- 豆浆(无糖): 蛋白质3.6g, 脂肪1.8g, 碳水1.2g, 膳食纤维0.1g
-- 猪肉: 蛋白质13g, 脂肪37g, 碳水0g, 膳食纤维0g
-- 牛肉: 蛋白质20g, 脂肪10g, 碳水0g, 膳食纤维0g
-- 包子(肉): 蛋白质8g, 脂肪8g, 碳水30g, 膳食纤维1g
-- 油条: 蛋白质6g, 脂肪18g, 碳水40g, 膳食纤维0.5g
-
-## 健康评分标准（基于中国居民膳食指南）：
-- 90-100分: 营养均衡，搭配合理
-- 70-89分: 基本合理，略有不足
-- 50-69分: 营养不够均衡，需要调整
-- 50分以下: 搭配不合理，建议改善
-
-记住：只输出JSON，不要有任何额外的文字说明！"""
+# 提示词版本（提示词或模型变更后缓存自动失效，并记录在任务表中）
+PROMPT_VERSIONS = prompts.prompt_versions(MODEL_NAME, VL_MODEL_NAME)
+ANALYSIS_PROMPT_VERSION = PROMPT_VERSIONS['analyze']
+
+# 饮食分析结果缓存（内存 LRU + SQLite）
+analysis_cache = AnalysisCache(
+    memory_size=int(os.getenv('ANALYSIS_CACHE_MEMORY_SIZE', 512)),
+    ttl=int(os.getenv('ANALYSIS_CACHE_TTL', 7 * 24 * 3600)),
+    max_rows=int(os.getenv('ANALYSIS_CACHE_MAX_ROWS', 5000))
+)
+
+# 饮食建议缓存（按餐次和食物组合）
+advice_cache = LRUCache(
+    max_size=int(os.getenv('ADVICE_CACHE_SIZE', 1024)),
+    ttl=int(os.getenv('ADVICE_CACHE_TTL', 7 * 24 * 3600))
+)
+
+# 对话使用的一周饮食摘要（token 预算内，按用户缓存）
+CHAT_DIGEST_TOKEN_BUDGET = int(os.getenv('CHAT_DIGEST_TOKEN_BUDGET', 300))
+chat_digest_cache = LRUCache(int(os.getenv('CHAT_DIGEST_CACHE_SIZE', 1024)), ttl=24 * 3600)
+
+# 好友动态（按用户缓存已生成的分页，短 TTL；自己点赞/评论时立即失效）
+feed_cache = LRUCache(int(os.getenv('FEED_CACHE_SIZE', 1024)), ttl=int(os.getenv('FEED_CACHE_TTL', 15)))
+
+# 本地食物库（内置常见食物，可通过数据文件扩展）
+nutrition_engine = NutritionEngine.load(
+    os.getenv('NUTRITION_DATA_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'foods.json'))
+)
+
+# 图片分析缓存（按用户隔离，感知哈希相近即复用）
+VISION_PROMPT_VERSION = PROMPT_VERSIONS['vision']
+vision_cache = ImageAnalysisCache(
+    per_user_size=int(os.getenv('VISION_CACHE_PER_USER', 20)),
+    ttl=int(os.getenv('VISION_CACHE_TTL', 24 * 3600)),
+    threshold=int(os.getenv('VISION_CACHE_HAMMING_THRESHOLD', 6))
+)
+
+# AI 后台任务队列（模型调用不占用 Web 工作线程）
+job_queue = JobQueue(
+    app,
+    max_workers=int(os.getenv('AI_JOB_WORKERS', 4)),
+    max_pending=int(os.getenv('AI_JOB_MAX_PENDING', 256 if AI_ASYNC_MODE else 32)),
+    dedupe_window=int(os.getenv('AI_JOB_DEDUPE_WINDOW', 60))
+)
+
+# 相同模型请求合并（跨用户共享同一次上游调用）
+ai_coalescer = SingleFlight(timeout=int(os.getenv('AI_COALESCE_TIMEOUT', 120)))
+
+# 留言推送（SSE / 长轮询）；多进程部署时每 INBOX_POLL_INTERVAL 秒查库发现其他进程写入的消息
+inbox = InboxNotifier(poll_interval=int(os.getenv('INBOX_POLL_INTERVAL', 5)))
+INBOX_STREAM_MAX_AGE = int(os.getenv('INBOX_STREAM_MAX_AGE', 300))  # SSE 连接最长保持秒数，之后由客户端重连
+INBOX_LONG_POLL_TIMEOUT = 25
+
+# 好友关系内存索引（社交接口的好友校验）；每 FRIEND_INDEX_CHECK_INTERVAL 秒核对一次其他进程的变更
+friend_graph = friend_index.FriendIndex(check_interval=int(os.getenv('FRIEND_INDEX_CHECK_INTERVAL', 5)))
+
+# 管理后台统计快照（过期后后台刷新）
+admin_stats_snapshot = AdminStatsSnapshot(
+    app,
+    ttl=int(os.getenv('ADMIN_STATS_TTL', 60)),
+    days=int(os.getenv('ADMIN_STATS_DAYS', 30))
+)
 
 
 # ========== 工具函数 ==========
@@ -269,49 +168,172 @@ def get_client():
     """获取魔搭 API 客户端"""
     if not API_KEY:
         raise ValueError("未配置 MODELSCOPE_API_KEY")
-    return OpenAI(
-        base_url=MODELSCOPE_BASE_URL,
-        api_key=API_KEY,
-        http_client=httpx.Client(verify=True)
-    )
+    return client_manager.get_client()
 
 
-def call_ai_streaming(client, messages, enable_thinking=False):
-    """使用流式调用 AI（Qwen3）"""
+# 模型调用的公共参数
+COMPLETION_OPTIONS = {'temperature': 0.3, 'max_tokens': 2000}
+
+# Qwen3 文本模型默认关闭思考模式
+TEXT_MODEL_OPTIONS = {'extra_body': {'enable_thinking': False}}
+
+
+def iter_ai_stream(client, model, messages, **kwargs):
+    """流式调用 AI，逐段产出回答内容（delta.content）"""
     response = client.chat.completions.create(
-        model=MODEL_NAME,
+        model=model,
+        messages=messages,
+        stream=True,
+        **COMPLETION_OPTIONS,
+        **kwargs
+    )
+    try:
+        for chunk in response:
+            if chunk.choices:
+                delta = chunk.choices[0].delta
+                # Qwen3 区分 reasoning_content（思考过程）和 content（最终回答），只取 content
+                if hasattr(delta, 'content') and delta.content:
+                    yield delta.content
+    finally:
+        # 出错或客户端断开时也要关闭响应，连接才能归还连接池
+        response.close()
+
+
+async def collect_ai_stream_async(client, model, messages, emit, **kwargs):
+    """异步流式调用 AI（AsyncOpenAI），增量内容交给 emit，返回完整回答"""
+    response = await client.chat.completions.create(
+        model=model,
         messages=messages,
-        temperature=0.3,
-        max_tokens=2000,
         stream=True,
-        extra_body={"enable_thinking": enable_thinking}
+        **COMPLETION_OPTIONS,
+        **kwargs
     )
     answer_content = ""
-    for chunk in response:
-        if chunk.choices:
-            delta = chunk.choices[0].delta
-            # Qwen3 区分 reasoning_content（思考过程）和 content（最终回答），只取 content
-            if hasattr(delta, 'content') and delta.content:
-                answer_content += delta.content
+    try:
+        async for chunk in response:
+            if chunk.choices:
+                delta = chunk.choices[0].delta
+                if hasattr(delta, 'content') and delta.content:
+                    answer_content += delta.content
+                    emit(delta.content)
+    finally:
+        await response.close()
     return answer_content
 
 
-def call_vision_ai_streaming(client, messages):
-    """使用流式调用视觉 AI"""
-    response = client.chat.completions.create(
-        model=VL_MODEL_NAME,
-        messages=messages,
-        temperature=0.3,
-        max_tokens=2000,
-        stream=True
+def iter_text_ai(client, messages, enable_thinking=False):
+    """流式调用文本 AI（Qwen3），逐段产出"""
+    return iter_ai_stream(client, MODEL_NAME, messages, extra_body={"enable_thinking": enable_thinking})
+
+
+def call_ai_streaming(client, messages, enable_thinking=False):
+    """使用流式调用 AI（Qwen3）"""
+    return ''.join(iter_text_ai(client, messages, enable_thinking))
+
+
+def sse_event(event, data):
+    """格式化一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events):
+    """以 text/event-stream 返回事件生成器"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
+
+
+def run_ai_stream(client, model, messages, publish, **kwargs):
+    """同步流式调用 AI，增量内容交给 publish，返回已完成的 Future（结果为完整回答）"""
+    future = Future()
     answer_content = ""
-    for chunk in response:
-        if chunk.choices:
-            delta = chunk.choices[0].delta
-            if hasattr(delta, 'content') and delta.content:
-                answer_content += delta.content
-    return answer_content
+    try:
+        for piece in iter_ai_stream(client, model, messages, **kwargs):
+            answer_content += piece
+            publish(piece)
+        future.set_result(answer_content)
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def ai_task(coalesce_key, start, finish, error_prefix):
+    """把一次（可合并的）模型调用包装为后台任务：增量输出交给 emit，结束后返回 finish(全文)"""
+    def run(emit):
+        try:
+            return finish(ai_coalescer.run(coalesce_key, start, emit).result())
+        except Exception as e:
+            return None, f'{error_prefix}: {str(e)}'
+    return run
+
+
+def job_dedupe_key(*parts):
+    """生成任务去重键"""
+    return hashlib.sha256('\x00'.join(parts).encode('utf-8')).hexdigest()
+
+
+def job_events(job_id):
+    """以 SSE 转发任务事件：先发送 job（任务 ID，便于断线后重连），再转发 delta/result/error
+
+    网页端通过 /stream 接口边生成边显示，连接断开时改为轮询 /api/jobs/<id>。
+    注意：SSE 连接在整个生成期间占用一个 Web 工作线程（等待任务进度），并发连接较多时
+    应部署在非线程模型的 worker（如 gevent）上。
+    """
+    yield sse_event('job', {'job_id': job_id})
+    for event, data in job_queue.events(job_id):
+        yield sse_event(event, data)
+
+
+def async_ai_finish(finish, error_prefix):
+    """异步任务的收尾：取出事件循环返回的全文交给 finish"""
+    def run(future):
+        try:
+            return finish(future.result())
+        except Exception as e:
+            return None, f'{error_prefix}: {str(e)}'
+    return run
+
+
+def submit_ai_job(kind, dedupe_key, model, messages, finish, error_prefix, prompt_key=None, **kwargs):
+    """提交模型调用任务：异步模式在事件循环中执行，否则在任务线程池中执行
+
+    prompt_key 标识归一化后的提示词（默认取消息全文），(接口, 模型, prompt_key) 相同的并发请求共享一次上游调用
+    """
+    if prompt_key is None:
+        prompt_key = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    coalesce_key = job_dedupe_key(kind, model, prompt_key)
+
+    if async_client_manager is not None:
+        if not API_KEY:
+            raise ValueError("未配置 MODELSCOPE_API_KEY")
+
+        def start_upstream(publish):
+            client = async_client_manager.get_client()
+            return async_client_manager.submit(collect_ai_stream_async(client, model, messages, publish, **kwargs))
+
+        return job_queue.submit_async(current_user.id, kind, dedupe_key,
+                                      partial(ai_coalescer.run, coalesce_key, start_upstream),
+                                      async_ai_finish(finish, error_prefix), PROMPT_VERSIONS.get(kind))
+
+    start_upstream = partial(run_ai_stream, get_client(), model, messages, **kwargs)
+    task = ai_task(coalesce_key, start_upstream, finish, error_prefix)
+    return job_queue.submit(current_user.id, kind, dedupe_key, task, PROMPT_VERSIONS.get(kind))
+
+
+def ai_job_response(kind, dedupe_key, model, messages, finish, error_prefix, stream=False, prompt_key=None,
+                    **kwargs):
+    """提交 AI 任务：stream 时以 SSE 转发任务进度（占用请求线程，见 job_events），否则立即返回任务 ID（202）"""
+    try:
+        job_id, _ = submit_ai_job(kind, dedupe_key, model, messages, finish, error_prefix, prompt_key, **kwargs)
+    except QueueFull:
+        return jsonify({'error': '服务繁忙，请稍后重试'}), 503
+    except Exception as e:
+        return jsonify({'error': f'{error_prefix}: {str(e)}'}), 500
+    if stream:
+        return sse_response(job_events(job_id))
+    return jsonify({'job_id': job_id, 'status': 'queued'}), 202
 
 
 def calculate_visualizations(total_calories):
@@ -344,6 +366,36 @@ def parse_ai_response(response_text):
     return None
 
 
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def validate_analysis_result(result):
+    """校验 AI 分析结果的结构和数值，只有通过校验的结果才写入缓存"""
+    if not isinstance(result, dict):
+        return False
+    
+    def valid_foods(foods):
+        return isinstance(foods, list) and all(
+            isinstance(f, dict) and f.get('name') and _is_number(f.get('calories')) for f in foods
+        )
+    
+    status = result.get('status')
+    if status == 'clear':
+        return bool(result.get('foods')) and valid_foods(result['foods']) \
+            and _is_number(result.get('total_calories'))
+    if status == 'need_clarification':
+        items = result.get('ambiguous_items')
+        if not isinstance(items, list) or not items or not valid_foods(result.get('clear_foods', [])):
+            return False
+        return all(
+            isinstance(item, dict) and item.get('food') and isinstance(item.get('options'), list)
+            and item['options'] and all(isinstance(o, dict) and _is_number(o.get('calories')) for o in item['options'])
+            for item in items
+        )
+    return False
+
+
 # ========== 页面路由 ==========
 
 @app.route('/')
@@ -488,22 +540,40 @@ def update_profile():
 @app.route('/api/meals', methods=['GET'])
 @login_required
 def get_meals():
-    """获取一周饮食记录"""
-    week_ago = datetime.utcnow() - timedelta(days=7)
-    records = MealRecord.query.filter(
-        MealRecord.user_id == current_user.id,
-        MealRecord.created_at >= week_ago
-    ).order_by(MealRecord.created_at.desc()).all()
-    
-    # 为每条记录添加点赞/点踩统计
+    """分页获取饮食记录（从新到旧，cursor 为上一页返回的 X-Next-Cursor）"""
+    return meals_page(current_user.id)
+
+
+def meals_page(user_id):
+    """按游标分页返回某个用户的饮食记录"""
+    try:
+        records, next_cursor = keyset_page(
+            MealRecord.query.filter(MealRecord.user_id == user_id), MealRecord,
+            request.args.get('cursor'), page_size(request.args.get('limit', type=int), MEALS_PAGE_SIZE)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return page_response(meals_with_reactions(records), next_cursor)
+
+
+def meals_with_reactions(records):
+    """序列化饮食记录并附带点赞/点踩数（计数列）和当前用户的反应（一次批量查询）"""
+    meal_ids = [r.id for r in records]
+    mine = {}
+    if meal_ids:
+        mine = dict(db.session.query(MealReaction.meal_id, MealReaction.reaction_type).filter(
+            MealReaction.meal_id.in_(meal_ids),
+            MealReaction.user_id == current_user.id
+        ).all())
+    
     result = []
     for r in records:
         data = r.to_dict()
-        data['likes'] = MealReaction.query.filter_by(meal_id=r.id, reaction_type='like').count()
-        data['dislikes'] = MealReaction.query.filter_by(meal_id=r.id, reaction_type='dislike').count()
+        data['likes'] = r.like_count or 0
+        data['dislikes'] = r.dislike_count or 0
+        data['my_reaction'] = mine.get(r.id)
         result.append(data)
-    
-    return jsonify(result)
+    return result
 
 
 @app.route('/api/meals', methods=['POST'])
@@ -515,14 +585,17 @@ def save_meal():
     record = MealRecord(
         user_id=current_user.id,
         meal_type=data.get('meal_type', ''),
-        foods=json.dumps(data.get('foods', []), ensure_ascii=False),
         total_calories=data.get('total_calories', 0),
         health_score=data.get('health_score', 0),
-        dietary_advice=data.get('dietary_advice', '')
+        dietary_advice=data.get('dietary_advice', ''),
+        created_at=datetime.utcnow()
     )
+    record.set_foods(data.get('foods', []))
     
     db.session.add(record)
+    DailyNutritionSummary.apply(record)
     db.session.commit()
+    chat_digest_cache.pop(current_user.id)
     return jsonify({'success': True, 'record': record.to_dict()})
 
 
@@ -534,47 +607,17 @@ def delete_meal(meal_id):
     if not record:
         return jsonify({'error': '记录不存在'}), 404
     
+    DailyNutritionSummary.apply(record, -1)
     db.session.delete(record)
     db.session.commit()
+    chat_digest_cache.pop(current_user.id)
     return jsonify({'success': True})
 
 
-@app.route('/api/daily-nutrition', methods=['GET'])
-@login_required
-def get_daily_nutrition():
-    """获取今日营养汇总"""
-    from datetime import date
-    today_start = datetime.combine(date.today(), datetime.min.time())
-
-    records = MealRecord.query.filter(
-        MealRecord.user_id == current_user.id,
-        MealRecord.created_at >= today_start
-    ).all()
-
-    total_calories = 0
-    protein = 0.0
-    fat = 0.0
-    carbs = 0.0
-    fiber = 0.0
-    has_nutrition = False
-
-    for record in records:
-        total_calories += record.total_calories or 0
-        try:
-            foods = json.loads(record.foods) if isinstance(record.foods, str) else (record.foods or [])
-        except (json.JSONDecodeError, TypeError):
-            foods = []
-        for food in foods:
-            if isinstance(food, dict) and food.get('protein') is not None:
-                has_nutrition = True
-                protein += float(food.get('protein', 0))
-                fat += float(food.get('fat', 0))
-                carbs += float(food.get('carbs', 0))
-                fiber += float(food.get('fiber', 0))
-
-    # 根据用户性别和目标计算推荐值（基于中国居民膳食指南 2022）
-    gender = current_user.gender or 'male'
-    goal = current_user.goal or 'maintain'
+def recommended_nutrition(user):
+    """根据用户性别和目标计算推荐值（基于中国居民膳食指南 2022）"""
+    gender = user.gender or 'male'
+    goal = user.goal or 'maintain'
 
     rec_protein = 65 if gender == 'male' else 55
     rec_fat = 60 if gender == 'male' else 50
@@ -587,23 +630,71 @@ def get_daily_nutrition():
     elif goal == 'gain_muscle':
         rec_protein += 25
 
+    return {
+        'protein': rec_protein,
+        'fat': rec_fat,
+        'carbs': rec_carbs,
+        'fiber': rec_fiber
+    }
+
+
+def empty_day(day):
+    return {
+        'date': day.isoformat(),
+        'total_calories': 0,
+        'meal_count': 0,
+        'nutrition': {'protein': 0.0, 'fat': 0.0, 'carbs': 0.0, 'fiber': 0.0},
+        'has_data': False
+    }
+
+
+def nutrition_history(user_id, days):
+    """从每日汇总表读取最近 days 天（含今天）的营养数据，缺失的日期补零"""
+    from datetime import date
+    start_date = date.today() - timedelta(days=days - 1)
+    summaries = {
+        s.local_date: s.to_dict()
+        for s in DailyNutritionSummary.query.filter(
+            DailyNutritionSummary.user_id == user_id,
+            DailyNutritionSummary.local_date >= start_date
+        )
+    }
+    result = []
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        result.append(summaries.get(day) or empty_day(day))
+    return result
+
+
+@app.route('/api/daily-nutrition', methods=['GET'])
+@login_required
+def get_daily_nutrition():
+    """获取今日营养汇总"""
+    today = nutrition_history(current_user.id, 1)[0]
+    today['recommended'] = recommended_nutrition(current_user)
+    return jsonify(today)
+
+
+@app.route('/api/weekly-nutrition', methods=['GET'])
+@login_required
+def get_weekly_nutrition():
+    """获取最近 7 天每天的营养汇总"""
+    return jsonify({
+        'days': nutrition_history(current_user.id, 7),
+        'recommended': recommended_nutrition(current_user)
+    })
+
+
+@app.route('/api/nutrition-history', methods=['GET'])
+@login_required
+def get_nutrition_history():
+    """获取最近 N 天（30/90/365）的每日营养汇总"""
+    days = request.args.get('days', 30, type=int)
+    if days not in (7, 30, 90, 365):
+        return jsonify({'error': 'days 只能是 7、30、90 或 365'}), 400
     return jsonify({
-        'date': date.today().isoformat(),
-        'total_calories': total_calories,
-        'nutrition': {
-            'protein': round(protein, 1),
-            'fat': round(fat, 1),
-            'carbs': round(carbs, 1),
-            'fiber': round(fiber, 1)
-        },
-        'recommended': {
-            'protein': rec_protein,
-            'fat': rec_fat,
-            'carbs': rec_carbs,
-            'fiber': rec_fiber
-        },
-        'meal_count': len(records),
-        'has_data': has_nutrition
+        'days': nutrition_history(current_user.id, days),
+        'recommended': recommended_nutrition(current_user)
     })
 
 
@@ -612,18 +703,17 @@ def get_daily_nutrition():
 @app.route('/api/friends', methods=['GET'])
 @login_required
 def get_friends():
-    """获取好友列表"""
-    friendships = Friendship.query.filter_by(user_id=current_user.id).all()
-    friends = []
-    for f in friendships:
-        friend = User.query.get(f.friend_id)
-        if friend:
-            friends.append({
-                'id': friend.id,
-                'username': friend.username,
-                'goal': friend.goal
-            })
-    return jsonify(friends)
+    """获取好友列表（一次联表查询）"""
+    rows = db.session.query(User.id, User.username, User.goal).join(
+        Friendship, Friendship.friend_id == User.id
+    ).filter(Friendship.user_id == current_user.id).order_by(Friendship.id).all()
+    unread = unread_summary(current_user.id)['conversations']
+    return jsonify([{
+        'id': friend_id,
+        'username': username,
+        'goal': goal,
+        'unread': unread.get(str(friend_id), 0)
+    } for friend_id, username, goal in rows])
 
 
 @app.route('/api/friends', methods=['POST'])
@@ -644,17 +734,20 @@ def add_friend():
         return jsonify({'error': '邀请码无效'}), 404
     
     # 检查是否已是好友
-    existing = Friendship.query.filter_by(user_id=current_user.id, friend_id=friend.id).first()
-    if existing:
+    if friend_graph.are_friends(current_user.id, friend.id):
         return jsonify({'error': '已经是好友了'}), 400
     
-    # 双向添加好友关系
+    # 双向添加好友关系，并在同一事务中更新好友关系版本号
     friendship1 = Friendship(user_id=current_user.id, friend_id=friend.id)
     friendship2 = Friendship(user_id=friend.id, friend_id=current_user.id)
     
     db.session.add(friendship1)
     db.session.add(friendship2)
+    version = bump_data_version(friend_index.VERSION_NAME)
     db.session.commit()
+    friend_graph.added(current_user.id, friend.id, version)
+    feed_cache.pop(current_user.id)
+    feed_cache.pop(friend.id)
     
     return jsonify({
         'success': True,
@@ -665,41 +758,93 @@ def add_friend():
 @app.route('/api/friends/<int:friend_id>/meals', methods=['GET'])
 @login_required
 def get_friend_meals(friend_id):
-    """查看好友一周饮食"""
+    """分页查看好友饮食记录"""
     # 验证是否为好友
-    friendship = Friendship.query.filter_by(user_id=current_user.id, friend_id=friend_id).first()
-    if not friendship:
+    if not friend_graph.are_friends(current_user.id, friend_id):
         return jsonify({'error': '不是好友关系'}), 403
     
-    week_ago = datetime.utcnow() - timedelta(days=7)
-    records = MealRecord.query.filter(
-        MealRecord.user_id == friend_id,
-        MealRecord.created_at >= week_ago
-    ).order_by(MealRecord.created_at.desc()).all()
-    
-    return jsonify([r.to_dict() for r in records])
+    return meals_page(friend_id)
+
+
+@app.route('/api/feed', methods=['GET'])
+@login_required
+def get_feed():
+    """好友动态：所有好友的饮食记录按时间从新到旧合并分页，附带作者、点赞数、我的反应和评论数"""
+    cursor = request.args.get('cursor')
+    limit = page_size(request.args.get('limit', type=int), FEED_PAGE_SIZE)
+    
+    pages = feed_cache.get(current_user.id) or {}
+    page = pages.get((cursor, limit))
+    if page is None:
+        try:
+            page = build_feed_page(current_user.id, cursor, limit)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        feed_cache.set(current_user.id, {**pages, (cursor, limit): page})
+    return page_response(*page)
+
+
+def build_feed_page(user_id, cursor, limit):
+    """生成一页好友动态，返回 (条目列表, 下一页游标)
+
+    每个好友一路沿 (user_id, created_at, id) 索引从游标处向前读，各路归并后取一页记录 ID，
+    不需要把所有好友的记录放进临时表排序；再按 ID 加载这一页的记录
+    """
+    ids, next_cursor = keyset_union_page(MealRecord, [
+        MealRecord.user_id == friend_id for friend_id in sorted(friend_graph.friends_of(user_id))
+    ], cursor, limit)
+    loaded = {r.id: r for r in MealRecord.query.options(db.joinedload(MealRecord.user)).filter(
+        MealRecord.id.in_(ids))} if ids else {}
+    records = [loaded[record_id] for record_id in ids if record_id in loaded]
+    comments = {}
+    if records:
+        comments = dict(db.session.query(Message.meal_id, db.func.count(Message.id)).filter(
+            Message.meal_id.in_([r.id for r in records])
+        ).group_by(Message.meal_id).all())
+    
+    items = meals_with_reactions(records)
+    for record, item in zip(records, items):
+        item['user_id'] = record.user_id
+        item['username'] = record.user.username
+        item['comments'] = comments.get(record.id, 0)
+    return items, next_cursor
 
 
 # ========== 留言 API ==========
 
+def message_query():
+    """留言查询：预加载发送者和关联饮食记录（含食物明细），序列化时不再逐条懒加载"""
+    return Message.query.options(
+        db.joinedload(Message.sender),
+        db.joinedload(Message.meal).selectinload(MealRecord.food_items)
+    )
+
+
 @app.route('/api/messages', methods=['GET'])
 @login_required
 def get_messages():
-    """获取留言"""
+    """分页获取留言：与好友的对话每页按时间正序返回，游标指向更早的消息；收到的留言从新到旧"""
     friend_id = request.args.get('friend_id', type=int)
+    cursor = request.args.get('cursor')
+    limit = page_size(request.args.get('limit', type=int), MESSAGES_PAGE_SIZE)
     
-    if friend_id:
-        # 获取与特定好友的对话
-        messages = Message.query.filter(
-            ((Message.from_user_id == current_user.id) & (Message.to_user_id == friend_id)) |
-            ((Message.from_user_id == friend_id) & (Message.to_user_id == current_user.id))
-        ).order_by(Message.created_at.asc()).limit(100).all()
-    else:
-        # 获取收到的所有留言
-        messages = Message.query.filter_by(to_user_id=current_user.id)\
-            .order_by(Message.created_at.desc()).limit(50).all()
+    try:
+        if friend_id:
+            # 获取与特定好友的对话（最近的一页，按时间正序展示）
+            conversation = find_conversation(current_user.id, friend_id)
+            if not conversation:
+                return page_response([], None)
+            messages, next_cursor = keyset_page(message_query().filter_by(conversation_id=conversation.id),
+                                                Message, cursor, limit)
+            messages.reverse()
+        else:
+            # 获取收到的所有留言
+            messages, next_cursor = keyset_page(message_query().filter_by(to_user_id=current_user.id),
+                                                Message, cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify([m.to_dict() for m in messages])
+    return page_response([m.to_dict() for m in messages], next_cursor)
 
 
 @app.route('/api/messages', methods=['POST'])
@@ -718,8 +863,7 @@ def send_message():
         return jsonify({'error': '留言内容不能超过200字'}), 400
     
     # 验证是否为好友
-    friendship = Friendship.query.filter_by(user_id=current_user.id, friend_id=to_user_id).first()
-    if not friendship:
+    if not friend_graph.are_friends(current_user.id, to_user_id):
         return jsonify({'error': '只能给好友留言'}), 403
     
     # 如果有 meal_id，验证该饮食记录属于目标好友
@@ -728,7 +872,9 @@ def send_message():
         if not meal or meal.user_id != to_user_id:
             return jsonify({'error': '无效的饮食记录'}), 400
     
+    conversation = get_or_create_conversation(current_user.id, to_user_id)
     message = Message(
+        conversation_id=conversation.id,
         from_user_id=current_user.id,
         to_user_id=to_user_id,
         meal_id=meal_id,
@@ -736,58 +882,227 @@ def send_message():
     )
     
     db.session.add(message)
+    db.session.flush()
+    record_message(conversation, message)
     db.session.commit()
+    if meal_id:
+        feed_cache.pop(current_user.id)
+    inbox.publish([to_user_id, current_user.id], message.id)
     return jsonify({'success': True, 'message': message.to_dict()})
 
 
+def user_conversations(user_id):
+    """user_id 参与的会话"""
+    return Conversation.query.filter(
+        (Conversation.user_low_id == user_id) | (Conversation.user_high_id == user_id)
+    )
+
+
+def latest_message_id(user_id):
+    """与 user_id 相关（收到或发出）的最新消息 ID，取自各会话冗余的最后一条消息"""
+    return user_conversations(user_id).with_entities(db.func.max(Conversation.last_message_id)).scalar() or 0
+
+
+def unread_summary(user_id):
+    """各会话的未读数：{'total': 总数, 'conversations': {好友 ID: 未读数}}"""
+    unread = {}
+    for conversation in user_conversations(user_id).filter(
+        db.or_(Conversation.low_unread > 0, Conversation.high_unread > 0)
+    ):
+        count = conversation.unread_for(user_id)
+        if count:
+            unread[str(conversation.peer_of(user_id))] = count
+    return {'total': sum(unread.values()), 'conversations': unread}
+
+
+def message_updates(user_id, after_id, limit=100):
+    """after_id 之后与 user_id 相关的新消息（按 ID 正序）和最新未读数
+
+    按用户的各个会话分别沿 (conversation_id, id) 索引读取 after_id 之后的消息 ID 再归并，
+    不在整张留言表上做收件人/发件人的 OR 查询
+    """
+    conversation_ids = [row.id for row in user_conversations(user_id).with_entities(Conversation.id)]
+    ids = [row[0] for row in union_top([
+        db.select(Message.id).where(Message.conversation_id == conversation_id, Message.id > after_id)
+        for conversation_id in conversation_ids
+    ], limit)] if conversation_ids else []
+    messages = message_query().filter(Message.id.in_(ids)).order_by(Message.id.asc()).all() if ids else []
+    return {
+        'messages': [m.to_dict() for m in messages],
+        'unread': unread_summary(user_id),
+        'last_id': messages[-1].id if messages else after_id
+    }
+
+
+def wait_for_messages(user_id, after_id, timeout):
+    """等待新消息；等待前和每次兜底查询后都结束当前事务，等待期间不占用数据库连接"""
+    db.session.rollback()
+    
+    def latest_in_db():
+        try:
+            return latest_message_id(user_id)
+        finally:
+            db.session.rollback()
+    
+    return inbox.wait(user_id, after_id, timeout, latest_in_db)
+
+
+def inbox_after_id():
+    """客户端已收到的最新消息 ID：after_id 参数或 SSE 重连时的 Last-Event-ID，缺省时从当前最新消息开始"""
+    after_id = request.args.get('after_id', type=int)
+    if after_id is None:
+        after_id = request.headers.get('Last-Event-ID', type=int)
+    if after_id is None:
+        after_id = latest_message_id(current_user.id)
+    return after_id
+
+
+@app.route('/api/messages/unread', methods=['GET'])
+@login_required
+def get_unread():
+    """获取各会话的未读数和最新消息 ID"""
+    return jsonify(dict(unread_summary(current_user.id), last_id=latest_message_id(current_user.id)))
+
+
+@app.route('/api/messages/read', methods=['POST'])
+@login_required
+def mark_messages_read():
+    """标记与某个好友的会话已读到 last_id（缺省为最新消息）"""
+    data = request.json or {}
+    friend_id = data.get('friend_id')
+    if not friend_graph.are_friends(current_user.id, friend_id):
+        return jsonify({'error': '不是好友关系'}), 403
+    
+    conversation = find_conversation(current_user.id, friend_id)
+    if conversation:
+        last_id = data.get('last_id')
+        if not isinstance(last_id, int):
+            last_id = conversation.last_message_id or 0
+        mark_conversation_read(conversation, current_user.id, last_id)
+    return jsonify(unread_summary(current_user.id))
+
+
+@app.route('/api/conversations', methods=['GET'])
+@login_required
+def get_conversations():
+    """会话列表：按最后一条消息时间从新到旧，附带对方信息、最后一条消息和未读数
+
+    用户在会话中可能是 low 或 high 一侧，两侧各沿 (user_*_id, last_message_at) 索引有序读取后归并
+    """
+    ids = [row_id for _, row_id in union_top([
+        db.select(Conversation.last_message_at, Conversation.id).where(
+            side == current_user.id, Conversation.last_message_id.isnot(None))
+        for side in (Conversation.user_low_id, Conversation.user_high_id)
+    ], None, descending=True)]
+    loaded = {c.id: c for c in Conversation.query.filter(Conversation.id.in_(ids))} if ids else {}
+    conversations = [loaded[conversation_id] for conversation_id in ids if conversation_id in loaded]
+    peers = {u.id: u for u in User.query.filter(
+        User.id.in_([c.peer_of(current_user.id) for c in conversations])
+    )} if conversations else {}
+    result = []
+    for conversation in conversations:
+        item = conversation.to_dict(current_user.id)
+        peer = peers.get(item['friend_id'])
+        item['friend_name'] = peer.username if peer else None
+        result.append(item)
+    return jsonify(result)
+
+
+@app.route('/api/messages/updates', methods=['GET'])
+@login_required
+def message_long_poll():
+    """长轮询：有 after_id 之后的新消息时立即返回，否则最多等待 timeout 秒后返回空列表"""
+    user_id = current_user.id
+    after_id = inbox_after_id()
+    timeout = max(0, min(request.args.get('timeout', INBOX_LONG_POLL_TIMEOUT, type=int), 55))
+    
+    updates = message_updates(user_id, after_id)
+    if not updates['messages'] and wait_for_messages(user_id, after_id, timeout):
+        updates = message_updates(user_id, after_id)
+    return jsonify(updates)
+
+
+@app.route('/api/messages/stream', methods=['GET'])
+@login_required
+def message_stream():
+    """SSE 推送新消息：message 事件（id 为消息 ID，断线重连时通过 Last-Event-ID 续传）和 unread 未读数"""
+    user_id = current_user.id
+    after_id = inbox_after_id()
+    
+    def events():
+        last_id = after_id
+        deadline = time.monotonic() + INBOX_STREAM_MAX_AGE
+        yield sse_event('unread', unread_summary(user_id))
+        while time.monotonic() < deadline:
+            updates = message_updates(user_id, last_id)
+            for message in updates['messages']:
+                yield f"id: {message['id']}\n" + sse_event('message', message)
+            if updates['messages']:
+                last_id = updates['last_id']
+                yield sse_event('unread', updates['unread'])
+                continue
+            if not wait_for_messages(user_id, last_id, min(15, max(0, deadline - time.monotonic()))):
+                yield sse_event('ping', {})
+    
+    return sse_response(events())
+
+
 # ========== AI 问候和对话 API ==========
 
+def generate_greeting_templates(time_period, goal_text, count):
+    """调用模型生成一组问候语模板（后台线程调用）"""
+    messages = prompts.greeting_messages(time_period, goal_text, count)
+    return parse_templates(call_ai_streaming(get_client(), messages))
+
+
+# 问候语服务（按用户缓存，模板池后台刷新）
+greeting_service = GreetingService(
+    generate=generate_greeting_templates if API_KEY else None,
+    pool_size=int(os.getenv('GREETING_POOL_SIZE', 8)),
+    refresh_interval=int(os.getenv('GREETING_REFRESH_INTERVAL', 6 * 3600))
+)
+
+
 @app.route('/api/greeting', methods=['GET'])
 @login_required
 def get_greeting():
-    """获取 AI 问候语"""
+    """获取 AI 问候语（从缓存和预生成模板中返回，不等待模型）"""
     if not API_KEY:
         return jsonify({'greeting': '欢迎回来！祝您今天饮食健康！'})
     
+    greeting_service.start()
     try:
-        # 获取当前时间段
-        from datetime import datetime
-        hour = datetime.now().hour
-        if 5 <= hour < 11:
-            time_period = "早上"
-        elif 11 <= hour < 14:
-            time_period = "中午"
-        elif 14 <= hour < 18:
-            time_period = "下午"
-        else:
-            time_period = "晚上"
-        
-        # 获取用户目标描述
-        goal_map = {
-            'lose_weight': '减重',
-            'gain_muscle': '增肌',
-            'maintain': '保持规律饮食'
-        }
-        user_goal = goal_map.get(current_user.goal, '保持健康')
-        
-        client = get_client()
-        messages = [
-            {"role": "system", "content": GREETING_PROMPT},
-            {"role": "user", "content": f"当前时间：{time_period}，用户名：{current_user.username}，健康目标：{user_goal}"}
-        ]
-        
-        greeting = call_ai_streaming(client, messages)
-        return jsonify({'greeting': greeting.strip()})
-        
-    except Exception as e:
+        greeting = greeting_service.greeting_for(current_user.id, current_user.username, current_user.goal)
+        return jsonify({'greeting': greeting})
+    except Exception:
         # 降级为默认问候
         return jsonify({'greeting': f'欢迎回来，{current_user.username}！继续坚持您的健康目标！'})
 
 
-@app.route('/api/chat', methods=['POST'])
-@login_required
-def chat():
-    """AI 饮食咨询对话"""
+def weekly_digest(user_id):
+    """获取用户一周饮食摘要（按天缓存，饮食记录变化时失效）"""
+    from datetime import date
+    today = date.today()
+    cached = chat_digest_cache.get(user_id)
+    if cached and cached[0] == today:
+        return cached[1]
+    digest = build_weekly_digest(user_id, CHAT_DIGEST_TOKEN_BUDGET)
+    chat_digest_cache.set(user_id, (today, digest))
+    return digest
+
+
+def build_chat_messages(user, user_message):
+    """构建饮食咨询对话消息（系统提示词固定，用户信息和一周饮食记录放在用户消息中）"""
+    return prompts.chat_messages(user, weekly_digest(user.id), user_message)
+
+
+def finish_chat(ai_response):
+    """整理对话回复，返回 (结果, 错误信息)"""
+    return {'reply': ai_response.strip()}, None
+
+
+def chat_job(stream):
+    """提交饮食咨询任务"""
     data = request.json
     user_message = data.get('message', '').strip()
     
@@ -798,52 +1113,28 @@ def chat():
         return jsonify({'error': '请输入您的问题'}), 400
     
     try:
-        # 准备用户信息
-        goal_map = {
-            'lose_weight': '减重',
-            'gain_muscle': '增肌',
-            'maintain': '保持规律饮食'
-        }
-        gender_map = {'male': '男', 'female': '女'}
-        
-        # 获取一周饮食记录
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        records = MealRecord.query.filter(
-            MealRecord.user_id == current_user.id,
-            MealRecord.created_at >= week_ago
-        ).order_by(MealRecord.created_at.desc()).all()
-        
-        # 格式化饮食记录
-        if records:
-            meal_lines = []
-            for r in records:
-                date_str = r.created_at.strftime('%m月%d日')
-                foods = json.loads(r.foods) if r.foods else []
-                food_names = '、'.join([f['name'] for f in foods]) if foods else '未记录详情'
-                meal_lines.append(f"- {date_str} {r.meal_type}: {food_names} (共{r.total_calories}卡)")
-            meal_history = '\n'.join(meal_lines)
-        else:
-            meal_history = '暂无饮食记录'
-        
-        system_prompt = CHAT_PROMPT.format(
-            gender=gender_map.get(current_user.gender, '未知'),
-            height=current_user.height or '未知',
-            weight=current_user.weight or '未知',
-            goal=goal_map.get(current_user.goal, '保持健康'),
-            meal_history=meal_history
-        )
-        
-        client = get_client()
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ]
-        
-        response = call_ai_streaming(client, messages)
-        return jsonify({'reply': response.strip()})
-        
+        messages = build_chat_messages(current_user, user_message)
     except Exception as e:
         return jsonify({'error': f'对话失败: {str(e)}'}), 500
+    
+    # 去重键包含完整的提示词（用户资料和一周饮食摘要），记录或删除饮食后同样的问题会重新回答
+    context = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return ai_job_response('chat', job_dedupe_key('chat', context), MODEL_NAME, messages,
+                           finish_chat, '对话失败', stream, prompt_key=context, **TEXT_MODEL_OPTIONS)
+
+
+@app.route('/api/chat', methods=['POST'])
+@login_required
+def chat():
+    """AI 饮食咨询对话（后台任务，返回任务 ID）"""
+    return chat_job(stream=False)
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """AI 饮食咨询对话（SSE 流式返回）"""
+    return chat_job(stream=True)
 
 
 # ========== AI 饮食分析 API ==========
@@ -857,156 +1148,370 @@ def api_status():
     })
 
 
-@app.route('/api/analyze-meal', methods=['POST'])
-@login_required
-def analyze_meal():
-    """分析饮食输入"""
+def build_meal_messages(meal_type, description, resolved_foods=None):
+    """构建文字饮食分析消息；resolved_foods 为本地已计算的食物，只需模型分析其余部分"""
+    return prompts.meal_messages(meal_type, description, resolved_foods)
+
+
+def finish_analysis(ai_response, store=None, local=None):
+    """解析饮食分析结果，返回 (结果, 错误信息)
+
+    传入 local 时与本地解析结果合并；传入 store 时交给 store(result) 写入缓存
+    """
+    result = parse_ai_response(ai_response)
+    
+    if not result:
+        return None, 'AI 返回格式错误，请重试'
+    
+    if local is not None:
+        result = merge_with_model(local, result)
+        result['source'] = 'mixed'
+    else:
+        result['source'] = 'model'
+    
+    if store:
+        store(result)
+    result['cached'] = False
+    
+    return with_visualizations(result), None
+
+
+def analysis_cache_store(cache_key, meal_type, description):
+    """文字分析结果的缓存写入回调，只写入通过校验的结果"""
+    def store(result):
+        if validate_analysis_result(result):
+            analysis_cache.set(cache_key, result, meal_type, description)
+        else:
+            analysis_cache.reject()
+    return store
+
+
+def local_analysis_result(local):
+    """本地食物库完整解析的结果"""
+    result = local.to_result()
+    result['source'] = 'local'
+    result['cached'] = False
+    return with_visualizations(result)
+
+
+def build_model_meal_messages(meal_type, description, local):
+    """本地部分解析时只把未识别的片段交给模型，否则分析完整描述"""
+    if local.resolved_any:
+        return build_meal_messages(meal_type, local.unresolved_text, local.foods + [
+            {'name': item['food'], 'quantity': '分量待确认', 'calories': item['options'][1]['calories']}
+            for item in local.ambiguous
+        ])
+    return build_meal_messages(meal_type, description)
+
+
+def with_visualizations(result):
+    """为明确的分析结果补充形象化数据"""
+    if result.get('status') == 'clear':
+        result['visualizations'] = calculate_visualizations(result.get('total_calories', 0))
+    return result
+
+
+def analyze_meal_job(stream):
+    """分析饮食输入：本地食物库和缓存能回答时直接返回，否则提交模型分析任务"""
     data = request.json
     meal_type = data.get('meal_type', '午餐')
     description = data.get('description', '')
     
-    if not API_KEY:
-        return jsonify({'error': '服务器未配置 API Key'}), 500
-    
     if not description:
         return jsonify({'error': '请输入饮食内容'}), 400
     
-    try:
-        client = get_client()
-        user_prompt = f"""餐次类型：{meal_type}
-用户输入的饮食内容：{description}
-
-请分析以上饮食内容，识别所有食物并计算卡路里。如果有描述不明确的食物，请标记为需要澄清。"""
-        
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        ai_response = call_ai_streaming(client, messages)
-        result = parse_ai_response(ai_response)
-        
-        if not result:
-            return jsonify({'error': 'AI 返回格式错误，请重试'}), 500
-        
-        if result.get('status') == 'clear':
-            result['visualizations'] = calculate_visualizations(result.get('total_calories', 0))
-        
+    def immediate(result):
+        if stream:
+            return sse_response(iter([sse_event('result', result)]))
         return jsonify(result)
-        
+    
+    # 本地食物库能完整解析时直接返回，无需调用模型
+    local = nutrition_engine.analyze(description)
+    if local.fully_resolved:
+        return immediate(local_analysis_result(local))
+    
+    try:
+        cache_key = make_analysis_key(description, meal_type, ANALYSIS_PROMPT_VERSION)
+        cached = analysis_cache.get(cache_key)
+        if cached:
+            cached['cached'] = True
+            return immediate(with_visualizations(cached))
     except Exception as e:
         return jsonify({'error': f'分析失败: {str(e)}'}), 500
+    
+    # 本地和缓存都无法回答时才需要模型
+    if not API_KEY:
+        return jsonify({'error': '服务器未配置 API Key'}), 500
+    
+    messages = build_model_meal_messages(meal_type, description, local)
+    finish = partial(finish_analysis, store=analysis_cache_store(cache_key, meal_type, description),
+                     local=local if local.resolved_any else None)
+    return ai_job_response('analyze', job_dedupe_key('analyze', cache_key), MODEL_NAME, messages,
+                           finish, '分析失败', stream, prompt_key=cache_key, **TEXT_MODEL_OPTIONS)
+
+
+@app.route('/api/analyze-meal', methods=['POST'])
+@login_required
+def analyze_meal():
+    """分析饮食输入（需要模型时返回任务 ID）"""
+    return analyze_meal_job(stream=False)
+
+
+@app.route('/api/analyze-meal/stream', methods=['POST'])
+@login_required
+def analyze_meal_stream():
+    """分析饮食输入（SSE 流式返回）"""
+    return analyze_meal_job(stream=True)
+
+
+def confirmed_food(name, quantity, values):
+    """澄清后的单个食物条目，保留已知的营养数据"""
+    food = {'name': name, 'quantity': quantity}
+    for key in NUTRIENTS:
+        if values.get(key) is not None:
+            food[key] = float(values[key]) if key != 'calories' else int(values[key])
+    return food
+
+
+def rule_based_advice(foods):
+    """规则评分：返回 (健康评分, 饮食建议)"""
+    return score_meal(foods, nutrition_engine.categories(foods))
 
 
 @app.route('/api/confirm-clarification', methods=['POST'])
 @login_required
 def confirm_clarification():
-    """确认澄清后计算最终结果"""
+    """确认澄清后计算最终结果（本地计算，不调用模型）"""
     data = request.json
-    meal_type = data.get('meal_type', '午餐')
     clear_foods = data.get('clear_foods', [])
     clarified_items = data.get('clarified_items', [])
     
-    if not API_KEY:
-        return jsonify({'error': '服务器未配置 API Key'}), 500
-    
     try:
-        client = get_client()
-        
-        all_foods = []
-        for food in clear_foods:
-            all_foods.append(f"{food['name']} {food['quantity']} ({food['calories']}卡)")
-        for item in clarified_items:
-            all_foods.append(f"{item['food']} {item['selected_label']} ({item['calories']}卡)")
-        
-        foods_text = "\n".join(all_foods)
-        user_prompt = f"""餐次类型：{meal_type}
-用户的完整饮食内容（已确认分量）：
-{foods_text}
-
-请计算总卡路里并给出饮食建议。直接返回 clear 状态的 JSON 结果。"""
-        
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        ai_response = call_ai_streaming(client, messages)
-        result = parse_ai_response(ai_response)
-        
-        if not result:
-            total_calories = sum(f['calories'] for f in clear_foods)
-            total_calories += sum(item['calories'] for item in clarified_items)
-            
-            foods = [{"name": f['name'], "quantity": f['quantity'], "calories": f['calories']} for f in clear_foods]
-            foods.extend([{"name": item['food'], "quantity": item['selected_label'], "calories": item['calories']} for item in clarified_items])
-            
-            result = {
-                "status": "clear",
-                "foods": foods,
-                "total_calories": total_calories,
-                "dietary_advice": "请保持均衡饮食，适量摄入蛋白质、碳水化合物和蔬菜。",
-                "health_score": 70
-            }
-        
-        if result.get('status') == 'clear':
-            result['visualizations'] = calculate_visualizations(result.get('total_calories', 0))
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        return jsonify({'error': f'计算失败: {str(e)}'}), 500
+        foods = [confirmed_food(f['name'], f['quantity'], f) for f in clear_foods]
+        foods.extend(confirmed_food(item['food'], item['selected_label'], item) for item in clarified_items)
+        total_calories = sum(f.get('calories', 0) for f in foods)
+        health_score, dietary_advice = rule_based_advice(foods)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'计算失败: {str(e)}'}), 400
+    
+    result = {
+        "status": "clear",
+        "foods": foods,
+        "total_calories": total_calories,
+        "dietary_advice": dietary_advice,
+        "health_score": health_score,
+        "advice_source": "rule",
+        # 配置了 API Key 时，前端可再调用 /api/meal-advice 获取模型建议
+        "advice_refinable": bool(API_KEY)
+    }
+    return jsonify(with_visualizations(result))
 
 
-@app.route('/api/analyze-meal-vision', methods=['POST'])
+def advice_cache_key(meal_type, foods):
+    """饮食建议缓存键：餐次 + 食物名称和分量"""
+    items = [[f.get('name', ''), f.get('quantity', ''), f.get('calories', 0)] for f in foods]
+    # 按字符串排序：同名食物的热量可能为 None，不能直接比较
+    canonical = json.dumps([meal_type, sorted(items, key=lambda item: [str(v) for v in item])], ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+@app.route('/api/meal-advice', methods=['POST'])
 @login_required
-def analyze_meal_vision():
-    """通过图片分析饮食"""
+def meal_advice():
+    """根据已确定的食物生成饮食建议和健康评分（短提示词，结果缓存；需要模型时返回任务 ID）"""
     data = request.json
     meal_type = data.get('meal_type', '午餐')
-    image_base64 = data.get('image', '')
-
+    foods = data.get('foods', [])
+    
+    if not foods:
+        return jsonify({'error': '缺少食物数据'}), 400
+    
+    cache_key = advice_cache_key(meal_type, foods)
+    cached = advice_cache.get(cache_key)
+    if cached:
+        return jsonify(dict(cached, cached=True))
+    
+    health_score, dietary_advice = rule_based_advice(foods)
+    fallback = {'dietary_advice': dietary_advice, 'health_score': health_score, 'advice_source': 'rule'}
     if not API_KEY:
-        return jsonify({'error': '服务器未配置 API Key'}), 500
+        return jsonify(dict(fallback, cached=False))
+    
+    finish = partial(finish_advice, cache_key=cache_key, fallback=fallback)
+    return ai_job_response('advice', job_dedupe_key('advice', cache_key), MODEL_NAME,
+                           prompts.advice_messages(meal_type, foods), finish, '生成建议失败',
+                           prompt_key=cache_key, **TEXT_MODEL_OPTIONS)
+
+
+def finish_advice(ai_response, cache_key, fallback):
+    """解析模型返回的建议和评分，格式不对时使用规则评分（不写入缓存）"""
+    parsed = parse_ai_response(ai_response)
+    if not isinstance(parsed, dict) or not parsed.get('dietary_advice') or not _is_number(parsed.get('health_score')):
+        return dict(fallback, cached=False), None
+    
+    result = {
+        'dietary_advice': str(parsed['dietary_advice']),
+        'health_score': max(0, min(100, int(parsed['health_score']))),
+        'advice_source': 'model'
+    }
+    advice_cache.set(cache_key, result)
+    return dict(result, cached=False), None
 
-    if not image_base64:
-        return jsonify({'error': '请上传食物图片'}), 400
 
+def decode_image(image_base64):
+    """解码并校验 base64 图片，返回 (图片字节, 错误信息)"""
+    if not image_base64:
+        return None, '请上传食物图片'
+    
     # 验证图像大小
     try:
         image_data = base64.b64decode(image_base64)
         if len(image_data) > MAX_IMAGE_SIZE:
-            return jsonify({'error': '图片过大，请压缩后重试（最大4MB）'}), 400
+            return None, '图片过大，请压缩后重试（最大4MB）'
     except Exception:
-        return jsonify({'error': '图片数据无效'}), 400
+        return None, '图片数据无效'
+    return image_data, None
+
 
+def read_upload_image():
+    """读取 multipart 上传的图片文件（表单字段 image），返回 (图片字节, 错误信息)
+
+    请求体大小由 MAX_CONTENT_LENGTH 在读取过程中限制（超出时解析表单即中止）；文件内容由 werkzeug 流式写入临时文件
+    """
     try:
-        client = get_client()
+        file = request.files.get('image')
+    except RequestEntityTooLarge:
+        return None, '图片过大，请选择小于10MB的图片'
+    if file is None or not file.filename:
+        return None, '请上传食物图片'
+    image_data = file.stream.read(MAX_UPLOAD_SIZE + 1)
+    if not image_data:
+        return None, '请上传食物图片'
+    if len(image_data) > MAX_UPLOAD_SIZE:
+        return None, '图片过大，请选择小于10MB的图片'
+    return image_data, None
+
+
+def vision_cache_store(user_id, image_hash):
+    """图片分析结果的缓存写入回调，只写入通过校验的结果"""
+    def store(result):
+        if validate_analysis_result(result):
+            vision_cache.set(user_id, image_hash, VISION_PROMPT_VERSION, result)
+        else:
+            vision_cache.reject()
+    return store
 
-        messages = [
-            {"role": "system", "content": VISION_SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": f"请分析这张{meal_type}的食物照片，识别所有食物并计算卡路里。"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-                ]
-            }
-        ]
 
-        ai_response = call_vision_ai_streaming(client, messages)
-        result = parse_ai_response(ai_response)
+def lookup_vision_cache(user_id, image_hash):
+    """查找相似图片的缓存结果，未命中返回 None"""
+    if image_hash is None:
+        return None
+    cached, distance = vision_cache.get(user_id, image_hash, VISION_PROMPT_VERSION)
+    if cached is None:
+        return None
+    cached['cached'] = True
+    cached['cache_distance'] = distance
+    return with_visualizations(cached)
 
-        if not result:
-            return jsonify({'error': 'AI 返回格式错误，请重试'}), 500
 
-        if result.get('status') == 'clear':
-            result['visualizations'] = calculate_visualizations(result.get('total_calories', 0))
+def build_vision_messages(meal_type, image_base64):
+    """构建图片饮食分析消息"""
+    return prompts.vision_messages(meal_type, image_base64)
 
-        return jsonify(result)
 
-    except Exception as e:
-        return jsonify({'error': f'图片分析失败: {str(e)}'}), 500
+def vision_job(meal_type, image_data, stream):
+    """归一化图片后分析饮食：相似图片命中缓存时直接返回，否则提交模型分析任务"""
+    try:
+        image_data, _, _ = normalize_image(image_data, VISION_MAX_EDGE, VISION_MAX_JPEG_BYTES)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    image_hash = dhash(image_data)
+    cached = lookup_vision_cache(current_user.id, image_hash)
+    if cached:
+        if stream:
+            return sse_response(iter([sse_event('result', cached)]))
+        return jsonify(cached)
+
+    image_base64 = base64.b64encode(image_data).decode('ascii')
+    messages = build_vision_messages(meal_type, image_base64)
+    store = vision_cache_store(current_user.id, image_hash) if image_hash is not None else None
+    dedupe_key = job_dedupe_key('vision', meal_type, hashlib.sha256(image_data).hexdigest())
+    return ai_job_response('vision', dedupe_key, VL_MODEL_NAME, messages,
+                           partial(finish_analysis, store=store), '图片分析失败', stream, prompt_key=dedupe_key)
+
+
+def analyze_meal_vision_job(stream):
+    """通过 base64 图片（JSON）分析饮食"""
+    data = request.json
+    meal_type = data.get('meal_type', '午餐')
+
+    if not API_KEY:
+        return jsonify({'error': '服务器未配置 API Key'}), 500
+
+    image_data, error = decode_image(data.get('image', ''))
+    if error:
+        return jsonify({'error': error}), 400
+    return vision_job(meal_type, image_data, stream)
+
+
+def upload_meal_vision_job(stream):
+    """通过 multipart 上传的图片分析饮食"""
+    if not API_KEY:
+        return jsonify({'error': '服务器未配置 API Key'}), 500
+
+    image_data, error = read_upload_image()
+    if error:
+        return jsonify({'error': error}), 400
+    return vision_job(request.form.get('meal_type', '午餐'), image_data, stream)
+
+
+@app.route('/api/analyze-meal-vision', methods=['POST'])
+@login_required
+def analyze_meal_vision():
+    """通过图片分析饮食（需要模型时返回任务 ID）"""
+    return analyze_meal_vision_job(stream=False)
+
+
+@app.route('/api/analyze-meal-vision/stream', methods=['POST'])
+@login_required
+def analyze_meal_vision_stream():
+    """通过图片分析饮食（SSE 流式返回）"""
+    return analyze_meal_vision_job(stream=True)
+
+
+@app.route('/api/analyze-meal-vision/upload', methods=['POST'])
+@login_required
+def upload_meal_vision():
+    """上传图片文件分析饮食（multipart/form-data，需要模型时返回任务 ID）"""
+    return upload_meal_vision_job(stream=False)
+
+
+@app.route('/api/analyze-meal-vision/upload/stream', methods=['POST'])
+@login_required
+def upload_meal_vision_stream():
+    """上传图片文件分析饮食（multipart/form-data，SSE 流式返回）"""
+    return upload_meal_vision_job(stream=True)
+
+
+# ========== AI 任务 API ==========
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """查询 AI 任务状态（轮询），执行中时附带已生成的文本"""
+    job = job_queue.get(job_id, current_user.id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@login_required
+def job_event_stream(job_id):
+    """订阅 AI 任务进度（SSE）"""
+    if not job_queue.get(job_id, current_user.id):
+        return jsonify({'error': '任务不存在'}), 404
+    return sse_response(job_events(job_id))
 
 
 # ========== 饮食点赞/点踩 API ==========
@@ -1031,24 +1536,25 @@ def react_to_meal(meal_id):
         return jsonify({'error': '不能给自己的饮食点赞'}), 400
     
     # 检查是否为好友关系
-    friendship = Friendship.query.filter_by(user_id=current_user.id, friend_id=meal.user_id).first()
-    if not friendship:
+    if not friend_graph.are_friends(current_user.id, meal.user_id):
         return jsonify({'error': '只能给好友的饮食点赞'}), 403
     
     # 查找现有的反应
     existing = MealReaction.query.filter_by(user_id=current_user.id, meal_id=meal_id).first()
     
+    # 反应记录与计数列在同一事务中更新
     if existing:
         if existing.reaction_type == reaction_type:
             # 取消反应
             db.session.delete(existing)
-            db.session.commit()
-            return jsonify({'success': True, 'action': 'removed', 'type': reaction_type})
+            adjust_reaction_counts(meal_id, reaction_type, -1)
+            action, my_reaction = 'removed', None
         else:
             # 切换反应类型
+            adjust_reaction_counts(meal_id, existing.reaction_type, -1)
+            adjust_reaction_counts(meal_id, reaction_type, 1)
             existing.reaction_type = reaction_type
-            db.session.commit()
-            return jsonify({'success': True, 'action': 'switched', 'type': reaction_type})
+            action, my_reaction = 'switched', reaction_type
     else:
         # 新增反应
         reaction = MealReaction(
@@ -1057,8 +1563,20 @@ def react_to_meal(meal_id):
             reaction_type=reaction_type
         )
         db.session.add(reaction)
-        db.session.commit()
-        return jsonify({'success': True, 'action': 'added', 'type': reaction_type})
+        adjust_reaction_counts(meal_id, reaction_type, 1)
+        action, my_reaction = 'added', reaction_type
+    db.session.commit()
+    feed_cache.pop(current_user.id)
+    
+    db.session.refresh(meal)
+    return jsonify({
+        'success': True,
+        'action': action,
+        'type': reaction_type,
+        'likes': meal.like_count,
+        'dislikes': meal.dislike_count,
+        'my_reaction': my_reaction
+    })
 
 
 @app.route('/api/meals/<int:meal_id>/reactions', methods=['GET'])
@@ -1069,15 +1587,12 @@ def get_meal_reactions(meal_id):
     if not meal:
         return jsonify({'error': '记录不存在'}), 404
     
-    likes = MealReaction.query.filter_by(meal_id=meal_id, reaction_type='like').count()
-    dislikes = MealReaction.query.filter_by(meal_id=meal_id, reaction_type='dislike').count()
-    
     # 获取当前用户的反应
     my_reaction = MealReaction.query.filter_by(user_id=current_user.id, meal_id=meal_id).first()
     
     return jsonify({
-        'likes': likes,
-        'dislikes': dislikes,
+        'likes': meal.like_count,
+        'dislikes': meal.dislike_count,
         'my_reaction': my_reaction.reaction_type if my_reaction else None
     })
 
@@ -1121,85 +1636,131 @@ def submit_ai_feedback():
 @app.route('/api/admin/stats', methods=['GET'])
 @login_required
 def admin_stats():
-    """获取管理员统计数据"""
+    """获取管理员统计数据（缓存快照，含近 30 天每日新增）"""
     if current_user.username.lower() != 'admin':
         return jsonify({'error': '无权限'}), 403
     
-    # 用户统计
-    total_users = User.query.count()
-    today = datetime.utcnow().date()
-    today_start = datetime.combine(today, datetime.min.time())
-    new_users_today = User.query.filter(User.created_at >= today_start).count()
-    
-    # 饮食记录统计
-    total_meals = MealRecord.query.count()
-    meals_today = MealRecord.query.filter(MealRecord.created_at >= today_start).count()
-    
-    # AI反馈统计
-    total_feedbacks = AIFeedback.query.count()
-    likes = AIFeedback.query.filter_by(feedback_type='like').count()
-    dislikes = AIFeedback.query.filter_by(feedback_type='dislike').count()
-    
-    # 留言统计
-    total_messages = Message.query.count()
-    
-    return jsonify({
-        'users': {
-            'total': total_users,
-            'today': new_users_today
-        },
-        'meals': {
-            'total': total_meals,
-            'today': meals_today
-        },
-        'ai_feedbacks': {
-            'total': total_feedbacks,
-            'likes': likes,
-            'dislikes': dislikes
-        },
-        'messages': {
-            'total': total_messages
-        }
-    })
+    return jsonify(admin_stats_snapshot.get())
 
 
 @app.route('/api/admin/users', methods=['GET'])
 @login_required
 def admin_users():
-    """获取用户列表"""
+    """分页获取用户列表"""
     if current_user.username.lower() != 'admin':
         return jsonify({'error': '无权限'}), 403
     
-    users = User.query.order_by(User.created_at.desc()).limit(100).all()
+    try:
+        users, next_cursor = keyset_page(User.query, User, request.args.get('cursor'),
+                                         page_size(request.args.get('limit', type=int), ADMIN_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # 本页用户的饮食记录数（一次分组查询）
+    meal_counts = {}
+    if users:
+        meal_counts = dict(db.session.query(MealRecord.user_id, db.func.count(MealRecord.id)).filter(
+            MealRecord.user_id.in_([u.id for u in users])
+        ).group_by(MealRecord.user_id).all())
     result = []
     for user in users:
-        meal_count = MealRecord.query.filter_by(user_id=user.id).count()
         result.append({
             'id': user.id,
             'username': user.username,
             'goal': user.goal,
-            'meal_count': meal_count,
+            'meal_count': meal_counts.get(user.id, 0),
             'created_at': user.created_at.strftime('%Y-%m-%d %H:%M')
         })
     
-    return jsonify(result)
+    return page_response(result, next_cursor)
 
 
 @app.route('/api/admin/feedbacks', methods=['GET'])
 @login_required
 def admin_feedbacks():
-    """获取 AI 反馈列表"""
+    """分页获取 AI 反馈列表"""
     if current_user.username.lower() != 'admin':
         return jsonify({'error': '无权限'}), 403
     
-    feedbacks = AIFeedback.query.order_by(AIFeedback.created_at.desc()).limit(100).all()
-    return jsonify([f.to_dict() for f in feedbacks])
+    try:
+        feedbacks, next_cursor = keyset_page(
+            AIFeedback.query.options(db.joinedload(AIFeedback.user)), AIFeedback, request.args.get('cursor'),
+            page_size(request.args.get('limit', type=int), ADMIN_PAGE_SIZE)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return page_response([f.to_dict() for f in feedbacks], next_cursor)
+
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@login_required
+def admin_cache_stats():
+    """获取 AI 缓存命中统计"""
+    if current_user.username.lower() != 'admin':
+        return jsonify({'error': '无权限'}), 403
+    
+    return jsonify({
+        'analysis': analysis_cache.stats(),
+        'vision': vision_cache.stats(),
+        'greeting': greeting_service.stats(),
+        'jobs': job_queue.stats(),
+        'coalescing': ai_coalescer.stats(),
+        'friends': friend_graph.stats(),
+        'admin_stats': admin_stats_snapshot.stats(),
+        'prompts': {'versions': PROMPT_VERSIONS, 'prefixes': prompts.prefix_stats()}
+    })
 
 
 # ========== 初始化数据库 ==========
 
 with app.app_context():
-    db.create_all()
+    migrations.upgrade()
+    job_queue.recover()
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """执行未执行的数据库迁移"""
+    applied = migrations.upgrade()
+    print(f"已执行迁移: {applied}" if applied else "数据库已是最新版本")
+
+
+@app.cli.command('db-status')
+def db_status_command():
+    """查看数据库迁移状态"""
+    for version, name, done in migrations.status():
+        print(f"{'✓' if done else ' '} {version:04d} {name}")
+
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    """打印热点查询的 EXPLAIN QUERY PLAN，存在全表扫描或临时排序时以非零状态退出"""
+    problems = []
+    for name, plan, problem in migrations.explain_hot_queries():
+        print(f"[{problem or 'OK'}] {name}")
+        for step in plan:
+            print(f"    {step}")
+        if problem:
+            problems.append(f'{name}（{problem}）')
+    if problems:
+        raise SystemExit(f"存在问题查询: {'、'.join(problems)}")
+
+
+@app.cli.command('backfill-meal-foods')
+def backfill_meal_foods_command():
+    """为旧饮食记录补写 meal_foods 明细行"""
+    print(f"已处理 {backfill_meal_foods()} 条饮食记录")
+
+
+@app.cli.command('rebuild-nutrition-summary')
+def rebuild_nutrition_summary_command():
+    """根据饮食记录重建每日营养汇总表"""
+    print(f"已重建 {rebuild_daily_summaries()} 天的营养汇总")
+
+
+@app.cli.command('repair-reaction-counts')
+def repair_reaction_counts_command():
+    """根据点赞记录重新计算饮食记录的点赞/点踩计数"""
+    print(f"已修正 {repair_reaction_counts()} 条饮食记录的计数")
 
 
 if __name__ == '__main__':
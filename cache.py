@@ -0,0 +1,313 @@
+"""
+缓存工具：内存 LRU 缓存、饮食分析结果缓存与图片分析缓存
+"""
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, AnalysisCacheEntry
+from image_utils import hamming_distance
+
+
+class LRUCache:
+    """线程安全的内存 LRU 缓存，支持 TTL 过期"""
+
+    def __init__(self, max_size=512, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """返回未过期条目的快照（按最近使用从旧到新）"""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (v, exp) in self._data.items() if exp is None or exp >= now]
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ========== 饮食描述归一化 ==========
+
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4,
+              '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CN_UNITS = {'十': 10, '百': 100, '千': 1000}
+_MEASURE_WORDS = '碗个杯根份片块盘勺串只条瓶袋盒克斤罐听包粒颗张'
+
+_CN_NUMBER_RE = re.compile(
+    r'([零〇一二两三四五六七八九十百千]+|半)(?=[' + _MEASURE_WORDS + r']|g|ml|毫升)'
+)
+_ARABIC_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+_QUANTITY_ONLY_RE = re.compile(r'^\d+(?:\.\d+)?(?:[' + _MEASURE_WORDS + r']|g|ml|毫升)?$')
+
+
+def chinese_to_number(text):
+    """中文数字转数值，如 两→2、十二→12、一百零五→105、半→0.5"""
+    if text == '半':
+        return 0.5
+    total, current = 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            current = _CN_DIGITS[ch]
+        else:
+            total += (current or 1) * _CN_UNITS[ch]
+            current = 0
+    return total + current
+
+
+def _format_number(value):
+    value = float(value)
+    return str(int(value)) if value == int(value) else f'{value:g}'
+
+
+def _is_separator(ch):
+    category = unicodedata.category(ch)
+    return category[0] in ('P', 'Z') or category in ('Sm', 'Sk', 'So') or ch.isspace()
+
+
+def normalize_description(text):
+    """归一化饮食描述：全角转半角、统一数字、去除空白和标点，食物片段排序"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = _CN_NUMBER_RE.sub(lambda m: _format_number(chinese_to_number(m.group(1))), text)
+    text = _ARABIC_NUMBER_RE.sub(lambda m: _format_number(m.group()), text)
+
+    segments, current = [], []
+    for i, ch in enumerate(text):
+        # 保留小数点，其余标点和空白均视为分隔符
+        is_decimal_point = ch == '.' and 0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit()
+        if _is_separator(ch) and not is_decimal_point:
+            if current:
+                segments.append(''.join(current))
+                current = []
+        else:
+            current.append(ch)
+    if current:
+        segments.append(''.join(current))
+
+    # "1碗 米饭" 中只有数量的片段并入下一个片段
+    merged, pending = [], ''
+    for segment in segments:
+        if _QUANTITY_ONLY_RE.match(segment):
+            pending += segment
+        else:
+            merged.append(pending + segment)
+            pending = ''
+    if pending:
+        merged.append(pending)
+    return '|'.join(sorted(merged))
+
+
+def prompt_version(*parts):
+    """根据提示词和模型名生成版本号，提示词变更后旧缓存自动失效"""
+    digest = hashlib.sha256('\x00'.join(parts).encode('utf-8')).hexdigest()
+    return digest[:12]
+
+
+def make_analysis_key(description, meal_type, version):
+    """生成饮食分析缓存键"""
+    raw = '\x00'.join([version, meal_type or '', normalize_description(description)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# ========== 饮食分析结果缓存 ==========
+
+class AnalysisCache:
+    """饮食分析结果缓存：内存 LRU + SQLite 持久化，按 TTL 和条数淘汰"""
+
+    def __init__(self, memory_size=512, ttl=7 * 24 * 3600, max_rows=5000, prune_every=50):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self.memory = LRUCache(memory_size, ttl)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0, 'rejected': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        """读取缓存结果（返回副本），未命中返回 None"""
+        result = self.memory.get(key)
+        if result is not None:
+            self._count('memory_hits')
+            return json.loads(result)
+
+        entry = AnalysisCacheEntry.query.get(key)
+        if entry and entry.created_at >= datetime.utcnow() - timedelta(seconds=self.ttl):
+            entry.hit_count = (entry.hit_count or 0) + 1
+            entry.last_used_at = datetime.utcnow()
+            db.session.commit()
+            self.memory.set(key, entry.result)
+            self._count('db_hits')
+            return json.loads(entry.result)
+
+        self._count('misses')
+        return None
+
+    def set(self, key, result, meal_type='', description=''):
+        """写入缓存"""
+        payload = json.dumps(result, ensure_ascii=False)
+        self.memory.set(key, payload)
+
+        now = datetime.utcnow()
+        entry = AnalysisCacheEntry.query.get(key)
+        if entry is None:
+            db.session.add(AnalysisCacheEntry(
+                key=key,
+                meal_type=meal_type,
+                description=normalize_description(description),
+                result=payload,
+                created_at=now,
+                last_used_at=now
+            ))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # 合并的并发请求可能同时写入同一个键，改为更新
+                db.session.rollback()
+                entry = AnalysisCacheEntry.query.get(key)
+        if entry is not None:
+            entry.result = payload
+            entry.created_at = now
+            entry.last_used_at = now
+            db.session.commit()
+        self._count('stores')
+
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % self.prune_every == 0
+        if should_prune:
+            self.prune()
+
+    def reject(self):
+        """记录一次因校验失败未写入的结果"""
+        self._count('rejected')
+
+    def prune(self):
+        """删除过期条目，并按最近使用时间裁剪到 max_rows 条"""
+        expire_before = datetime.utcnow() - timedelta(seconds=self.ttl)
+        AnalysisCacheEntry.query.filter(AnalysisCacheEntry.created_at < expire_before)\
+            .delete(synchronize_session=False)
+
+        overflow = AnalysisCacheEntry.query.count() - self.max_rows
+        if overflow > 0:
+            stale_keys = [row.key for row in AnalysisCacheEntry.query.with_entities(AnalysisCacheEntry.key)
+                          .order_by(AnalysisCacheEntry.last_used_at.asc()).limit(overflow)]
+            AnalysisCacheEntry.query.filter(AnalysisCacheEntry.key.in_(stale_keys))\
+                .delete(synchronize_session=False)
+        db.session.commit()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['memory_hits'] + counters['db_hits'] + counters['misses']
+        hits = counters['memory_hits'] + counters['db_hits']
+        counters['hit_rate'] = round(hits / lookups, 3) if lookups else 0.0
+        counters['memory_entries'] = len(self.memory)
+        counters['memory_evictions'] = self.memory.evictions
+        return counters
+
+
+# ========== 图片分析缓存 ==========
+
+class ImageAnalysisCache:
+    """按用户隔离的图片分析缓存：感知哈希汉明距离不超过阈值即视为同一张图"""
+
+    def __init__(self, per_user_size=20, max_users=1000, ttl=24 * 3600, threshold=6):
+        self.per_user_size = per_user_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.users = LRUCache(max_users)
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'rejected': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _user_cache(self, user_id, create=False):
+        with self._lock:
+            cache = self.users.get(user_id)
+            if cache is None and create:
+                cache = LRUCache(self.per_user_size, self.ttl)
+                self.users.set(user_id, cache)
+            return cache
+
+    def get(self, user_id, image_hash, version):
+        """查找最相近的缓存结果，返回 (结果副本, 汉明距离)，未命中返回 (None, None)"""
+        cache = self._user_cache(user_id)
+        best_key, best_distance = None, None
+        if cache is not None:
+            for (cached_version, cached_hash), _ in cache.items():
+                if cached_version != version:
+                    continue
+                distance = hamming_distance(image_hash, cached_hash)
+                if distance <= self.threshold and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = (cached_version, cached_hash), distance
+
+        if best_key is not None:
+            payload = cache.get(best_key)
+            if payload is not None:
+                self._count('hits')
+                return json.loads(payload), best_distance
+
+        self._count('misses')
+        return None, None
+
+    def set(self, user_id, image_hash, version, result):
+        self._user_cache(user_id, create=True).set((version, image_hash), json.dumps(result, ensure_ascii=False))
+        self._count('stores')
+
+    def reject(self):
+        """记录一次因校验失败未写入的结果"""
+        self._count('rejected')
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = round(counters['hits'] / lookups, 3) if lookups else 0.0
+        counters['users'] = len(self.users)
+        return counters
@@ -0,0 +1,109 @@
+"""
+数据库连接配置：按 DATABASE_URL 选择 SQLite 或服务器数据库（PostgreSQL 等），并应用对应的调优参数
+
+SQLite：每个连接建立时设置 WAL、busy_timeout、synchronous=NORMAL 和 mmap_size，
+多个进程并发写入时等待锁而不是立即报 "database is locked"。
+服务器数据库：使用连接池，开启 pre-ping 并定期回收连接，避免使用已被服务端断开的连接。
+"""
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不支持文件锁，单进程运行时无需加锁
+    fcntl = None
+
+DEFAULT_DATABASE_URL = 'sqlite:///diet_assistant.db'
+
+# PostgreSQL 咨询锁的键（数据库迁移）
+MIGRATION_LOCK_KEY = 0x64696574
+
+
+def database_url():
+    """读取 DATABASE_URL；兼容部分平台提供的 postgres:// 写法"""
+    url = os.getenv('DATABASE_URL', '').strip() or DEFAULT_DATABASE_URL
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def sqlite_pragmas():
+    """SQLite 连接级 PRAGMA（按执行顺序）"""
+    return [
+        ('journal_mode', 'WAL'),
+        ('busy_timeout', int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))),
+        ('synchronous', os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('mmap_size', int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))),
+    ]
+
+
+def server_engine_options():
+    """服务器数据库的连接池参数"""
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    # 只处理 SQLite 连接（监听器注册在 Engine 类上）
+    if type(dbapi_connection).__module__.split('.')[0] not in ('sqlite3', 'pysqlite2'):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in sqlite_pragmas():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def configure(app):
+    """根据环境变量设置 SQLALCHEMY_DATABASE_URI 和 SQLALCHEMY_ENGINE_OPTIONS，在 db.init_app 之前调用"""
+    url = database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    if url.startswith('sqlite'):
+        # sqlite3 驱动自身的锁等待与 busy_timeout 保持一致
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'connect_args': {'timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)) / 1000}
+        }
+        if not event.contains(Engine, 'connect', _apply_sqlite_pragmas):
+            event.listen(Engine, 'connect', _apply_sqlite_pragmas)
+    else:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = server_engine_options()
+    return url
+
+
+@contextmanager
+def migration_lock(engine):
+    """跨进程互斥执行迁移：多个 worker 同时启动时只有一个在建表和执行迁移，其余等待后跳过已执行的版本
+
+    SQLite 使用数据库文件旁的文件锁，PostgreSQL 使用咨询锁，其他数据库不加锁
+    """
+    if engine.dialect.name == 'sqlite':
+        path = engine.url.database
+        if fcntl is None or not path or path == ':memory:':
+            yield
+            return
+        with open(path + '.migrate.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    elif engine.dialect.name == 'postgresql':
+        with engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            conn.commit()
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+                conn.commit()
+    else:
+        yield
@@ -0,0 +1,95 @@
+"""
+一周饮食摘要：每日汇总、营养素日均值和常吃食物，按 token 预算裁剪后放入对话提示词
+"""
+import math
+from datetime import date, datetime, timedelta, timezone
+
+from models import db, MealFood, DailyNutritionSummary
+
+NO_RECORDS = '暂无饮食记录'
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文字符按 1 个计，其余字符按每 4 个 1 个计"""
+    cjk = sum(1 for ch in text if '\u4e00' <= ch <= '\u9fff')
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _local_day_start_utc(day):
+    """本地日期零点对应的 UTC 时间（饮食记录以 UTC 存储）"""
+    return datetime.combine(day, datetime.min.time()).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _macros_text(protein, fat, carbs, fiber=None):
+    text = f"蛋白质{protein:.0f}g 脂肪{fat:.0f}g 碳水{carbs:.0f}g"
+    if fiber is not None:
+        text += f" 膳食纤维{fiber:.0f}g"
+    return text
+
+
+def build_weekly_digest(user_id, token_budget=300, days=7, top_n=8):
+    """生成最近 days 天的饮食摘要，估算 token 数不超过 token_budget（总览行除外）
+
+    优先保留总览和营养素均值，其次是常吃食物，剩余预算按从近到远放入每日明细
+    """
+    start = date.today() - timedelta(days=days - 1)
+    summaries = DailyNutritionSummary.query.filter(
+        DailyNutritionSummary.user_id == user_id,
+        DailyNutritionSummary.local_date >= start
+    ).order_by(DailyNutritionSummary.local_date.desc()).all()
+    if not summaries:
+        return NO_RECORDS
+
+    logged_days = len(summaries)
+    meal_count = sum(s.meal_count for s in summaries)
+    avg_calories = round(sum(s.total_calories for s in summaries) / logged_days)
+    # 总览行始终保留，其余各行放不下时省略
+    lines = [f"- 近{days}天记录了{logged_days}天、共{meal_count}餐，日均{avg_calories}卡"]
+    used = estimate_tokens(lines[0])
+
+    with_macros = [s for s in summaries if s.nutrient_items > 0]
+    if with_macros:
+        n = len(with_macros)
+        macros_line = f"- 日均营养素（{n}天有数据）：" + _macros_text(
+            sum(s.protein for s in with_macros) / n,
+            sum(s.fat for s in with_macros) / n,
+            sum(s.carbs for s in with_macros) / n,
+            sum(s.fiber for s in with_macros) / n
+        )
+        if used + estimate_tokens(macros_line) <= token_budget:
+            lines.append(macros_line)
+            used += estimate_tokens(macros_line)
+
+    top_foods = db.session.query(MealFood.name, db.func.count(MealFood.id).label('times')).filter(
+        MealFood.user_id == user_id,
+        MealFood.created_at >= _local_day_start_utc(start)
+    ).group_by(MealFood.name).order_by(db.text('times DESC')).limit(top_n).all()
+    # 常吃食物按预算逐个放入
+    foods_line = ''
+    for name, times in top_foods:
+        item = f"{name}×{times}"
+        candidate = f"{foods_line}、{item}" if foods_line else f"- 常吃食物：{item}"
+        if used + estimate_tokens(candidate) > token_budget:
+            break
+        foods_line = candidate
+    if foods_line:
+        lines.append(foods_line)
+        used += estimate_tokens(foods_line)
+
+    # 每日明细从近到远放入，放不下的天数汇总为一行
+    omitted = 0
+    for s in summaries:
+        line = f"- {s.local_date.month}月{s.local_date.day}日：{s.meal_count}餐 {s.total_calories}卡"
+        if s.nutrient_items > 0:
+            line += "，" + _macros_text(s.protein, s.fat, s.carbs)
+        if omitted or used + estimate_tokens(line) > token_budget:
+            omitted += 1
+            continue
+        lines.append(line)
+        used += estimate_tokens(line)
+    if omitted:
+        note = f"- 另有{omitted}天明细从略"
+        if used + estimate_tokens(note) <= token_budget:
+            lines.append(note)
+
+    return '\n'.join(lines)
@@ -0,0 +1,80 @@
+"""
+好友关系内存索引：按用户缓存好友 ID 集合，社交接口的好友校验不再每次查询 friendships 表
+
+各用户的好友集合在首次访问时加载。friendships 每次变更都会在同一事务中把 data_versions 中的
+版本号加一；本进程发现版本号变化（其他 worker 添加了好友）时清空索引重新加载。
+校验结果为"不是好友"时总是先核对版本号，避免其他进程刚添加的好友关系被误判；
+为"是好友"时每 check_interval 秒最多核对一次。
+"""
+import threading
+import time
+
+from models import db, Friendship, read_data_version
+
+VERSION_NAME = 'friendships'
+
+
+class FriendIndex:
+    """user_id -> 好友 ID 集合"""
+
+    def __init__(self, check_interval=5):
+        self.check_interval = check_interval
+        self._friends = {}
+        self._version = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'loads': 0, 'reloads': 0}
+
+    def _sync(self, force=False):
+        """核对数据库中的版本号，变化时清空索引"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        version = read_data_version(VERSION_NAME)
+        with self._lock:
+            self._next_check = now + self.check_interval
+            if version != self._version:
+                if self._version is not None:
+                    self._stats['reloads'] += 1
+                self._friends.clear()
+                self._version = version
+
+    def friends_of(self, user_id):
+        """user_id 的好友 ID 集合"""
+        self._sync()
+        with self._lock:
+            friends = self._friends.get(user_id)
+            if friends is not None:
+                self._stats['hits'] += 1
+                return friends
+            version = self._version
+        rows = db.session.query(Friendship.friend_id).filter_by(user_id=user_id)
+        friends = frozenset(friend_id for friend_id, in rows)
+        with self._lock:
+            # 加载期间版本号已变化则不写入，下次重新加载
+            if version == self._version:
+                self._friends[user_id] = friends
+                self._stats['loads'] += 1
+        return friends
+
+    def are_friends(self, user_id, other_id):
+        if other_id in self.friends_of(user_id):
+            return True
+        self._sync(force=True)
+        return other_id in self.friends_of(user_id)
+
+    def added(self, user_id, friend_id, version):
+        """本进程已提交一对双向好友关系，version 为提交后的版本号"""
+        with self._lock:
+            if self._version is not None and version == self._version + 1:
+                # 期间没有其他进程的变更，直接更新已加载的集合
+                for a, b in ((user_id, friend_id), (friend_id, user_id)):
+                    if a in self._friends:
+                        self._friends[a] = self._friends[a] | {b}
+            else:
+                self._friends.clear()
+            self._version = version
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, users=len(self._friends), version=self._version)
@@ -0,0 +1,161 @@
+"""
+问候语服务：按用户缓存当天问候语，模板池由后台线程预生成，请求路径不等待模型
+"""
+import re
+import time
+import random
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache
+
+TIME_PERIODS = ('早上', '中午', '下午', '晚上')
+
+GOAL_NAMES = {
+    'lose_weight': '减重',
+    'gain_muscle': '增肌',
+    'maintain': '保持规律饮食'
+}
+DEFAULT_GOAL_NAME = '保持健康'
+
+USERNAME_PLACEHOLDER = '{username}'
+
+# 内置模板，模型生成的模板池就绪前使用
+DEFAULT_TEMPLATES = {
+    '早上': ['早上好，{username}！一份营养早餐是{goal}路上的好开始～',
+            '早上好，{username}！记得吃早餐，为{goal}补充能量！'],
+    '中午': ['中午好，{username}！午餐荤素搭配，{goal}更轻松～',
+            '中午好，{username}！细嚼慢咽，为{goal}加油！'],
+    '下午': ['下午好，{username}！饿了可以来点水果或坚果，{goal}继续加油～',
+            '下午好，{username}！记得多喝水，{goal}一步步来！'],
+    '晚上': ['晚上好，{username}！晚餐清淡七分饱，{goal}稳稳前进～',
+            '晚上好，{username}！今天也辛苦了，{goal}贵在坚持！'],
+}
+
+_LINE_PREFIX_RE = re.compile(r'^\s*(?:\d+[.、)）]|[-*•])\s*')
+
+
+def current_time_period(hour=None):
+    """根据小时判断时间段"""
+    hour = datetime.now().hour if hour is None else hour
+    if 5 <= hour < 11:
+        return '早上'
+    elif 11 <= hour < 14:
+        return '中午'
+    elif 14 <= hour < 18:
+        return '下午'
+    return '晚上'
+
+
+def goal_name(goal):
+    return GOAL_NAMES.get(goal, DEFAULT_GOAL_NAME)
+
+
+def parse_templates(text, max_length=60):
+    """把模型输出按行拆分为模板，去掉序号并过滤过长或缺少占位符的行"""
+    templates = []
+    for line in (text or '').splitlines():
+        line = _LINE_PREFIX_RE.sub('', line).strip().strip('"“”')
+        if line and USERNAME_PLACEHOLDER in line and len(line) <= max_length:
+            templates.append(line)
+    return templates
+
+
+class GreetingService:
+    """问候语缓存与模板池管理"""
+
+    def __init__(self, generate=None, pool_size=8, refresh_interval=6 * 3600, cache_size=4096):
+        # generate(time_period, goal_name, count) -> 模板列表；为 None 时只使用内置模板
+        self.generate = generate
+        self.pool_size = pool_size
+        self.refresh_interval = refresh_interval
+        self.cache = LRUCache(cache_size, ttl=24 * 3600)
+        self._pools = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='greeting-refresh')
+        self._started = False
+        self.counters = {'cache_hits': 0, 'served': 0, 'generated_pools': 0, 'generate_errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def greeting_for(self, user_id, username, goal):
+        """获取用户当前时段的问候语（同一天同一时段保持不变）"""
+        time_period = current_time_period()
+        goal_text = goal_name(goal)
+        key = (user_id, time_period, goal_text, datetime.now().date().isoformat())
+
+        greeting = self.cache.get(key)
+        if greeting is not None:
+            self._count('cache_hits')
+            return greeting
+
+        template = random.choice(self._templates(time_period, goal_text))
+        greeting = template.replace(USERNAME_PLACEHOLDER, username).replace('{goal}', goal_text)
+        self.cache.set(key, greeting)
+        self._count('served')
+        return greeting
+
+    def _templates(self, time_period, goal_text):
+        """返回模板池，缺失或过期时安排后台刷新"""
+        pool_key = (time_period, goal_text)
+        with self._lock:
+            pool = self._pools.get(pool_key)
+        if pool is None or time.monotonic() - pool[0] > self.refresh_interval:
+            self._schedule(pool_key)
+        if pool and pool[1]:
+            return pool[1]
+        return DEFAULT_TEMPLATES[time_period]
+
+    def _schedule(self, pool_key):
+        if self.generate is None:
+            return
+        with self._lock:
+            if pool_key in self._pending:
+                return
+            self._pending.add(pool_key)
+        self._executor.submit(self._refresh, pool_key)
+
+    def _refresh(self, pool_key):
+        try:
+            templates = self.generate(pool_key[0], pool_key[1], self.pool_size)
+            if templates:
+                with self._lock:
+                    self._pools[pool_key] = (time.monotonic(), templates)
+                self._count('generated_pools')
+            else:
+                self._count('generate_errors')
+        except Exception:
+            self._count('generate_errors')
+        finally:
+            with self._lock:
+                self._pending.discard(pool_key)
+
+    def start(self):
+        """启动后台线程，定期为所有时间段和目标预生成模板池"""
+        if self.generate is None:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        thread = threading.Thread(target=self._refresh_loop, name='greeting-prefetch', daemon=True)
+        thread.start()
+
+    def _refresh_loop(self):
+        goal_texts = list(GOAL_NAMES.values()) + [DEFAULT_GOAL_NAME]
+        while True:
+            for time_period in TIME_PERIODS:
+                for goal_text in goal_texts:
+                    self._schedule((time_period, goal_text))
+            time.sleep(self.refresh_interval)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters['pools'] = len(self._pools)
+        counters['cached_greetings'] = len(self.cache)
+        return counters
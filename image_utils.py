@@ -0,0 +1,64 @@
+"""
+图片处理工具：感知哈希、上传图片的归一化（方向校正、缩放、JPEG 压缩）
+"""
+import io
+
+from PIL import Image, ImageOps
+
+JPEG_QUALITIES = (85, 75, 65, 55, 45)
+
+
+def dhash(image_data, hash_size=8):
+    """计算图片的差值哈希（dHash），返回 64 位整数；无法解码时返回 None"""
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        image = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    except Exception:
+        return None
+
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    """两个哈希值的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+def normalize_image(image_data, max_edge=1024, max_bytes=512 * 1024):
+    """按 EXIF 方向校正图片，长边缩放到 max_edge 以内，重新编码为不超过 max_bytes 的 JPEG
+
+    逐档降低 JPEG 质量，最低质量仍超出时继续缩小尺寸；返回 (JPEG 字节, 宽, 高)，无法解码时抛出 ValueError
+    """
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        # JPEG 在解码时直接按整数倍缩小，大图省去大部分解码开销
+        image.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+    except Exception as e:
+        raise ValueError('图片数据无效') from e
+
+    edge = max_edge
+    while True:
+        if max(image.size) > edge:
+            image.thumbnail((edge, edge), Image.LANCZOS)
+        for quality in JPEG_QUALITIES:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue(), image.width, image.height
+        if max(image.size) <= 64:
+            return buffer.getvalue(), image.width, image.height
+        edge = int(max(image.size) * 0.75)
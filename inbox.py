@@ -0,0 +1,48 @@
+"""
+留言推送：send_message 提交后通知收发双方，SSE / 长轮询连接被唤醒后只查询新增的消息
+
+通知只在本进程内传递；其他 worker 写入的消息收不到通知，等待期间每 poll_interval 秒查一次数据库兜底。
+"""
+import threading
+import time
+
+
+class InboxNotifier:
+    """按用户记录最新消息 ID，等待中的连接在有更新的消息时被唤醒"""
+
+    def __init__(self, poll_interval=5):
+        self.poll_interval = poll_interval
+        self._latest = {}  # user_id -> 已知的最新消息 ID
+        self._cond = threading.Condition()
+
+    def publish(self, user_ids, message_id):
+        """新消息已提交，唤醒相关用户的连接"""
+        with self._cond:
+            for user_id in user_ids:
+                if message_id > self._latest.get(user_id, 0):
+                    self._latest[user_id] = message_id
+            self._cond.notify_all()
+
+    def wait(self, user_id, after_id, timeout, latest_in_db):
+        """等待 user_id 出现 ID 大于 after_id 的消息，最多 timeout 秒，返回是否有新消息
+
+        latest_in_db() 返回数据库中该用户的最新消息 ID，用于发现其他进程写入的消息
+        """
+        deadline = time.monotonic() + timeout
+        next_poll = time.monotonic() + self.poll_interval
+        while True:
+            with self._cond:
+                while self._latest.get(user_id, 0) <= after_id:
+                    now = time.monotonic()
+                    if now >= deadline or now >= next_poll:
+                        break
+                    self._cond.wait(min(deadline, next_poll) - now)
+                else:
+                    return True
+            if time.monotonic() >= deadline:
+                return False
+            next_poll = time.monotonic() + self.poll_interval
+            latest = latest_in_db()
+            if latest > after_id:
+                self.publish([user_id], latest)
+                return True
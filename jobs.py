@@ -0,0 +1,264 @@
+"""
+AI 后台任务队列：模型调用在有界线程池中执行，Web 请求只负责入队和查询
+
+任务状态持久化在 ai_jobs 表中；执行过程中的增量输出保存在内存里，供 SSE 实时转发。
+同一用户的相同请求（去重键相同）在执行中或刚完成时会直接复用已有任务。
+"""
+import json
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, AIJob
+
+
+class QueueFull(Exception):
+    """等待中的任务过多"""
+
+
+class _LiveJob:
+    """执行中任务的内存状态：增量输出与完成通知"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.cond = threading.Condition()
+
+    def emit(self, text):
+        with self.cond:
+            self.chunks.append(text)
+            self.cond.notify_all()
+
+    def finish(self, result, error):
+        with self.cond:
+            self.result, self.error, self.done = result, error, True
+            self.cond.notify_all()
+
+    def text(self):
+        with self.cond:
+            return ''.join(self.chunks)
+
+
+class JobQueue:
+    """有界线程池 + ai_jobs 表的任务队列"""
+
+    def __init__(self, app, max_workers=4, max_pending=32, dedupe_window=60, retention=24 * 3600,
+                 stale_after=600):
+        self.app = app
+        self.max_pending = max_pending
+        self.dedupe_window = dedupe_window
+        self.retention = retention
+        self.stale_after = stale_after  # 超过该时长仍未结束的任务视为已中断
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-job')
+        self._live = {}  # job_id -> _LiveJob
+        self._active = {}  # (user_id, dedupe_key) -> job_id
+        self._lock = threading.Lock()
+        self._submits = 0
+        self.counters = {'submitted': 0, 'attached': 0, 'rejected': 0, 'done': 0, 'failed': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _reserve(self, user_id, kind, dedupe_key, status='queued', prompt_version=None):
+        """登记任务，返回 (job_id, 是否新建)；命中去重时返回已有任务"""
+        active_key = (user_id, dedupe_key)
+        with self._lock:
+            job_id = self._active.get(active_key)
+            if job_id is None and len(self._live) >= self.max_pending:
+                self.counters['rejected'] += 1
+                raise QueueFull()
+            if job_id is None:
+                job_id = uuid.uuid4().hex
+                self._active[active_key] = job_id
+                self._live[job_id] = _LiveJob()
+                created = True
+            else:
+                created = False
+
+        if not created:
+            self._count('attached')
+            return job_id, False
+
+        try:
+            recent = AIJob.query.filter(
+                AIJob.user_id == user_id,
+                AIJob.dedupe_key == dedupe_key,
+                AIJob.status == 'done',
+                AIJob.created_at >= datetime.utcnow() - timedelta(seconds=self.dedupe_window)
+            ).order_by(AIJob.created_at.desc()).first()
+            if not recent:
+                now = datetime.utcnow()
+                db.session.add(AIJob(id=job_id, user_id=user_id, kind=kind, dedupe_key=dedupe_key, status=status,
+                                     prompt_version=prompt_version, created_at=now,
+                                     started_at=now if status == 'running' else None))
+                db.session.commit()
+        except Exception:
+            # 任务未写入数据库：释放去重键和名额，否则之后的请求会挂到不存在的任务上
+            db.session.rollback()
+            self._release(job_id, active_key)
+            raise
+
+        if recent:
+            self._release(job_id, active_key)
+            self._count('attached')
+            return recent.id, False
+        self._count('submitted')
+
+        with self._lock:
+            self._submits += 1
+            should_prune = self._submits % 100 == 0
+        if should_prune:
+            self.prune()
+        return job_id, True
+
+    def _release(self, job_id, active_key):
+        with self._lock:
+            self._live.pop(job_id, None)
+            if self._active.get(active_key) == job_id:
+                del self._active[active_key]
+
+    def submit(self, user_id, kind, dedupe_key, task, prompt_version=None):
+        """提交任务，返回 (job_id, 是否新建)；task(emit) 在线程池中执行，返回 (结果, 错误信息)
+
+        相同去重键的任务正在执行或在 dedupe_window 秒内完成时，直接返回该任务
+        """
+        job_id, created = self._reserve(user_id, kind, dedupe_key, prompt_version=prompt_version)
+        if created:
+            self._executor.submit(self._run, job_id, (user_id, dedupe_key), task)
+        return job_id, created
+
+    def submit_async(self, user_id, kind, dedupe_key, start, finish, prompt_version=None):
+        """提交异步任务：start(emit) 返回 Future（结果为模型全文），完成后在线程池中执行 finish(Future)
+
+        模型流在事件循环中执行，不占用线程池；finish 返回 (结果, 错误信息)
+        """
+        job_id, created = self._reserve(user_id, kind, dedupe_key, status='running', prompt_version=prompt_version)
+        if created:
+            active_key = (user_id, dedupe_key)
+            try:
+                future = start(self._live[job_id].emit)
+            except Exception as e:
+                error = str(e)
+                self._executor.submit(self._complete, job_id, active_key, lambda: (None, error))
+            else:
+                future.add_done_callback(
+                    lambda f: self._executor.submit(self._complete, job_id, active_key, partial(finish, f)))
+        return job_id, created
+
+    def _run(self, job_id, active_key, task):
+        live = self._live[job_id]
+
+        def produce():
+            job = AIJob.query.get(job_id)
+            job.status = 'running'
+            job.started_at = datetime.utcnow()
+            db.session.commit()
+            return task(live.emit)
+
+        self._complete(job_id, active_key, produce)
+
+    def _complete(self, job_id, active_key, produce):
+        """执行 produce() 得到 (结果, 错误信息)，写入任务表并通知等待中的连接"""
+        live = self._live[job_id]
+        result, error = None, '任务执行失败，请重试'
+        try:
+            with self.app.app_context():
+                try:
+                    result, error = produce()
+                except Exception as e:
+                    result, error = None, str(e)
+
+                # 任务出错时会话可能处于待回滚状态
+                db.session.rollback()
+                job = AIJob.query.get(job_id)
+                job.status = 'failed' if error else 'done'
+                job.result = json.dumps(result, ensure_ascii=False) if result is not None else None
+                job.error = error
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+        finally:
+            # 无论成功与否都要通知等待中的 SSE 连接并释放去重键
+            self._count('failed' if error else 'done')
+            live.finish(result, error)
+            self._release(job_id, active_key)
+
+    def get(self, job_id, user_id):
+        """查询任务状态，执行中时附带已生成的文本；任务不存在或不属于该用户返回 None"""
+        job = AIJob.query.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        data = job.to_dict()
+        live = self._live.get(job_id)
+        if live is not None:
+            data['text'] = live.text()
+        return data
+
+    def events(self, job_id, heartbeat=15):
+        """逐个产出 (事件名, 数据)：delta 增量文本，最后是 result 或 error"""
+        live = self._live.get(job_id)
+        if live is not None:
+            sent = 0
+            while True:
+                with live.cond:
+                    if len(live.chunks) == sent and not live.done:
+                        live.cond.wait(heartbeat)
+                    chunks = live.chunks[sent:]
+                    done = live.done
+                sent += len(chunks)
+                for text in chunks:
+                    yield 'delta', {'text': text}
+                if done:
+                    break
+                if not chunks:
+                    yield 'ping', {}
+
+        # 已结束或在其他进程中执行的任务：轮询数据库直到结束
+        deadline = time.monotonic() + self.stale_after
+        while True:
+            # get() 会直接返回会话中的旧对象，这里必须重新查询
+            job = AIJob.query.filter_by(id=job_id).populate_existing().first()
+            if job is None:
+                yield 'error', {'error': '任务不存在'}
+                return
+            if job.status == 'done':
+                yield 'result', json.loads(job.result) if job.result else {}
+                return
+            if job.status == 'failed' or time.monotonic() > deadline:
+                yield 'error', {'error': job.error or '任务已中断，请重试'}
+                return
+            time.sleep(1)
+            yield 'ping', {}
+
+    def recover(self):
+        """启动时把长时间未结束的遗留任务标记为失败，并清理过期任务"""
+        AIJob.query.filter(
+            AIJob.status.in_(['queued', 'running']),
+            AIJob.created_at < datetime.utcnow() - timedelta(seconds=self.stale_after)
+        ).update({
+            AIJob.status: 'failed',
+            AIJob.error: '任务已中断，请重试',
+            AIJob.finished_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        self.prune()
+
+    def prune(self):
+        """删除超过保留期的已结束任务"""
+        expire_before = datetime.utcnow() - timedelta(seconds=self.retention)
+        AIJob.query.filter(
+            AIJob.status.in_(['done', 'failed']),
+            AIJob.created_at < expire_before
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters['live'] = len(self._live)
+        return counters
@@ -0,0 +1,256 @@
+"""
+数据库版本化迁移与热点查询计划检查
+
+db.create_all() 只会创建缺失的表，不会修改已有表。对已有表的结构变更（加列、加索引）
+和一次性的数据回填都写成带版本号的迁移，已执行的版本记录在 schema_migrations 表中。
+迁移本身保持幂等，这样没有版本记录的旧库也可以安全地从头执行。
+"""
+from datetime import datetime, timedelta
+
+from database import migration_lock
+from pagination import keyset_query, keyset_filter, encode_cursor, merged_union
+from models import db, User, MealRecord, MealFood, Friendship, Message, MealReaction, DailyNutritionSummary, \
+    AIFeedback, Conversation, ensure_columns, drop_columns, backfill_meal_foods, rebuild_daily_summaries, \
+    repair_reaction_counts, backfill_conversations, repair_conversations
+
+
+class SchemaMigration(db.Model):
+    """已执行的迁移版本"""
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """注册一个迁移，版本号必须递增"""
+    def decorator(func):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] < version, '迁移版本号必须递增'
+        MIGRATIONS.append((version, name, func))
+        return func
+    return decorator
+
+
+def create_index(name, table, columns):
+    db.session.execute(db.text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'))
+
+
+@migration(1, 'meal_records reaction counters')
+def _reaction_counters():
+    # 先补列：之后的迁移会通过 ORM 读取 meal_records 的全部列
+    ensure_columns('meal_records', [
+        ('like_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('dislike_count', 'INTEGER NOT NULL DEFAULT 0')
+    ])
+    repair_reaction_counts()
+
+
+@migration(2, 'backfill meal_foods')
+def _backfill_meal_foods():
+    backfill_meal_foods()
+
+
+@migration(3, 'build daily_nutrition_summary')
+def _build_daily_summaries():
+    rebuild_daily_summaries()
+
+
+@migration(4, 'hot query indexes')
+def _hot_query_indexes():
+    create_index('ix_meal_records_user_created', 'meal_records', ['user_id', 'created_at'])
+    create_index('ix_messages_pair_created', 'messages', ['from_user_id', 'to_user_id', 'created_at'])
+    create_index('ix_messages_to_created', 'messages', ['to_user_id', 'created_at'])
+    create_index('ix_friendships_user_friend', 'friendships', ['user_id', 'friend_id'])
+    create_index('ix_meal_reactions_meal_type', 'meal_reactions', ['meal_id', 'reaction_type'])
+
+
+@migration(5, 'ai_jobs prompt version')
+def _ai_job_prompt_version():
+    ensure_columns('ai_jobs', [('prompt_version', 'VARCHAR(12)')])
+
+
+@migration(6, 'keyset pagination indexes')
+def _pagination_indexes():
+    create_index('ix_users_created_id', 'users', ['created_at', 'id'])
+    create_index('ix_ai_feedbacks_created_id', 'ai_feedbacks', ['created_at', 'id'])
+
+
+# 版本 7（friendships 上的未读计数列）已废弃：未读状态只在迁移 8 的 conversations 表中引入，
+# 执行过旧版本 7 的库由迁移 11 删除这两列
+
+
+@migration(8, 'conversations')
+def _conversations():
+    ensure_columns('messages', [('conversation_id', 'INTEGER REFERENCES conversations(id)')])
+    create_index('ix_messages_conversation_created', 'messages', ['conversation_id', 'created_at'])
+    backfill_conversations()
+    # 已有的留言视为双方都已读，再据此计算最后一条消息和未读数
+    last_id = db.func.coalesce(db.select(db.func.max(Message.id)).where(
+        Message.conversation_id == Conversation.id
+    ).scalar_subquery(), 0)
+    Conversation.query.update({Conversation.low_last_read_id: last_id, Conversation.high_last_read_id: last_id},
+                              synchronize_session=False)
+    db.session.commit()
+    repair_conversations()
+
+
+@migration(9, 'feed indexes')
+def _feed_indexes():
+    create_index('ix_messages_meal', 'messages', ['meal_id'])
+
+
+@migration(10, 'admin stats indexes')
+def _admin_stats_indexes():
+    # 每日新增统计按 created_at 范围扫描
+    create_index('ix_meal_records_created', 'meal_records', ['created_at'])
+    create_index('ix_messages_created', 'messages', ['created_at'])
+
+
+@migration(11, 'drop friendships unread columns')
+def _drop_friendship_unread_columns():
+    # 旧版本 7 加在 friendships 上的未读计数列，已由 conversations 取代
+    drop_columns('friendships', ['unread_count', 'last_read_message_id'])
+
+
+@migration(12, 'message updates index')
+def _message_updates_index():
+    # 新消息推送按会话取 after_id 之后的消息
+    create_index('ix_messages_conversation_id', 'messages', ['conversation_id', 'id'])
+
+
+@migration(13, 'feed merge index')
+def _feed_merge_index():
+    # 好友动态按好友逐路沿 (user_id, created_at, id) 归并；取代只有 (user_id, created_at) 的旧索引
+    create_index('ix_meal_records_user_created_id', 'meal_records', ['user_id', 'created_at', 'id'])
+    db.session.execute(db.text('DROP INDEX IF EXISTS ix_meal_records_user_created'))
+    db.session.commit()
+
+
+@migration(14, 'sort-free hot query indexes')
+def _sort_free_indexes():
+    # 食物明细按 (meal_id, position) 顺序读出
+    create_index('ix_meal_foods_meal_position', 'meal_foods', ['meal_id', 'position'])
+    # 每日新增统计按日期表达式过滤和分组，取代迁移 10 的 created_at 索引
+    for table in ('users', 'meal_records', 'ai_feedbacks', 'messages'):
+        create_index(f'ix_{table}_created_day', table, ['date(created_at)'])
+    for name in ('ix_meal_foods_meal_id', 'ix_meal_records_created', 'ix_messages_created'):
+        db.session.execute(db.text(f'DROP INDEX IF EXISTS {name}'))
+    db.session.commit()
+
+
+@migration(15, 'drop message pair index')
+def _drop_message_pair_index():
+    # 对话改为按会话读取（ix_messages_conversation_*），按收发双方查询的索引已无查询使用
+    db.session.execute(db.text('DROP INDEX IF EXISTS ix_messages_pair_created'))
+    db.session.commit()
+
+
+def applied_versions():
+    return {row.version for row in SchemaMigration.query.with_entities(SchemaMigration.version)}
+
+
+def upgrade():
+    """执行所有未执行的迁移，返回本次执行的版本号列表（多进程同时调用时串行执行）"""
+    with migration_lock(db.engine):
+        db.create_all()
+        done = applied_versions()
+        applied = []
+        for version, name, func in MIGRATIONS:
+            if version in done:
+                continue
+            func()
+            db.session.add(SchemaMigration(version=version, name=name))
+            db.session.commit()
+            applied.append(version)
+        return applied
+
+
+def status():
+    """返回 [(版本号, 名称, 是否已执行)]"""
+    done = applied_versions()
+    return [(version, name, version in done) for version, name, _ in MIGRATIONS]
+
+
+# ========== 热点查询计划检查 ==========
+
+def hot_queries(user_id=1, friend_id=2):
+    """各接口的热点查询（与 app.py 中的写法一致），用于 EXPLAIN QUERY PLAN"""
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    # 翻页查询带上游标条件，检查深翻页时同样走索引
+    cursor = encode_cursor(week_ago, 1000)
+    return {
+        '饮食记录分页': keyset_query(MealRecord.query.filter(MealRecord.user_id == user_id), MealRecord, cursor, 30),
+        '与好友的对话': keyset_query(Message.query.filter_by(conversation_id=1), Message, cursor, 50),
+        '会话列表': merged_union([
+            db.select(Conversation.last_message_at, Conversation.id).where(
+                side == user_id, Conversation.last_message_id.isnot(None))
+            for side in (Conversation.user_low_id, Conversation.user_high_id)
+        ], None, descending=True),
+        '新消息推送': merged_union([
+            db.select(Message.id).where(Message.conversation_id == conversation_id, Message.id > 1000)
+            for conversation_id in (1, 2, 3)
+        ], 100),
+        '会话查找': Conversation.query.filter_by(user_low_id=user_id, user_high_id=friend_id),
+        '好友动态': merged_union([
+            db.select(MealRecord.created_at, MealRecord.id).where(MealRecord.user_id == friend_id, keyset_filter(
+                MealRecord, cursor)) for friend_id in (2, 3, 4)
+        ], 31, descending=True),
+        '动态评论数': db.session.query(Message.meal_id, db.func.count(Message.id)).filter(
+            Message.meal_id.in_([1, 2, 3])
+        ).group_by(Message.meal_id),
+        '收到的留言': keyset_query(Message.query.filter_by(to_user_id=user_id), Message, cursor, 50),
+        '用户列表分页': keyset_query(User.query, User, cursor, 50),
+        '反馈列表分页': keyset_query(AIFeedback.query, AIFeedback, cursor, 50),
+        '好友关系校验': Friendship.query.filter_by(user_id=user_id, friend_id=friend_id),
+        '好友列表': Friendship.query.filter_by(user_id=user_id),
+        '点赞统计': db.session.query(
+            MealReaction.meal_id, MealReaction.reaction_type, db.func.count(MealReaction.id)
+        ).filter(MealReaction.meal_id.in_([1, 2, 3])).group_by(MealReaction.meal_id, MealReaction.reaction_type),
+        '我的反应': db.session.query(MealReaction.meal_id, MealReaction.reaction_type).filter(
+            MealReaction.meal_id.in_([1, 2, 3]),
+            MealReaction.user_id == user_id
+        ),
+        '聊天饮食明细': db.session.query(MealFood.meal_id, MealFood.name).filter(
+            MealFood.meal_id.in_([1, 2, 3])
+        ).order_by(MealFood.meal_id, MealFood.position),
+        '每日新增饮食记录': db.session.query(db.func.date(MealRecord.created_at), db.func.count()).filter(
+            db.func.date(MealRecord.created_at) >= week_ago.date()
+        ).group_by(db.func.date(MealRecord.created_at)),
+        '用户列表饮食记录数': db.session.query(MealRecord.user_id, db.func.count(MealRecord.id)).filter(
+            MealRecord.user_id.in_([1, 2, 3])
+        ).group_by(MealRecord.user_id),
+        '营养历史': DailyNutritionSummary.query.filter(
+            DailyNutritionSummary.user_id == user_id,
+            DailyNutritionSummary.local_date >= week_ago.date()
+        ),
+    }
+
+
+def plan_problem(plan):
+    """计划中的问题：全表扫描或临时 B 树排序，没有问题时返回 None"""
+    # "SCAN 表名" 且未使用索引即为全表扫描
+    if any(step.startswith('SCAN ') and 'INDEX' not in step for step in plan):
+        return '全表扫描'
+    # 排序、分组或去重没能沿索引顺序进行，需要把所有候选行放进临时 B 树
+    if any('TEMP B-TREE' in step for step in plan):
+        return '临时排序'
+    return None
+
+
+def explain_hot_queries(user_id=1, friend_id=2):
+    """对每条热点查询执行 EXPLAIN QUERY PLAN，返回 [(名称, 计划行列表, 问题或 None)]"""
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('EXPLAIN QUERY PLAN 检查仅支持 SQLite')
+
+    report = []
+    for name, query in hot_queries(user_id, friend_id).items():
+        statement = getattr(query, 'statement', query)
+        sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        rows = db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+        plan = [row[-1] for row in rows]
+        report.append((name, plan, plan_problem(plan)))
+    return report
@@ -4,7 +4,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timezone
+from sqlalchemy.exc import IntegrityError
 import random
 import string
 
@@ -64,8 +65,29 @@ class MealRecord(db.Model):
     total_calories = db.Column(db.Integer)
     health_score = db.Column(db.Integer)
     dietary_advice = db.Column(db.Text)
+    like_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # 冗余计数，随点赞更新
+    dislike_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_meal_records_user_created_id', 'user_id', 'created_at', 'id'),
+    )
+    
+    # 每种食物一行的营养明细（批量预加载时按 (meal_id, position) 索引顺序读出，不需要再排序）
+    food_items = db.relationship('MealFood', backref='meal', cascade='all, delete-orphan',
+                                 order_by='[MealFood.meal_id, MealFood.position]')
+    
+    def set_foods(self, foods):
+        """写入食物列表：JSON 字段保持 API 兼容，同时生成营养明细行"""
+        import json
+        foods = [f for f in (foods or []) if isinstance(f, dict)]
+        self.foods = json.dumps(foods, ensure_ascii=False)
+        self.food_items = [MealFood.from_food(self, i, f) for i, f in enumerate(foods)]
+    
+    def food_names(self):
+        """食物名称列表（读取明细行，不解析 JSON）"""
+        return [item.name for item in self.food_items]
+    
     def to_dict(self):
         import json
         return {
@@ -79,6 +101,182 @@ class MealRecord(db.Model):
         }
 
 
+def _to_float(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class MealFood(db.Model):
+    """饮食记录中的单个食物（营养数值列，便于 SQL 聚合）"""
+    __tablename__ = 'meal_foods'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    meal_id = db.Column(db.Integer, db.ForeignKey('meal_records.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    position = db.Column(db.Integer, default=0)
+    name = db.Column(db.String(100), nullable=False)
+    quantity = db.Column(db.String(100))
+    calories = db.Column(db.Float)
+    protein = db.Column(db.Float)  # g
+    fat = db.Column(db.Float)  # g
+    carbs = db.Column(db.Float)  # g
+    fiber = db.Column(db.Float)  # g
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # 与所属饮食记录一致
+    
+    __table_args__ = (
+        db.Index('ix_meal_foods_user_created', 'user_id', 'created_at'),
+        db.Index('ix_meal_foods_meal_position', 'meal_id', 'position'),
+    )
+    
+    @classmethod
+    def from_food(cls, record, position, food):
+        return cls(
+            user_id=record.user_id,
+            position=position,
+            name=str(food.get('name') or '')[:100],
+            quantity=str(food.get('quantity') or '')[:100],
+            calories=_to_float(food.get('calories')),
+            protein=_to_float(food.get('protein')),
+            fat=_to_float(food.get('fat')),
+            carbs=_to_float(food.get('carbs')),
+            fiber=_to_float(food.get('fiber')),
+            created_at=record.created_at
+        )
+
+
+def backfill_meal_foods():
+    """为还没有明细行的旧饮食记录补写 meal_foods，返回处理的记录数"""
+    import json
+    has_items = db.session.query(MealFood.meal_id)
+    records = MealRecord.query.filter(
+        MealRecord.foods.isnot(None),
+        MealRecord.foods != '[]',
+        ~MealRecord.id.in_(has_items)
+    ).all()
+    
+    for record in records:
+        try:
+            foods = json.loads(record.foods)
+        except (json.JSONDecodeError, TypeError):
+            continue
+        if isinstance(foods, list):
+            record.food_items = [MealFood.from_food(record, i, f) for i, f in enumerate(foods) if isinstance(f, dict)]
+    db.session.commit()
+    return len(records)
+
+
+def _dialect_insert():
+    """当前数据库方言的 insert（支持 on_conflict_do_update 的 SQLite / PostgreSQL）"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def local_date_of(value):
+    """UTC 时间转换为服务器本地日期（饮食记录按本地日期归日）"""
+    return value.replace(tzinfo=timezone.utc).astimezone().date()
+
+
+class DailyNutritionSummary(db.Model):
+    """每用户每日营养汇总表，随饮食记录的新增/删除增量维护"""
+    __tablename__ = 'daily_nutrition_summary'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    local_date = db.Column(db.Date, primary_key=True)
+    meal_count = db.Column(db.Integer, default=0, nullable=False)
+    total_calories = db.Column(db.Integer, default=0, nullable=False)
+    protein = db.Column(db.Float, default=0, nullable=False)  # g
+    fat = db.Column(db.Float, default=0, nullable=False)  # g
+    carbs = db.Column(db.Float, default=0, nullable=False)  # g
+    fiber = db.Column(db.Float, default=0, nullable=False)  # g
+    nutrient_items = db.Column(db.Integer, default=0, nullable=False)  # 带营养素数据的食物条数
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @classmethod
+    def empty(cls, user_id, local_date):
+        return cls(user_id=user_id, local_date=local_date, meal_count=0, total_calories=0,
+                   protein=0, fat=0, carbs=0, fiber=0, nutrient_items=0)
+    
+    @classmethod
+    def apply(cls, record, sign=1):
+        """把一条饮食记录计入（sign=1）或移出（sign=-1）当日汇总，由调用方提交事务
+
+        使用 INSERT ... ON CONFLICT DO UPDATE 原子累加，并发保存同一天的记录不会主键冲突或丢失增量
+        """
+        local_date = local_date_of(record.created_at or datetime.utcnow())
+        deltas = cls.deltas(record, sign)
+        insert = _dialect_insert()
+        table = cls.__table__
+        stmt = insert(table).values(user_id=record.user_id, local_date=local_date,
+                                    updated_at=datetime.utcnow(), **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.local_date],
+            set_=dict({name: table.c[name] + stmt.excluded[name] for name in deltas},
+                      updated_at=stmt.excluded.updated_at)
+        )
+        db.session.execute(stmt)
+        if sign < 0:
+            cls.query.filter(cls.user_id == record.user_id, cls.local_date == local_date,
+                             cls.meal_count <= 0).delete(synchronize_session=False)
+    
+    @staticmethod
+    def deltas(record, sign=1):
+        """一条饮食记录对各汇总列的增量"""
+        deltas = {'meal_count': sign, 'total_calories': sign * int(record.total_calories or 0),
+                  'protein': 0.0, 'fat': 0.0, 'carbs': 0.0, 'fiber': 0.0, 'nutrient_items': 0}
+        for item in record.food_items:
+            if item.protein is not None:
+                deltas['nutrient_items'] += sign
+            for name in ('protein', 'fat', 'carbs', 'fiber'):
+                deltas[name] += sign * (getattr(item, name) or 0)
+        return deltas
+    
+    def add(self, record, sign=1):
+        for name, delta in self.deltas(record, sign).items():
+            setattr(self, name, getattr(self, name) + delta)
+    
+    def to_dict(self):
+        return {
+            'date': self.local_date.isoformat(),
+            'total_calories': self.total_calories,
+            'meal_count': self.meal_count,
+            'nutrition': {
+                'protein': round(self.protein, 1),
+                'fat': round(self.fat, 1),
+                'carbs': round(self.carbs, 1),
+                'fiber': round(self.fiber, 1)
+            },
+            'has_data': self.nutrient_items > 0
+        }
+
+
+def rebuild_daily_summaries(user_id=None):
+    """根据饮食记录重建每日营养汇总（用于修复），返回重建的天数"""
+    query = DailyNutritionSummary.query
+    records = MealRecord.query
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+        records = records.filter_by(user_id=user_id)
+    query.delete(synchronize_session=False)
+    db.session.flush()
+    
+    summaries = {}
+    for record in records.options(db.selectinload(MealRecord.food_items)).all():
+        key = (record.user_id, local_date_of(record.created_at))
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = DailyNutritionSummary.empty(*key)
+        summary.add(record)
+    
+    db.session.add_all(summaries.values())
+    db.session.commit()
+    return len(summaries)
+
+
 class Friendship(db.Model):
     """好友关系表"""
     __tablename__ = 'friendships'
@@ -88,28 +286,153 @@ class Friendship(db.Model):
     friend_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_friendships_user_friend', 'user_id', 'friend_id'),)
+    
     # 关系
     user = db.relationship('User', foreign_keys=[user_id])
     friend = db.relationship('User', foreign_keys=[friend_id])
 
 
+class DataVersion(db.Model):
+    """数据版本号：某类数据每次变更时加一，各进程的内存索引据此判断是否需要重新加载"""
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+
+def read_data_version(name):
+    return db.session.query(DataVersion.version).filter_by(name=name).scalar() or 0
+
+
+def bump_data_version(name):
+    """在当前事务中把版本号加一（原子更新），返回新版本号"""
+    updated = DataVersion.query.filter_by(name=name).update(
+        {DataVersion.version: DataVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        try:
+            with db.session.begin_nested():
+                db.session.add(DataVersion(name=name, version=1))
+        except IntegrityError:
+            DataVersion.query.filter_by(name=name).update(
+                {DataVersion.version: DataVersion.version + 1}, synchronize_session=False)
+    return read_data_version(name)
+
+
+def conversation_key(user_a, user_b):
+    """会话的规范键 (较小的用户 ID, 较大的用户 ID)"""
+    return (user_a, user_b) if user_a < user_b else (user_b, user_a)
+
+
+class Conversation(db.Model):
+    """两个用户之间的会话（每对用户一条）：最后一条消息和双方的未读状态冗余存储，会话列表无需扫描留言表
+
+    low_* / high_* 分别是 user_low_id / user_high_id 一侧的状态
+    """
+    __tablename__ = 'conversations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_low_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_high_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    last_message_id = db.Column(db.Integer)
+    last_message_at = db.Column(db.DateTime)
+    last_sender_id = db.Column(db.Integer)
+    last_preview = db.Column(db.String(50))
+    low_unread = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    high_unread = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    low_last_read_id = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    high_last_read_id = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_low_id', 'user_high_id', name='uq_conversation_pair'),
+        db.Index('ix_conversations_low_last', 'user_low_id', 'last_message_at'),
+        db.Index('ix_conversations_high_last', 'user_high_id', 'last_message_at'),
+    )
+    
+    def peer_of(self, user_id):
+        return self.user_high_id if user_id == self.user_low_id else self.user_low_id
+    
+    def unread_for(self, user_id):
+        return self.low_unread if user_id == self.user_low_id else self.high_unread
+    
+    def to_dict(self, user_id):
+        return {
+            'id': self.id,
+            'friend_id': self.peer_of(user_id),
+            'last_message_id': self.last_message_id,
+            'last_message_at': self.last_message_at.strftime('%Y-%m-%d %H:%M') if self.last_message_at else None,
+            'last_sender_id': self.last_sender_id,
+            'last_preview': self.last_preview,
+            'unread': self.unread_for(user_id)
+        }
+
+
+def _side_columns(conversation, user_id):
+    """user_id 在会话中一侧的 (未读数列, 已读位置列)"""
+    if user_id == conversation.user_low_id:
+        return Conversation.low_unread, Conversation.low_last_read_id
+    return Conversation.high_unread, Conversation.high_last_read_id
+
+
+def find_conversation(user_a, user_b):
+    low, high = conversation_key(user_a, user_b)
+    return Conversation.query.filter_by(user_low_id=low, user_high_id=high).first()
+
+
+def get_or_create_conversation(user_a, user_b):
+    """获取两人的会话，不存在时创建（并发创建时唯一约束冲突只回滚保存点）"""
+    conversation = find_conversation(user_a, user_b)
+    if conversation:
+        return conversation
+    low, high = conversation_key(user_a, user_b)
+    try:
+        with db.session.begin_nested():
+            conversation = Conversation(user_low_id=low, user_high_id=high)
+            db.session.add(conversation)
+    except IntegrityError:
+        conversation = find_conversation(user_a, user_b)
+    return conversation
+
+
+def record_message(conversation, message):
+    """在当前事务中更新会话的最后一条消息，并原子地把接收方的未读数加一（message 需已 flush）"""
+    unread, _ = _side_columns(conversation, message.to_user_id)
+    Conversation.query.filter_by(id=conversation.id).update({
+        Conversation.last_message_id: message.id,
+        Conversation.last_message_at: message.created_at,
+        Conversation.last_sender_id: message.from_user_id,
+        Conversation.last_preview: message.content[:50],
+        unread: unread + 1
+    }, synchronize_session=False)
+
+
 class Message(db.Model):
     """留言表"""
     __tablename__ = 'messages'
     
     id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'))
     from_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     to_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     meal_id = db.Column(db.Integer, db.ForeignKey('meal_records.id'), nullable=True)  # 关联的饮食记录（可选）
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_messages_to_created', 'to_user_id', 'created_at'),
+        db.Index('ix_messages_conversation_created', 'conversation_id', 'created_at'),
+        db.Index('ix_messages_conversation_id', 'conversation_id', 'id'),
+        db.Index('ix_messages_meal', 'meal_id'),
+    )
+    
     # 关联饮食记录
     meal = db.relationship('MealRecord', backref='comments')
     
     def to_dict(self):
         result = {
             'id': self.id,
+            'conversation_id': self.conversation_id,
             'sender_id': self.from_user_id,
             'sender_name': self.sender.username,
             'receiver_id': self.to_user_id,
@@ -118,9 +441,8 @@ class Message(db.Model):
         }
         # 如果有关联的饮食记录，添加饮食信息
         if self.meal_id and self.meal:
-            import json
-            foods = json.loads(self.meal.foods) if self.meal.foods else []
-            food_names = '、'.join([f['name'] for f in foods]) if foods else '无详情'
+            names = self.meal.food_names()
+            food_names = '、'.join(names) if names else '无详情'
             result['meal_info'] = {
                 'id': self.meal.id,
                 'meal_type': self.meal.meal_type,
@@ -141,13 +463,130 @@ class MealReaction(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # 唯一约束：一个用户对一条饮食记录只能有一个反应
-    __table_args__ = (db.UniqueConstraint('user_id', 'meal_id', name='unique_user_meal_reaction'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'meal_id', name='unique_user_meal_reaction'),
+        db.Index('ix_meal_reactions_meal_type', 'meal_id', 'reaction_type'),
+    )
     
     # 关系
     user = db.relationship('User', backref='reactions')
     meal = db.relationship('MealRecord', backref='reactions')
 
 
+def adjust_reaction_counts(meal_id, reaction_type, delta):
+    """在当前事务中原子地增减饮食记录的点赞/点踩计数"""
+    column = MealRecord.like_count if reaction_type == 'like' else MealRecord.dislike_count
+    MealRecord.query.filter_by(id=meal_id).update({column: column + delta}, synchronize_session=False)
+
+
+def repair_reaction_counts():
+    """根据 meal_reactions 重新计算所有饮食记录的点赞/点踩计数，返回被修正的记录数"""
+    def count_of(reaction_type):
+        return db.select(db.func.count(MealReaction.id)).where(
+            MealReaction.meal_id == MealRecord.id,
+            MealReaction.reaction_type == reaction_type
+        ).scalar_subquery()
+
+    likes, dislikes = count_of('like'), count_of('dislike')
+    fixed = MealRecord.query.filter(
+        (MealRecord.like_count != likes) | (MealRecord.dislike_count != dislikes)
+    ).update({MealRecord.like_count: likes, MealRecord.dislike_count: dislikes}, synchronize_session=False)
+    db.session.commit()
+    return fixed
+
+
+def mark_conversation_read(conversation, user_id, last_id):
+    """user_id 已读到 last_id：未读数按之后收到的消息重新计算，标记期间新到的消息仍算未读"""
+    unread, last_read = _side_columns(conversation, user_id)
+    remaining = db.select(db.func.count(Message.id)).where(
+        Message.conversation_id == conversation.id,
+        Message.to_user_id == user_id,
+        Message.id > last_id
+    ).scalar_subquery()
+    Conversation.query.filter(
+        Conversation.id == conversation.id,
+        last_read <= last_id
+    ).update({last_read: last_id, unread: remaining}, synchronize_session=False)
+    db.session.commit()
+
+
+def backfill_conversations():
+    """为已有的好友关系和留言建立会话并回填 messages.conversation_id，返回新建的会话数"""
+    pairs = {conversation_key(a, b) for a, b in db.session.query(Friendship.user_id, Friendship.friend_id)}
+    pairs |= {conversation_key(a, b) for a, b in
+              db.session.query(Message.from_user_id, Message.to_user_id).filter(Message.conversation_id.is_(None))
+              .distinct()}
+    pairs -= set(db.session.query(Conversation.user_low_id, Conversation.user_high_id).all())
+    db.session.add_all([Conversation(user_low_id=low, user_high_id=high) for low, high in pairs])
+    db.session.flush()
+
+    low = db.case((Message.from_user_id < Message.to_user_id, Message.from_user_id), else_=Message.to_user_id)
+    high = db.case((Message.from_user_id < Message.to_user_id, Message.to_user_id), else_=Message.from_user_id)
+    conversation_id = db.select(Conversation.id).where(
+        Conversation.user_low_id == low,
+        Conversation.user_high_id == high
+    ).scalar_subquery()
+    Message.query.filter(Message.conversation_id.is_(None)).update(
+        {Message.conversation_id: conversation_id}, synchronize_session=False)
+    db.session.commit()
+    return len(pairs)
+
+
+def repair_conversations():
+    """根据留言表重新计算所有会话的最后一条消息和双方未读数（已读位置不变）"""
+    last_id = db.select(db.func.max(Message.id)).where(Message.conversation_id == Conversation.id).scalar_subquery()
+    Conversation.query.update({Conversation.last_message_id: last_id}, synchronize_session=False)
+
+    def last_field(column):
+        return db.select(column).where(Message.id == Conversation.last_message_id).scalar_subquery()
+
+    def unread_of(user_column, last_read_column):
+        return db.select(db.func.count(Message.id)).where(
+            Message.conversation_id == Conversation.id,
+            Message.to_user_id == user_column,
+            Message.id > last_read_column
+        ).scalar_subquery()
+
+    Conversation.query.update({
+        Conversation.last_message_at: last_field(Message.created_at),
+        Conversation.last_sender_id: last_field(Message.from_user_id),
+        Conversation.last_preview: last_field(db.func.substr(Message.content, 1, 50)),
+        Conversation.low_unread: unread_of(Conversation.user_low_id, Conversation.low_last_read_id),
+        Conversation.high_unread: unread_of(Conversation.user_high_id, Conversation.high_last_read_id)
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def ensure_columns(table_name, columns):
+    """为已存在的表补充新增列（create_all 不会修改旧表），返回新增的列名"""
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table(table_name):
+        return []
+    existing = {c['name'] for c in inspector.get_columns(table_name)}
+    added = []
+    with db.engine.begin() as conn:
+        for name, ddl in columns:
+            if name not in existing:
+                conn.execute(db.text(f'ALTER TABLE {table_name} ADD COLUMN {name} {ddl}'))
+                added.append(name)
+    return added
+
+
+def drop_columns(table_name, columns):
+    """删除已存在表中的废弃列（不存在的列跳过），返回删除的列名"""
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table(table_name):
+        return []
+    existing = {c['name'] for c in inspector.get_columns(table_name)}
+    dropped = []
+    with db.engine.begin() as conn:
+        for name in columns:
+            if name in existing:
+                conn.execute(db.text(f'ALTER TABLE {table_name} DROP COLUMN {name}'))
+                dropped.append(name)
+    return dropped
+
+
 class AIFeedback(db.Model):
     """AI回答反馈表"""
     __tablename__ = 'ai_feedbacks'
@@ -177,3 +616,54 @@ class AIFeedback(db.Model):
             'mode': self.mode,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M')
         }
+
+
+# 管理后台每日新增统计按 UTC 日期过滤和分组：日期表达式索引让两者都沿索引有序进行，不需要临时排序
+db.Index('ix_users_created_day', db.func.date(User.created_at))
+db.Index('ix_meal_records_created_day', db.func.date(MealRecord.created_at))
+db.Index('ix_ai_feedbacks_created_day', db.func.date(AIFeedback.created_at))
+db.Index('ix_messages_created_day', db.func.date(Message.created_at))
+
+
+class AnalysisCacheEntry(db.Model):
+    """饮食分析结果缓存表"""
+    __tablename__ = 'analysis_cache'
+    
+    key = db.Column(db.String(64), primary_key=True)  # 归一化描述 + 餐次 + 提示词版本的哈希
+    meal_type = db.Column(db.String(10))
+    description = db.Column(db.Text)  # 归一化后的描述，便于排查
+    result = db.Column(db.Text, nullable=False)  # JSON 格式的分析结果
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class AIJob(db.Model):
+    """AI 后台任务表（对话、文字分析、图片分析）"""
+    __tablename__ = 'ai_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # chat/analyze/vision
+    dedupe_key = db.Column(db.String(64), nullable=False)  # 相同请求的去重键
+    prompt_version = db.Column(db.String(12))  # 提交时的提示词版本
+    status = db.Column(db.String(10), nullable=False, default='queued')  # queued/running/done/failed
+    result = db.Column(db.Text)  # JSON 格式的结果
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (db.Index('ix_ai_jobs_user_dedupe', 'user_id', 'dedupe_key', 'created_at'),)
+    
+    def to_dict(self):
+        import json
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'prompt_version': self.prompt_version,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
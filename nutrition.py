@@ -0,0 +1,456 @@
+"""
+本地营养计算引擎：食物库 + 中文数量解析，常见饮食无需调用大模型即可得出结果
+"""
+import os
+import re
+import json
+import unicodedata
+
+from cache import chinese_to_number
+
+NUTRIENTS = ('calories', 'protein', 'fat', 'carbs', 'fiber')
+
+SIZE_LABELS = {'small': '小', 'medium': '中', 'large': '大'}
+SIZE_VALUES = {'小': 'small', '中': 'medium', '大': 'large'}
+
+# 内置食物库，数据来自 SYSTEM_PROMPT 中的卡路里和营养素参考表
+# per_100g: 每 100g（液体为每 100ml）的营养成分
+# units: 单位 → 克数；需要区分大小的单位写成 {small, medium, large}
+DEFAULT_FOODS = [
+    {
+        'name': '米饭', 'aliases': ['白米饭', '白饭', '大米饭'], 'category': 'staple',
+        'per_100g': {'calories': 116, 'protein': 2.6, 'fat': 0.3, 'carbs': 26, 'fiber': 0.3},
+        'units': {'碗': {'small': 150, 'medium': 200, 'large': 300}}, 'default_unit': '碗'
+    },
+    {
+        # 小米收录为完整的食物名，避免"小米饭"被拆成"小"（分量）+"米饭"
+        'name': '小米饭', 'aliases': [], 'category': 'staple',
+        'per_100g': {'calories': 119, 'protein': 3.5, 'fat': 1, 'carbs': 23.7, 'fiber': 1.3},
+        'units': {'碗': {'small': 150, 'medium': 200, 'large': 300}}, 'default_unit': '碗'
+    },
+    {
+        'name': '小米粥', 'aliases': ['小米稀饭'], 'category': 'staple',
+        'per_100g': {'calories': 46, 'protein': 1.4, 'fat': 0.7, 'carbs': 8.4, 'fiber': 0.3},
+        'units': {'碗': {'small': 200, 'medium': 300, 'large': 400}}, 'default_unit': '碗'
+    },
+    {
+        'name': '面条', 'aliases': ['面', '汤面', '挂面'], 'category': 'staple',
+        'per_100g': {'calories': 120, 'protein': 4, 'fat': 0.5, 'carbs': 25, 'fiber': 1},
+        'units': {'碗': {'small': 170, 'medium': 250, 'large': 330}}, 'default_unit': '碗'
+    },
+    {
+        'name': '肉包', 'aliases': ['包子', '肉包子', '猪肉包'], 'category': 'staple',
+        'per_100g': {'calories': 227, 'protein': 8, 'fat': 8, 'carbs': 30, 'fiber': 1},
+        'units': {'个': 110}, 'default_unit': '个'
+    },
+    {
+        'name': '素包', 'aliases': ['素包子', '菜包', '菜包子'], 'category': 'staple',
+        'per_100g': {'calories': 200, 'protein': 6, 'fat': 4, 'carbs': 35, 'fiber': 2},
+        'units': {'个': 100}, 'default_unit': '个'
+    },
+    {
+        'name': '馒头', 'aliases': ['白馒头'], 'category': 'staple',
+        'per_100g': {'calories': 220, 'protein': 7, 'fat': 1.1, 'carbs': 47, 'fiber': 1.3},
+        'units': {'个': 100}, 'default_unit': '个'
+    },
+    {
+        'name': '鸡蛋', 'aliases': ['煮鸡蛋', '水煮蛋', '煮蛋', '白煮蛋', '茶叶蛋'], 'category': 'protein',
+        'per_100g': {'calories': 145, 'protein': 13, 'fat': 10, 'carbs': 1.5, 'fiber': 0},
+        'units': {'个': 55}, 'default_unit': '个'
+    },
+    {
+        'name': '煎蛋', 'aliases': ['煎鸡蛋', '荷包蛋'], 'category': 'protein',
+        'per_100g': {'calories': 200, 'protein': 13, 'fat': 15, 'carbs': 1.5, 'fiber': 0},
+        'units': {'个': 60}, 'default_unit': '个'
+    },
+    {
+        'name': '豆浆', 'aliases': ['无糖豆浆', '淡豆浆'], 'category': 'drink', 'liquid': True,
+        'per_100g': {'calories': 22, 'protein': 3.6, 'fat': 1.8, 'carbs': 1.2, 'fiber': 0.1},
+        'units': {'杯': 250, '碗': 250, '瓶': 300, '盒': 250}, 'default_unit': '杯'
+    },
+    {
+        'name': '甜豆浆', 'aliases': ['加糖豆浆'], 'category': 'sugary_drink', 'liquid': True,
+        'per_100g': {'calories': 36, 'protein': 3.6, 'fat': 1.8, 'carbs': 4.6, 'fiber': 0.1},
+        'units': {'杯': 250, '碗': 250, '瓶': 300, '盒': 250}, 'default_unit': '杯'
+    },
+    {
+        'name': '牛奶', 'aliases': ['纯牛奶', '鲜牛奶'], 'category': 'dairy', 'liquid': True,
+        'per_100g': {'calories': 54, 'protein': 3, 'fat': 3.2, 'carbs': 3.4, 'fiber': 0},
+        'units': {'杯': 250, '盒': 250, '瓶': 250}, 'default_unit': '杯'
+    },
+    {
+        'name': '可乐', 'aliases': ['可口可乐', '百事可乐'], 'category': 'sugary_drink', 'liquid': True,
+        'per_100g': {'calories': 43, 'protein': 0, 'fat': 0, 'carbs': 10.6, 'fiber': 0},
+        'units': {'杯': {'small': 300, 'medium': 500, 'large': 700}, '罐': 330, '听': 330, '瓶': 500},
+        'default_unit': '杯'
+    },
+    {
+        'name': '红烧肉', 'aliases': [], 'category': 'meat',
+        'per_100g': {'calories': 400, 'protein': 13, 'fat': 37, 'carbs': 4, 'fiber': 0},
+        'units': {'份': {'small': 90, 'medium': 115, 'large': 140}, '块': 25}, 'default_unit': '份'
+    },
+    {
+        'name': '青菜', 'aliases': ['炒青菜', '清炒青菜', '蔬菜', '炒时蔬', '小白菜'], 'category': 'vegetable',
+        'per_100g': {'calories': 20, 'protein': 1.5, 'fat': 0.3, 'carbs': 2, 'fiber': 1.5},
+        'units': {'份': 200, '盘': 250, '碗': 150}, 'default_unit': '份'
+    },
+    {
+        'name': '鸡胸肉', 'aliases': ['鸡胸'], 'category': 'meat',
+        'per_100g': {'calories': 133, 'protein': 23, 'fat': 5, 'carbs': 1, 'fiber': 0},
+        'units': {'份': {'small': 100, 'medium': 150, 'large': 200}, '块': {'small': 80, 'medium': 120, 'large': 180}},
+        'default_unit': '份'
+    },
+    {
+        'name': '猪肉', 'aliases': [], 'category': 'meat',
+        'per_100g': {'calories': 395, 'protein': 13, 'fat': 37, 'carbs': 0, 'fiber': 0},
+        'units': {'份': {'small': 80, 'medium': 120, 'large': 160}}, 'default_unit': '份'
+    },
+    {
+        'name': '牛肉', 'aliases': [], 'category': 'meat',
+        'per_100g': {'calories': 250, 'protein': 20, 'fat': 10, 'carbs': 0, 'fiber': 0},
+        'units': {'份': {'small': 80, 'medium': 120, 'large': 160}}, 'default_unit': '份'
+    },
+    {
+        'name': '炒饭', 'aliases': ['蛋炒饭', '扬州炒饭'], 'category': 'staple',
+        'per_100g': {'calories': 180, 'protein': 5, 'fat': 6, 'carbs': 27, 'fiber': 0.8},
+        'units': {'份': {'small': 280, 'medium': 320, 'large': 380}, '碗': {'small': 280, 'medium': 320, 'large': 380},
+                  '盘': {'small': 280, 'medium': 320, 'large': 380}},
+        'default_unit': '份'
+    },
+    {
+        'name': '饺子', 'aliases': ['水饺', '猪肉饺子'], 'category': 'staple',
+        'per_100g': {'calories': 160, 'protein': 7, 'fat': 6, 'carbs': 20, 'fiber': 1},
+        'units': {'个': 25, '只': 25, '份': {'small': 200, 'medium': 250, 'large': 375},
+                  '盘': {'small': 200, 'medium': 250, 'large': 375}},
+        'default_unit': '份'
+    },
+    {
+        'name': '油条', 'aliases': [], 'category': 'fried',
+        'per_100g': {'calories': 388, 'protein': 6, 'fat': 18, 'carbs': 40, 'fiber': 0.5},
+        'units': {'根': 60, '个': 60}, 'default_unit': '根'
+    },
+]
+
+# 计量单位换算（克）；"两"跟在数字后面时是重量单位（二两 = 100g），单独出现时是数字
+WEIGHT_UNITS = {'克': 1, 'g': 1, '两': 50, '斤': 500, '毫升': 1, 'ml': 1}
+
+_FILLER_WORDS = sorted(['我', '今天', '吃了', '喝了', '吃', '喝', '了', '的', '和', '跟', '还有', '加上', '加', '以及', '配', '再'],
+                       key=len, reverse=True)
+_UNIT_PATTERN = '|'.join(sorted(['毫升', 'ml', '克', 'g', '两', '斤', '碗', '个', '杯', '根', '份', '片', '块', '盘',
+                                 '只', '瓶', '罐', '盒', '袋', '串', '勺', '听', '颗', '粒', '张', '包'],
+                                key=len, reverse=True))
+_QUANTITY_RE = re.compile(
+    # 中文数字非贪婪匹配，"二两"中的"两"才能作为单位
+    r'(?P<num>\d+(?:\.\d+)?|[零〇一二两三四五六七八九十百千]+?|半)?'
+    r'(?P<size>[小中大])?'
+    r'(?P<unit>' + _UNIT_PATTERN + r')?'
+)
+_SEPARATOR_RE = re.compile(r'[\s,，、;；。!！?？/]+')
+
+
+def _round1(value):
+    return round(value + 0.0, 1)
+
+
+class LocalAnalysis:
+    """本地解析结果：明确的食物、需澄清的食物和无法识别的片段"""
+
+    def __init__(self):
+        self.foods = []
+        self.ambiguous = []
+        self.unresolved = []
+        self.categories = set()
+
+    @property
+    def resolved_any(self):
+        return bool(self.foods or self.ambiguous)
+
+    @property
+    def fully_resolved(self):
+        return self.resolved_any and not self.unresolved
+
+    @property
+    def unresolved_text(self):
+        return '，'.join(self.unresolved)
+
+    def to_result(self):
+        """转换为与 AI 分析相同格式的结果（仅在完全解析时调用）"""
+        if self.ambiguous:
+            return {
+                'status': 'need_clarification',
+                'clear_foods': list(self.foods),
+                'ambiguous_items': list(self.ambiguous)
+            }
+        score, advice = score_meal(self.foods, self.categories)
+        return {
+            'status': 'clear',
+            'foods': list(self.foods),
+            'total_calories': sum(f['calories'] for f in self.foods),
+            'dietary_advice': advice,
+            'health_score': score
+        }
+
+
+def merge_with_model(local, model_result):
+    """合并本地解析结果和大模型对未识别部分的分析结果"""
+    if model_result.get('status') == 'need_clarification':
+        return {
+            'status': 'need_clarification',
+            'clear_foods': local.foods + list(model_result.get('clear_foods') or []),
+            'ambiguous_items': local.ambiguous + list(model_result.get('ambiguous_items') or [])
+        }
+
+    foods = local.foods + list(model_result.get('foods') or [])
+    if local.ambiguous:
+        return {
+            'status': 'need_clarification',
+            'clear_foods': foods,
+            'ambiguous_items': list(local.ambiguous)
+        }
+    merged = dict(model_result)
+    merged['foods'] = foods
+    merged['total_calories'] = sum(f.get('calories') or 0 for f in foods)
+    return merged
+
+
+class NutritionEngine:
+    """基于食物库的确定性营养计算"""
+
+    def __init__(self, foods):
+        self.foods = {}
+        self.aliases = {}
+        for food in foods:
+            self.add_food(food)
+
+    @classmethod
+    def load(cls, data_file=None):
+        """加载内置食物库，并用数据文件中的条目扩展或覆盖"""
+        foods = list(DEFAULT_FOODS)
+        if data_file and os.path.exists(data_file):
+            with open(data_file, encoding='utf-8') as f:
+                foods.extend(json.load(f))
+        return cls(foods)
+
+    def add_food(self, food):
+        self.foods[food['name']] = food
+        for alias in [food['name']] + list(food.get('aliases', [])):
+            self.aliases[alias] = food['name']
+        self._alias_lengths = sorted({len(a) for a in self.aliases}, reverse=True)
+
+    def analyze(self, description):
+        """解析饮食描述，返回 LocalAnalysis"""
+        analysis = LocalAnalysis()
+        text = unicodedata.normalize('NFKC', description or '').lower()
+        for segment in _SEPARATOR_RE.split(text):
+            if not segment:
+                continue
+            items = self._parse_segment(segment)
+            if items is None:
+                analysis.unresolved.append(segment)
+                continue
+            for kind, item in items:
+                (analysis.foods if kind == 'clear' else analysis.ambiguous).append(item)
+                analysis.categories.add(self.category(item.get('name') or item.get('food')))
+        return analysis
+
+    def category(self, name):
+        """查询食物类别，未收录的食物返回 None"""
+        food_name = self.aliases.get(name or '')
+        return self.foods[food_name].get('category') if food_name else None
+
+    def categories(self, foods):
+        """一组食物的类别集合"""
+        return {self.category(f.get('name')) for f in foods} - {None}
+
+    # ---------- 解析 ----------
+
+    def _match_foods(self, segment):
+        """最长匹配查找片段中的食物名，返回 [(start, end, 食物名)]"""
+        matches, i = [], 0
+        while i < len(segment):
+            for length in self._alias_lengths:
+                name = self.aliases.get(segment[i:i + length])
+                if name:
+                    matches.append((i, i + length, name))
+                    i += length
+                    break
+            else:
+                i += 1
+        return matches
+
+    def _parse_segment(self, segment):
+        """片段必须完整拆解为 [数量]食物[数量]，否则整体交给大模型
+
+        两个食物名紧挨着（如"牛肉面"、"鸡蛋炒饭"、"青菜包子"）通常是一道菜，不拆开计算
+        """
+        matches = self._match_foods(segment)
+        if not matches:
+            return None
+        if any(prev[1] == cur[0] for prev, cur in zip(matches, matches[1:])):
+            return None
+
+        quantities = []
+        cursor = 0
+        for start, end, _ in matches:
+            quantity = _parse_quantity(segment[cursor:start])
+            if quantity is False:
+                return None
+            quantities.append(quantity)
+            cursor = end
+
+        # 结尾的数量（如"米饭一碗"）归属最后一个食物
+        tail = _parse_quantity(segment[cursor:])
+        if tail is False:
+            return None
+        if tail:
+            if quantities[-1]:
+                return None
+            quantities[-1] = tail
+
+        items = []
+        for (_, _, name), quantity in zip(matches, quantities):
+            item = self._resolve(self.foods[name], quantity or {})
+            if item is None:
+                return None
+            items.append(item)
+        return items
+
+    def _resolve(self, food, quantity):
+        """根据数量计算营养成分，返回 ('clear', 食物) 或 ('ambiguous', 澄清项)，无法计算返回 None"""
+        count = quantity.get('num', 1)
+        size = quantity.get('size')
+        unit = quantity.get('unit') or food['default_unit']
+        liquid = food.get('liquid', False)
+
+        if unit in WEIGHT_UNITS:
+            if 'num' not in quantity:
+                return None
+            grams = count * WEIGHT_UNITS[unit]
+            display = f"{_format_count(grams)}{'ml' if liquid else 'g'}"
+            return 'clear', _food_item(food, grams, display)
+
+        grams = food['units'].get(unit)
+        if grams is None:
+            return None
+
+        if isinstance(grams, dict):
+            if size:
+                label = f"{SIZE_LABELS[size]}{unit}" if count == 1 else f"{_format_count(count)}{SIZE_LABELS[size]}{unit}"
+                return 'clear', _food_item(food, grams[size] * count, label)
+            return 'ambiguous', _clarification_item(food, unit, grams, count)
+
+        return 'clear', _food_item(food, grams * count, f"{_format_count(count)}{unit}")
+
+
+def _parse_quantity(text):
+    """解析数量短语，空串返回 None，无法解析返回 False"""
+    text = _strip_fillers(text)
+    if not text:
+        return None
+    match = _QUANTITY_RE.fullmatch(text)
+    if not match or not match.group(0):
+        return False
+    quantity = {}
+    if match.group('num'):
+        num = match.group('num')
+        quantity['num'] = float(num) if num[0].isdigit() else chinese_to_number(num)
+        if quantity['num'] <= 0:
+            return False
+    if match.group('size'):
+        quantity['size'] = SIZE_VALUES[match.group('size')]
+    if match.group('unit'):
+        quantity['unit'] = match.group('unit')
+    return quantity
+
+
+def _strip_fillers(text):
+    changed = True
+    while changed and text:
+        changed = False
+        for word in _FILLER_WORDS:
+            if text.startswith(word):
+                text, changed = text[len(word):], True
+            if text.endswith(word):
+                text, changed = text[:-len(word)], True
+    return text
+
+
+def _format_count(value):
+    return str(int(value)) if value == int(value) else f'{value:g}'
+
+
+def _nutrients(food, grams):
+    per_100g = food['per_100g']
+    values = {key: _round1(per_100g.get(key, 0) * grams / 100) for key in NUTRIENTS}
+    values['calories'] = int(round(per_100g['calories'] * grams / 100))
+    return values
+
+
+def _food_item(food, grams, quantity):
+    item = {'name': food['name'], 'quantity': quantity}
+    item.update(_nutrients(food, grams))
+    return item
+
+
+def _clarification_item(food, unit, sizes, count):
+    suffix = 'ml' if food.get('liquid') else 'g'
+    options = []
+    for value in ('small', 'medium', 'large'):
+        grams = sizes[value]
+        label = f"{SIZE_LABELS[value]}{unit} (约{grams}{suffix})"
+        if count != 1:
+            label += f" ×{_format_count(count)}"
+        option = {'label': label, 'value': value}
+        option.update(_nutrients(food, grams * count))
+        options.append(option)
+    return {
+        'food': food['name'],
+        'question': f"请问{food['name']}是什么分量？",
+        'options': options
+    }
+
+
+# ========== 规则评分 ==========
+
+def score_meal(foods, categories):
+    """根据《中国居民膳食指南》的供能比等规则计算健康评分和建议，返回 (评分, 建议)
+
+    categories 为这一餐包含的食物类别集合（如 vegetable、sugary_drink、fried）
+    """
+    protein = sum(float(f.get('protein') or 0) for f in foods)
+    fat = sum(float(f.get('fat') or 0) for f in foods)
+    carbs = sum(float(f.get('carbs') or 0) for f in foods)
+    fiber = sum(float(f.get('fiber') or 0) for f in foods)
+    energy = protein * 4 + fat * 9 + carbs * 4
+
+    score = 95
+    advice = []
+    if energy > 0:
+        fat_ratio = fat * 9 / energy
+        carbs_ratio = carbs * 4 / energy
+        protein_ratio = protein * 4 / energy
+        if fat_ratio > 0.30:
+            score -= min(25, int((fat_ratio - 0.30) * 100))
+            advice.append(f"脂肪供能比约{round(fat_ratio * 100)}%，高于建议的20%-30%，建议减少油炸和肥肉，多选择蒸煮等少油做法。")
+        if carbs_ratio > 0.65:
+            score -= min(15, int((carbs_ratio - 0.65) * 100))
+            advice.append("主食占比偏高，可适当减少精米白面，搭配粗杂粮和蔬菜。")
+        if protein_ratio < 0.10:
+            score -= 10
+            advice.append("蛋白质偏少，建议搭配鸡蛋、豆制品、瘦肉或奶类。")
+    if 'vegetable' not in categories and 'fruit' not in categories:
+        score -= 10
+        advice.append("这一餐缺少蔬果，膳食指南建议每天摄入蔬菜300-500g、水果200-350g。")
+    elif fiber < 3:
+        score -= 5
+        advice.append("膳食纤维偏少，可以增加蔬菜、水果或全谷物。")
+    if 'sugary_drink' in categories:
+        score -= 10
+        advice.append("含糖饮料会带来额外的糖分，建议用白开水或无糖茶代替。")
+    if 'fried' in categories:
+        score -= 8
+        advice.append("油炸食品脂肪含量较高，建议减少食用频率。")
+
+    if not advice:
+        advice.append("这一餐搭配较为均衡，继续保持食物多样，注意荤素搭配和清淡少油。")
+    return max(40, min(100, score)), ''.join(advice[:3])
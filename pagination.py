@@ -0,0 +1,107 @@
+"""
+游标（keyset）分页：按 (created_at, id) 定位下一页，不使用 OFFSET，翻到任意深度都只扫描一页的索引范围
+
+响应体仍是列表，下一页游标放在 X-Next-Cursor 响应头中（没有更多数据时不返回该头）。
+"""
+import base64
+from datetime import datetime
+
+from flask import jsonify
+
+from models import db
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+MAX_PAGE_SIZE = 100
+# 单条 UNION ALL 最多合并的子查询数（SQLite 复合查询上限为 500）
+MAX_UNION_ARMS = 400
+
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (created_at, id)；格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, row_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception as e:
+        raise ValueError('分页游标无效') from e
+
+
+def page_size(value, default):
+    """请求中的 limit 参数，限制在 1..MAX_PAGE_SIZE 之间"""
+    if value is None:
+        return default
+    return max(1, min(MAX_PAGE_SIZE, value))
+
+
+def keyset_filter(model, cursor):
+    """游标之后（更旧）的记录：(created_at, id) < 游标位置"""
+    created_at, row_id = decode_cursor(cursor)
+    return db.tuple_(model.created_at, model.id) < (created_at, row_id)
+
+
+def keyset_query(query, model, cursor, limit):
+    """在 query 上加游标条件、从新到旧排序和 limit + 1（多取一条用于判断是否还有下一页）
+
+    cursor 为上一页返回的游标，None 表示第一页
+    """
+    if cursor:
+        query = query.filter(keyset_filter(model, cursor))
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+
+def keyset_page(query, model, cursor, limit):
+    """按 (created_at, id) 从新到旧取一页，返回 (记录列表, 下一页游标)"""
+    rows = keyset_query(query, model, cursor, limit).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def merged_union(arms, limit, descending=False):
+    """把多个只选出排序键列的子查询 UNION ALL，按这些列排序取前 limit 行（limit 为 None 时取全部）
+
+    每个子查询都能沿索引按序读出时，数据库逐路归并（SQLite 计划为 MERGE (UNION ALL)），
+    不需要把所有候选行放进临时表排序，取够 limit 行即停止
+    """
+    union = db.union_all(*arms)
+    order = [column.desc() if descending else column.asc() for column in union.selected_columns]
+    union = union.order_by(*order)
+    return union if limit is None else union.limit(limit)
+
+
+def union_top(arms, limit, descending=False):
+    """执行 merged_union，返回排序键元组列表；子查询过多时分批执行后在内存中合并"""
+    rows = []
+    for start in range(0, len(arms), MAX_UNION_ARMS):
+        statement = merged_union(arms[start:start + MAX_UNION_ARMS], limit, descending)
+        rows.extend(tuple(row) for row in db.session.execute(statement))
+    rows.sort(reverse=descending)
+    return rows if limit is None else rows[:limit]
+
+
+def keyset_union_page(model, criteria, cursor, limit):
+    """多路合并的游标分页：criteria 中每一项是一路查询的过滤条件（各自能沿 (..., created_at, id) 索引有序读取），
+    各路按 (created_at, id) 从新到旧归并后取一页，返回 (记录 ID 列表, 下一页游标)
+    """
+    condition = [keyset_filter(model, cursor)] if cursor else []
+    keys = union_top([
+        db.select(model.created_at, model.id).where(criterion, *condition) for criterion in criteria
+    ], limit + 1, descending=True) if criteria else []
+    if len(keys) <= limit:
+        return [row_id for _, row_id in keys], None
+    keys = keys[:limit]
+    return [row_id for _, row_id in keys], encode_cursor(*keys[-1])
+
+
+def page_response(items, next_cursor):
+    """列表响应，有下一页时附带 X-Next-Cursor 响应头"""
+    response = jsonify(items)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
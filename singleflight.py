@@ -0,0 +1,121 @@
+"""
+请求合并（single-flight）：相同键的并发模型请求共享同一次上游调用
+
+第一个请求（leader）真正调用模型，之后到达的相同请求（follower）订阅它的增量输出并等待同一个结果。
+"""
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+
+class _Flight:
+    """一次进行中的上游调用"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.chunks = []
+        self.listeners = []
+        self.future = Future()
+        self.lock = threading.Lock()
+
+    def publish(self, text):
+        """leader 产出的增量内容转发给所有订阅者"""
+        with self.lock:
+            self.chunks.append(text)
+            for listener in self.listeners:
+                listener(text)
+
+    def join(self, emit):
+        """订阅后续增量内容，并先补发已产出的部分"""
+        with self.lock:
+            for text in self.chunks:
+                emit(text)
+            self.listeners.append(emit)
+
+
+def _settle(target, source):
+    """把 source 的结果复制到 target（target 可能已因超时结束）"""
+    try:
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+    except InvalidStateError:
+        pass
+
+
+class SingleFlight:
+    """按键合并并发请求，记录节省的上游调用次数"""
+
+    def __init__(self, timeout=120):
+        # follower 最多等待 timeout 秒；进行超过 timeout 秒的调用不再接受新的 follower
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.counters = {'upstream_calls': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def run(self, key, start, emit):
+        """执行或加入 key 对应的上游调用，返回结果为模型全文的 Future
+
+        start(publish) 发起上游调用并返回 Future，增量内容通过 publish 发布；emit 接收本请求的增量内容
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and time.monotonic() - flight.started_at < self.timeout:
+                leader = False
+                self.counters['coalesced'] += 1
+            else:
+                flight = self._flights[key] = _Flight()
+                leader = True
+                self.counters['upstream_calls'] += 1
+        flight.join(emit)
+
+        if not leader:
+            return self._waiter(flight)
+
+        try:
+            upstream = start(flight.publish)
+        except Exception as e:
+            upstream = Future()
+            upstream.set_exception(e)
+        upstream.add_done_callback(lambda f: self._land(key, flight, f))
+        return upstream
+
+    def _land(self, key, flight, upstream):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if upstream.exception() is not None:
+                self.counters['errors'] += 1
+        _settle(flight.future, upstream)
+
+    def _waiter(self, flight):
+        """follower 的 Future：随 leader 结束，超过 timeout 秒未结束则以超时失败"""
+        waiter = Future()
+        flight.future.add_done_callback(lambda f: _settle(waiter, f))
+
+        def expire():
+            if not waiter.done():
+                try:
+                    waiter.set_exception(TimeoutError('等待相同请求的结果超时，请重试'))
+                    self._count('timeouts')
+                except InvalidStateError:
+                    pass
+
+        timer = threading.Timer(self.timeout, expire)
+        timer.daemon = True
+        timer.start()
+        waiter.add_done_callback(lambda f: timer.cancel())
+        return waiter
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters['in_flight'] = len(self._flights)
+        requests = counters['upstream_calls'] + counters['coalesced']
+        counters['saved_rate'] = round(counters['coalesced'] / requests, 3) if requests else 0.0
+        return counters
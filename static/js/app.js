@@ -43,9 +43,10 @@ async function initUser() {
                 usernameEl.textContent = user.username;
             }
             
-            // 加载饮食记录和消息
+            // 加载饮食记录和消息，并订阅新留言
             loadMealRecords();
             loadMessages();
+            subscribeInbox({ onMessage: handleIncomingMessage, onUnread: updateUnreadBadge });
             loadDailyNutrition();
             
             // 获取 AI 问候语
@@ -287,74 +288,69 @@ async function loadDailyNutrition() {
 
 // ==================== 饮食记录功能 ====================
 
-// 加载饮食记录
-async function loadMealRecords() {
-    try {
-        const response = await fetch('/api/meals');
-        if (response.ok) {
-            const records = await response.json();
-            renderMealRecords(records);
-        }
-    } catch (error) {
-        console.error('加载饮食记录失败:', error);
-    }
-}
+let mealRecordsList = null;
 
-// 渲染饮食记录列表
-function renderMealRecords(records) {
+// 加载饮食记录（第一页，滚动到底部时继续加载更早的记录）
+function loadMealRecords() {
     const recordsList = document.getElementById('recordsList');
     if (!recordsList) return;
     
-    if (records.length === 0) {
-        recordsList.innerHTML = '<div class="empty-tip">暂无饮食记录</div>';
-        return;
+    if (!mealRecordsList) {
+        mealRecordsList = createInfiniteList({
+            container: recordsList,
+            url: '/api/meals',
+            renderItem: renderMealRecord,
+            emptyHtml: '<div class="empty-tip">暂无饮食记录</div>'
+        });
     }
+    mealRecordsList.reload();
+}
+
+// 渲染单条饮食记录
+function renderMealRecord(record) {
+    const mealIcons = {
+        '早餐': '🌅',
+        '午餐': '☀️',
+        '晚餐': '🌙',
+        '零食': '🍪'
+    };
+    const icon = mealIcons[record.meal_type] || '🍽️';
+    const date = new Date(record.created_at).toLocaleDateString('zh-CN', {
+        month: 'numeric',
+        day: 'numeric'
+    });
     
-    recordsList.innerHTML = records.map(record => {
-        const mealIcons = {
-            '早餐': '🌅',
-            '午餐': '☀️',
-            '晚餐': '🌙',
-            '零食': '🍪'
-        };
-        const icon = mealIcons[record.meal_type] || '🍽️';
-        const date = new Date(record.created_at).toLocaleDateString('zh-CN', {
-            month: 'numeric',
-            day: 'numeric'
-        });
-        
-        // 解析食物列表并生成显示文本
-        let foods = [];
-        try {
-            foods = Array.isArray(record.foods) ? record.foods : [];
-        } catch(e) {
-            foods = [];
-        }
-        const foodsText = foods.map(f => f.name).join('、') || '无详情';
-        
-        // 点赞/点踩显示
-        const hasReactions = record.likes > 0 || record.dislikes > 0;
-        const reactionsHtml = hasReactions ? `
-            <div class="record-reactions">
-                ${record.likes > 0 ? `<span class="reaction-stat like-stat">👍 ${record.likes}</span>` : ''}
-                ${record.dislikes > 0 ? `<span class="reaction-stat dislike-stat">👎 ${record.dislikes}</span>` : ''}
-            </div>
-        ` : '';
-        
-        return `
-            <div class="record-item" data-id="${record.id}">
-                <div class="record-header">
-                    <span class="record-icon">${icon}</span>
-                    <span class="record-type">${record.meal_type}</span>
-                    <span class="record-date">${date}</span>
-                    <span class="record-calories">${record.total_calories} 卡</span>
-                </div>
-                <div class="record-foods">${escapeHtml(foodsText)}</div>
-                ${reactionsHtml}
-                <button class="record-delete" onclick="deleteMealRecord(${record.id})">删除</button>
+    // 解析食物列表并生成显示文本
+    let foods = [];
+    try {
+        foods = Array.isArray(record.foods) ? record.foods : [];
+    } catch(e) {
+        foods = [];
+    }
+    const foodsText = foods.map(f => f.name).join('、') || '无详情';
+    
+    // 点赞/点踩显示
+    const hasReactions = record.likes > 0 || record.dislikes > 0;
+    const reactionsHtml = hasReactions ? `
+        <div class="record-reactions">
+            ${record.likes > 0 ? `<span class="reaction-stat like-stat">👍 ${record.likes}</span>` : ''}
+            ${record.dislikes > 0 ? `<span class="reaction-stat dislike-stat">👎 ${record.dislikes}</span>` : ''}
+        </div>
+    ` : '';
+    
+    return `
+        <div class="record-item" data-id="${record.id}">
+            <div class="record-header">
+                <span class="record-icon">${icon}</span>
+                <span class="record-type">${record.meal_type}</span>
+                <span class="record-date">${date}</span>
+                <span class="record-calories">${record.total_calories} 卡</span>
             </div>
-        `;
-    }).join('');
+            <div class="record-foods">${escapeHtml(foodsText)}</div>
+            ${reactionsHtml}
+            <button class="record-delete" onclick="deleteMealRecord(${record.id})">删除</button>
+        </div>
+    `;
 }
 
 // 删除饮食记录
@@ -379,7 +375,7 @@ async function deleteMealRecord(recordId) {
 }
 
 // 保存饮食记录
-async function saveMealRecord(mealType, totalCalories, foods, advice) {
+async function saveMealRecord(mealType, totalCalories, foods, advice, healthScore) {
     try {
         const response = await fetch('/api/meals', {
             method: 'POST',
@@ -388,7 +384,8 @@ async function saveMealRecord(mealType, totalCalories, foods, advice) {
                 meal_type: mealType,
                 total_calories: totalCalories,
                 foods: foods,
-                advice: advice
+                dietary_advice: advice,
+                health_score: healthScore
             })
         });
         
@@ -403,61 +400,76 @@ async function saveMealRecord(mealType, totalCalories, foods, advice) {
 
 // ==================== 消息功能 ====================
 
-// 加载消息
-async function loadMessages() {
-    try {
-        const response = await fetch('/api/messages');
-        if (response.ok) {
-            const messages = await response.json();
-            renderMessages(messages);
-        }
-    } catch (error) {
-        console.error('加载消息失败:', error);
-    }
-}
+let messagesPageList = null;
 
-// 渲染消息列表
-function renderMessages(messages) {
+// 加载消息（第一页，滚动到底部时继续加载更早的留言）
+function loadMessages() {
     const messagesList = document.getElementById('messagesList');
     if (!messagesList) return;
     
-    if (messages.length === 0) {
-        messagesList.innerHTML = '<div class="empty-tip">暂无留言</div>';
-        return;
-    }
-    
-    messagesList.innerHTML = messages.map(msg => {
-        const date = new Date(msg.created_at).toLocaleDateString('zh-CN', {
-            month: 'numeric',
-            day: 'numeric',
-            hour: 'numeric',
-            minute: 'numeric'
+    if (!messagesPageList) {
+        messagesPageList = createInfiniteList({
+            container: messagesList,
+            url: '/api/messages',
+            renderItem: renderMessage,
+            emptyHtml: '<div class="empty-tip">暂无留言</div>'
         });
-        const isFromMe = state.currentUser && msg.sender_id === state.currentUser.id;
-        const friendId = isFromMe ? msg.receiver_id : msg.sender_id;
-        
-        // 关联饮食记录信息
-        let mealRefHtml = '';
-        if (msg.meal_info) {
-            mealRefHtml = `
-                <div class="message-meal-ref">
-                    <span class="meal-ref-icon">🍽️</span>
-                    <span class="meal-ref-text">${msg.meal_info.meal_type}: ${escapeHtml(msg.meal_info.foods)} (${msg.meal_info.calories}卡)</span>
-                </div>
-            `;
-        }
-        
-        return `
-            <div class="message-item clickable" onclick="goToFriend(${friendId})">
-                <div class="message-header">
-                    <span class="message-sender">${isFromMe ? '我' : msg.sender_name}</span>
-                    <span class="message-time">${date}</span>
-                </div>
-                ${mealRefHtml}
-                <div class="message-text">${escapeHtml(msg.content)}</div>
+    }
+    messagesPageList.reload();
+}
+
+// 渲染单条留言
+function renderMessage(msg) {
+    const date = new Date(msg.created_at).toLocaleDateString('zh-CN', {
+        month: 'numeric',
+        day: 'numeric',
+        hour: 'numeric',
+        minute: 'numeric'
+    });
+    const isFromMe = state.currentUser && msg.sender_id === state.currentUser.id;
+    const friendId = isFromMe ? msg.receiver_id : msg.sender_id;
+    
+    // 关联饮食记录信息
+    let mealRefHtml = '';
+    if (msg.meal_info) {
+        mealRefHtml = `
+            <div class="message-meal-ref">
+                <span class="meal-ref-icon">🍽️</span>
+                <span class="meal-ref-text">${msg.meal_info.meal_type}: ${escapeHtml(msg.meal_info.foods)} (${msg.meal_info.calories}卡)</span>
             </div>
         `;
-    }).join('');
+    }
+    
+    return `
+        <div class="message-item clickable" onclick="goToFriend(${friendId})">
+            <div class="message-header">
+                <span class="message-sender">${isFromMe ? '我' : msg.sender_name}</span>
+                <span class="message-time">${date}</span>
+            </div>
+            ${mealRefHtml}
+            <div class="message-text">${escapeHtml(msg.content)}</div>
+        </div>
+    `;
+}
+
+// ==================== 留言推送 ====================
+
+// 收到新留言：插入到留言列表顶部
+function handleIncomingMessage(msg) {
+    const messagesList = document.getElementById('messagesList');
+    if (!messagesList || !state.currentUser || msg.receiver_id !== state.currentUser.id) return;
+    
+    const emptyTip = messagesList.querySelector('.empty-tip');
+    if (emptyTip) emptyTip.remove();
+    messagesList.insertAdjacentHTML('afterbegin', renderMessage(msg));
+}
+
+// 更新未读留言数
+function updateUnreadBadge(unread) {
+    const badge = document.getElementById('messagesUnreadBadge');
+    if (!badge) return;
+    badge.textContent = unread.total > 99 ? '99+' : unread.total;
+    badge.style.display = unread.total > 0 ? 'inline-block' : 'none';
 }
 
 // 跳转到好友页面
@@ -621,7 +633,7 @@ async function openFriendDetail(friendId) {
     document.getElementById('friendDetailGoal').textContent = state.selectedFriend.goal || '未设置目标';
     
     // 加载好友饮食记录
-    await loadFriendMeals(friendId);
+    loadFriendMeals(friendId);
     
     // 加载与该好友的消息
     await loadFriendMessages(friendId);
@@ -632,52 +644,46 @@ async function openFriendDetail(friendId) {
     modal.classList.add('active');
 }
 
-// 加载好友饮食记录
-async function loadFriendMeals(friendId) {
-    try {
-        const response = await fetch(`/api/friends/${friendId}/meals`);
-        if (response.ok) {
-            const meals = await response.json();
-            renderFriendMeals(meals);
-        }
-    } catch (error) {
-        console.error('加载好友饮食记录失败:', error);
-    }
-}
+let friendMealsList = null;
 
-// 渲染好友饮食记录
-function renderFriendMeals(meals) {
+// 加载好友饮食记录（第一页，滚动到底部时继续加载更早的记录）
+function loadFriendMeals(friendId) {
     const mealsList = document.getElementById('friendMealsList');
     if (!mealsList) return;
     
-    if (meals.length === 0) {
-        mealsList.innerHTML = '<div class="empty-tip">该好友暂无饮食记录</div>';
-        return;
+    if (!friendMealsList) {
+        friendMealsList = createInfiniteList({
+            container: mealsList,
+            url: `/api/friends/${friendId}/meals`,
+            renderItem: renderFriendMeal,
+            emptyHtml: '<div class="empty-tip">该好友暂无饮食记录</div>'
+        });
     }
-    
+    friendMealsList.reload(`/api/friends/${friendId}/meals`);
+}
+
+// 渲染单条好友饮食记录
+function renderFriendMeal(meal) {
     const mealIcons = {
         '早餐': '🌅',
         '午餐': '☀️',
         '晚餐': '🌙',
         '零食': '🍪'
     };
+    const icon = mealIcons[meal.meal_type] || '🍽️';
+    const date = new Date(meal.created_at).toLocaleDateString('zh-CN', {
+        month: 'numeric',
+        day: 'numeric'
+    });
     
-    mealsList.innerHTML = meals.map(meal => {
-        const icon = mealIcons[meal.meal_type] || '🍽️';
-        const date = new Date(meal.created_at).toLocaleDateString('zh-CN', {
-            month: 'numeric',
-            day: 'numeric'
-        });
-        
-        return `
-            <div class="friend-meal-item">
-                <span class="meal-icon">${icon}</span>
-                <span class="meal-type">${meal.meal_type}</span>
-                <span class="meal-date">${date}</span>
-                <span class="meal-calories">${meal.total_calories} 卡</span>
-            </div>
-        `;
-    }).join('');
+    return `
+        <div class="friend-meal-item">
+            <span class="meal-icon">${icon}</span>
+            <span class="meal-type">${meal.meal_type}</span>
+            <span class="meal-date">${date}</span>
+            <span class="meal-calories">${meal.total_calories} 卡</span>
+        </div>
+    `;
 }
 
 // 加载与好友的消息
@@ -805,13 +811,11 @@ async function sendChatMessage(message) {
     const loadingEl = addLoadingIndicator();
     
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ message: message })
-        });
-        
-        const result = await response.json();
+        const result = await fetchAIStream(
+            STREAM_SUPPORTED ? '/api/chat/stream' : '/api/chat',
+            { message: message },
+            createStreamRenderer(loadingEl, text => `<div class="chat-reply">${formatReply(text)}</div>`)
+        );
         loadingEl.remove();
         
         if (result.error) {
@@ -840,16 +844,14 @@ async function sendFoodMessage(message) {
     const loadingEl = addLoadingIndicator();
     
     try {
-        const response = await fetch('/api/analyze-meal', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
+        const result = await fetchAIStream(
+            STREAM_SUPPORTED ? '/api/analyze-meal/stream' : '/api/analyze-meal',
+            {
                 meal_type: state.currentMeal,
                 description: message
-            })
-        });
-        
-        const result = await response.json();
+            },
+            createStreamRenderer(loadingEl, text => `<div class="stream-preview">${escapeHtml(text)}</div>`)
+        );
         
         // 移除加载动画
         loadingEl.remove();
@@ -865,7 +867,8 @@ async function sendFoodMessage(message) {
                 state.currentMeal,
                 result.total_calories,
                 result.foods,
-                result.dietary_advice
+                result.dietary_advice,
+                result.health_score
             );
         }
     } catch (error) {
@@ -987,6 +990,121 @@ function addLoadingIndicator() {
     return loadingEl;
 }
 
+// 浏览器是否支持读取流式响应
+const STREAM_SUPPORTED = typeof ReadableStream !== 'undefined' && typeof TextDecoder !== 'undefined';
+
+// 请求 AI 接口：优先读取 SSE，生成的文本逐段回调 onDelta（首个字即可显示），返回最终结果；
+// 接口只返回任务 ID（不支持流式读取）或连接中途断开时，改为轮询任务结果
+async function fetchAIStream(url, payload, onDelta) {
+    // FormData 由浏览器设置 multipart 边界，其余按 JSON 发送
+    const response = await fetch(url, payload instanceof FormData ? {
+        method: 'POST',
+        body: payload
+    } : {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+    });
+    
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.includes('text/event-stream') || !response.body) {
+        const data = await response.json();
+        return data.job_id ? await pollAIJob(data.job_id, onDelta) : data;
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+    let jobId = null;
+    let received = 0;
+    
+    try {
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                const evt = parseSSEEvent(buffer.slice(0, sep));
+                buffer = buffer.slice(sep + 2);
+                if (!evt.data) continue;
+                
+                if (evt.event === 'job') {
+                    jobId = evt.data.job_id;
+                } else if (evt.event === 'delta') {
+                    const text = evt.data.text || '';
+                    received += text.length;
+                    onDelta(text);
+                } else if (evt.event === 'result') {
+                    result = evt.data;
+                } else if (evt.event === 'error') {
+                    result = { error: evt.data.error };
+                }
+            }
+        }
+    } catch (error) {
+        // 连接中断时改为轮询任务结果
+        if (!jobId) throw error;
+    }
+    
+    if (!result && jobId) {
+        return await pollAIJob(jobId, onDelta, received);
+    }
+    return result || { error: '连接中断，请重试' };
+}
+
+// 轮询后台 AI 任务，直到完成；received 为已展示的文本长度
+async function pollAIJob(jobId, onDelta, received = 0) {
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        const job = await response.json();
+        if (!response.ok) return job;
+        
+        if (job.text && job.text.length > received) {
+            onDelta(job.text.slice(received));
+            received = job.text.length;
+        }
+        if (job.status === 'done') return job.result;
+        if (job.status === 'failed') return { error: job.error || '请求失败，请重试' };
+        
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
+// 解析单条 SSE 消息
+function parseSSEEvent(raw) {
+    let event = 'message';
+    const dataLines = [];
+    raw.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    
+    let data = null;
+    try {
+        data = JSON.parse(dataLines.join('\n'));
+    } catch (e) {
+        data = null;
+    }
+    return { event, data };
+}
+
+// 在加载气泡中逐段渲染流式输出
+function createStreamRenderer(loadingEl, render) {
+    const contentEl = loadingEl.querySelector('.message-content');
+    let text = '';
+    return (piece) => {
+        text += piece;
+        contentEl.innerHTML = render(text);
+        scrollToBottom();
+    };
+}
+
 // 添加错误消息
 function addErrorMessage(error) {
     const messageEl = document.createElement('div');
@@ -1013,10 +1131,7 @@ function addResultCard(result) {
     
     // 健康评分样式
     const score = result.health_score || 70;
-    let scoreClass = 'fair';
-    if (score >= 90) scoreClass = 'excellent';
-    else if (score >= 70) scoreClass = 'good';
-    else if (score < 50) scoreClass = 'poor';
+    const scoreClass = getScoreClass(score);
     
     // 形象化数据
     const viz = result.visualizations || { cola: 0, rice: 0, running_km: 0 };
@@ -1081,6 +1196,42 @@ function addResultCard(result) {
     messageEl.dataset.originalContent = shareText;
     chatContainer.appendChild(messageEl);
     scrollToBottom();
+    return messageEl;
+}
+
+// 健康评分对应的样式
+function getScoreClass(score) {
+    if (score >= 90) return 'excellent';
+    if (score >= 70) return 'good';
+    if (score < 50) return 'poor';
+    return 'fair';
+}
+
+// 获取模型生成的饮食建议（后台任务），更新结果卡片；返回模型建议，未得到时返回 null
+async function refineMealAdvice(messageEl, result) {
+    try {
+        const advice = await fetchAIStream('/api/meal-advice', {
+            meal_type: state.currentMeal,
+            foods: result.foods
+        }, () => {});
+        if (!advice || advice.error || advice.advice_source !== 'model') return null;
+        
+        const adviceEl = messageEl.querySelector('.dietary-advice p');
+        if (adviceEl) adviceEl.textContent = advice.dietary_advice;
+        
+        const scoreEl = messageEl.querySelector('.score-circle');
+        if (scoreEl) {
+            scoreEl.textContent = advice.health_score;
+            scoreEl.className = `score-circle ${getScoreClass(advice.health_score)}`;
+        }
+        
+        const foodNames = result.foods.map(f => f.name).join('、');
+        messageEl.dataset.originalContent = `今日饮食：${foodNames}\n总计：${result.total_calories} 卡路里\n健康评分：${advice.health_score}分\n${advice.dietary_advice}`;
+        return advice;
+    } catch (error) {
+        console.error('获取饮食建议失败:', error);
+        return null;
+    }
 }
 
 // 添加澄清卡片
@@ -1128,6 +1279,7 @@ function addClarificationCard(result) {
             const value = e.target.dataset.value;
             const calories = parseInt(e.target.dataset.calories);
             const label = e.target.dataset.label;
+            const option = result.ambiguous_items[index].options.find(o => o.value === value) || {};
             
             // 更新选中状态
             const container = e.target.closest('.clarification-item');
@@ -1139,6 +1291,10 @@ function addClarificationCard(result) {
                 food: result.ambiguous_items[index].food,
                 value: value,
                 calories: calories,
+                protein: option.protein,
+                fat: option.fat,
+                carbs: option.carbs,
+                fiber: option.fiber,
                 selected_label: label
             };
             
@@ -1187,13 +1343,17 @@ async function confirmClarification() {
         if (result.error) {
             addErrorMessage(result.error);
         } else {
-            addResultCard(result);
-            // 保存饮食记录
+            const mealType = state.currentMeal;
+            const resultEl = addResultCard(result);
+            // 等模型建议返回后再保存，保存的评分和建议与卡片上显示的一致
+            const refined = result.advice_refinable ? await refineMealAdvice(resultEl, result) : null;
+            const advice = refined || result;
             saveMealRecord(
-                state.currentMeal,
+                mealType,
                 result.total_calories,
                 result.foods,
-                result.dietary_advice
+                advice.dietary_advice,
+                advice.health_score
             );
         }
     } catch (error) {
@@ -1397,11 +1557,11 @@ window.downloadShareImage = downloadShareImage;
 
 // 相机状态
 let cameraStream = null;
-let capturedImageBase64 = null;
+let capturedImageDataUrl = null;
 
 // 打开拍照弹窗
 function openCameraModal() {
-    capturedImageBase64 = null;
+    capturedImageDataUrl = null;
     const modal = document.getElementById('cameraModal');
     const choose = document.getElementById('cameraChoose');
     const preview = document.getElementById('cameraPreview');
@@ -1418,7 +1578,7 @@ function openCameraModal() {
 // 关闭拍照弹窗
 function closeCameraModal() {
     stopCamera();
-    capturedImageBase64 = null;
+    capturedImageDataUrl = null;
     document.getElementById('cameraModal').classList.remove('active');
     // 重置文件输入
     document.getElementById('imageFileInput').value = '';
@@ -1467,7 +1627,7 @@ function capturePhoto() {
 
     // 压缩为 JPEG base64
     const dataUrl = compressCanvas(canvas, 1280, 1280, 0.8);
-    capturedImageBase64 = dataUrl.split(',')[1];
+    capturedImageDataUrl = dataUrl;
 
     // 停止摄像头，显示预览
     stopCamera();
@@ -1516,7 +1676,7 @@ async function handleImageUpload(event) {
 
     try {
         const dataUrl = await compressImageFile(file, 1280, 1280, 0.8);
-        capturedImageBase64 = dataUrl.split(',')[1];
+        capturedImageDataUrl = dataUrl;
 
         // 显示预览
         document.getElementById('cameraChoose').style.display = 'none';
@@ -1564,7 +1724,7 @@ function compressImageFile(file, maxWidth, maxHeight, quality) {
 
 // 重新拍摄
 function retakePhoto() {
-    capturedImageBase64 = null;
+    capturedImageDataUrl = null;
     document.getElementById('imagePreviewArea').style.display = 'none';
     document.getElementById('imageFileInput').value = '';
     // 回到选择界面
@@ -1573,14 +1733,26 @@ function retakePhoto() {
 
 // 确认照片并发送分析
 function confirmPhoto() {
-    if (!capturedImageBase64) return;
-    const imageBase64 = capturedImageBase64;
+    if (!capturedImageDataUrl) return;
+    const imageDataUrl = capturedImageDataUrl;
     closeCameraModal();
-    sendVisionMessage(imageBase64);
+    sendVisionMessage(imageDataUrl);
+}
+
+// data URL 转为 Blob（以 multipart 文件上传，避免 base64 膨胀）
+function dataUrlToBlob(dataUrl) {
+    const [header, data] = dataUrl.split(',');
+    const mime = (header.match(/data:([^;]+)/) || [])[1] || 'image/jpeg';
+    const binary = atob(data);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new Blob([bytes], { type: mime });
 }
 
 // 发送视觉分析消息
-async function sendVisionMessage(imageBase64) {
+async function sendVisionMessage(imageDataUrl) {
     // 清除欢迎消息
     const welcomeMsg = chatContainer.querySelector('.welcome-message');
     if (welcomeMsg) {
@@ -1595,7 +1767,7 @@ async function sendVisionMessage(imageBase64) {
     messageEl.className = 'message user';
     messageEl.innerHTML = `
         <div class="message-label">${mealIcons[state.currentMeal] || '🍽️'} ${state.currentMeal} (拍照识别)</div>
-        <img class="user-image-thumbnail" src="data:image/jpeg;base64,${imageBase64}" alt="食物照片">
+        <img class="user-image-thumbnail" src="${imageDataUrl}" alt="食物照片">
     `;
     chatContainer.appendChild(messageEl);
     scrollToBottom();
@@ -1606,16 +1778,14 @@ async function sendVisionMessage(imageBase64) {
     const loadingEl = addLoadingIndicator();
 
     try {
-        const response = await fetch('/api/analyze-meal-vision', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                meal_type: state.currentMeal,
-                image: imageBase64
-            })
-        });
-
-        const result = await response.json();
+        const form = new FormData();
+        form.append('meal_type', state.currentMeal);
+        form.append('image', dataUrlToBlob(imageDataUrl), 'meal.jpg');
+        const result = await fetchAIStream(
+            STREAM_SUPPORTED ? '/api/analyze-meal-vision/upload/stream' : '/api/analyze-meal-vision/upload',
+            form,
+            createStreamRenderer(loadingEl, text => `<div class="stream-preview">${escapeHtml(text)}</div>`)
+        );
         loadingEl.remove();
 
         if (result.error) {
@@ -1628,7 +1798,8 @@ async function sendVisionMessage(imageBase64) {
                 state.currentMeal,
                 result.total_calories,
                 result.foods,
-                result.dietary_advice
+                result.dietary_advice,
+                result.health_score
             );
         }
     } catch (error) {
@@ -0,0 +1,137 @@
+/**
+ * 食友记 - 各页面共用的前端工具（游标分页列表、留言推送订阅）
+ */
+
+// ==================== 游标分页 ====================
+
+// 请求一页列表数据，返回 { items, nextCursor }（下一页游标在 X-Next-Cursor 响应头中）
+async function fetchPage(url, cursor) {
+    const pageUrl = cursor ? `${url}${url.includes('?') ? '&' : '?'}cursor=${encodeURIComponent(cursor)}` : url;
+    const response = await fetch(pageUrl);
+    if (!response.ok) {
+        throw new Error(`请求失败: ${response.status}`);
+    }
+    return { items: await response.json(), nextCursor: response.headers.get('X-Next-Cursor') };
+}
+
+// 无限滚动列表：reload() 加载第一页，列表末尾进入可视区域时自动加载下一页
+function createInfiniteList({ container, url, renderItem, emptyHtml }) {
+    const sentinel = document.createElement('div');
+    sentinel.className = 'list-sentinel';
+    let cursor = null;
+    let done = false;
+    let loading = false;
+    let generation = 0;
+
+    const observer = 'IntersectionObserver' in window
+        ? new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadMore();
+        })
+        : null;
+
+    async function loadMore() {
+        if (loading || done) return;
+        loading = true;
+        const current = generation;
+        try {
+            const page = await fetchPage(url, cursor);
+            if (current !== generation) return;
+            if (!cursor && page.items.length === 0) {
+                container.innerHTML = emptyHtml;
+                done = true;
+                return;
+            }
+            sentinel.insertAdjacentHTML('beforebegin', page.items.map(renderItem).join(''));
+            cursor = page.nextCursor;
+            done = !cursor;
+        } catch (error) {
+            console.error('加载列表失败:', error);
+        } finally {
+            if (current === generation) {
+                loading = false;
+                if (done) {
+                    sentinel.remove();
+                } else if (observer) {
+                    // 重新观察：加载后末尾仍在可视区域内时继续加载下一页
+                    observer.unobserve(sentinel);
+                    observer.observe(sentinel);
+                }
+            }
+        }
+    }
+
+    // nextUrl 可切换数据源（例如打开另一位好友的记录）
+    function reload(nextUrl) {
+        if (nextUrl) url = nextUrl;
+        generation++;
+        cursor = null;
+        done = false;
+        loading = false;
+        container.innerHTML = '';
+        container.appendChild(sentinel);
+        if (observer) {
+            observer.unobserve(sentinel);
+            observer.observe(sentinel);
+        } else {
+            loadMore();
+        }
+    }
+
+    return { reload, loadMore };
+}
+
+// ==================== 留言推送 ====================
+
+// 订阅新留言：优先使用 SSE，浏览器不支持时改为长轮询；只接收上次看到的消息之后的增量
+async function subscribeInbox({ onMessage, onUnread }) {
+    let lastId = 0;
+    
+    function receive(msg) {
+        if (msg.id <= lastId) return;
+        lastId = msg.id;
+        onMessage(msg);
+    }
+    
+    function openStream() {
+        const source = new EventSource(`/api/messages/stream?after_id=${lastId}`);
+        source.addEventListener('message', e => receive(JSON.parse(e.data)));
+        source.addEventListener('unread', e => onUnread(JSON.parse(e.data)));
+        // 连接中断或服务端定期关闭后，从最后收到的消息继续订阅
+        source.onerror = () => {
+            source.close();
+            setTimeout(openStream, 3000);
+        };
+    }
+    
+    async function longPoll() {
+        while (true) {
+            try {
+                const response = await fetch(`/api/messages/updates?after_id=${lastId}`);
+                if (!response.ok) throw new Error(`请求失败: ${response.status}`);
+                const updates = await response.json();
+                updates.messages.forEach(receive);
+                onUnread(updates.unread);
+            } catch (error) {
+                console.error('获取新留言失败:', error);
+                await new Promise(resolve => setTimeout(resolve, 5000));
+            }
+        }
+    }
+    
+    try {
+        const response = await fetch('/api/messages/unread');
+        if (!response.ok) return;
+        const summary = await response.json();
+        lastId = summary.last_id;
+        onUnread(summary);
+    } catch (error) {
+        console.error('获取未读留言失败:', error);
+        return;
+    }
+    
+    if (window.EventSource) {
+        openStream();
+    } else {
+        longPoll();
+    }
+}
@@ -0,0 +1,109 @@
+"""
+测试公共配置：每次测试会话使用临时 SQLite 数据库，不配置模型 API Key（不会访问外部服务）
+"""
+import os
+import sys
+import time
+import types
+import uuid
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_DB_DIR = tempfile.mkdtemp(prefix='diet-assistant-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DB_DIR, 'test.db')
+os.environ['MODELSCOPE_API_KEY'] = ''
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app as app_module
+    return app_module
+
+
+@pytest.fixture
+def app_ctx(app_module):
+    with app_module.app.app_context():
+        yield app_module.app
+
+
+def register(app_module, username=None, goal='lose_weight'):
+    """注册一个新用户，返回 (已登录的 test client, 用户资料)"""
+    client = app_module.app.test_client()
+    username = username or 'u' + uuid.uuid4().hex[:12]
+    response = client.post('/api/register', json={
+        'username': username, 'password': '123456', 'gender': 'male', 'goal': goal
+    })
+    assert response.status_code == 200, response.data
+    return client, client.get('/api/profile').get_json()
+
+
+def make_friends(app_module, a, b):
+    """a 通过 b 的邀请码添加好友"""
+    response = a[0].post('/api/friends', json={'invite_code': b[1]['invite_code']})
+    assert response.status_code == 200, response.data
+
+
+@pytest.fixture
+def user(app_module):
+    return register(app_module)
+
+
+@pytest.fixture
+def other_user(app_module):
+    return register(app_module)
+
+
+class FakeStream:
+    """模拟模型流式响应：把回复切成小段逐块返回"""
+
+    def __init__(self, text):
+        self.parts = [text[i:i + 7] for i in range(0, len(text), 7)]
+
+    def __iter__(self):
+        for part in self.parts:
+            delta = types.SimpleNamespace(content=part)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+    def close(self):
+        pass
+
+
+class FakeClient:
+    """模拟 OpenAI 客户端，reply 为固定回复或 reply(请求参数) 函数"""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return FakeStream(self.reply(kwargs) if callable(self.reply) else self.reply)
+
+
+@pytest.fixture
+def fake_ai(app_module, monkeypatch):
+    """配置假的 API Key 和模型客户端，返回 set_reply(reply) -> FakeClient"""
+    monkeypatch.setattr(app_module, 'API_KEY', 'test-key')
+
+    def set_reply(reply):
+        client = FakeClient(reply)
+        monkeypatch.setattr(app_module, 'get_client', lambda: client)
+        return client
+    return set_reply
+
+
+def wait_job(client, response, timeout=5):
+    """等待 202 返回的任务完成，返回任务信息"""
+    assert response.status_code == 202, response.data
+    job_id = response.get_json()['job_id']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError('任务未在限定时间内完成')
@@ -0,0 +1,44 @@
+from conftest import wait_job
+
+MEAL = {'meal_type': '午餐', 'total_calories': 300, 'foods': [{'name': '米饭', 'quantity': '1碗', 'calories': 300}]}
+
+
+def test_repeated_question_is_deduplicated(app_module, user, fake_ai):
+    client, _ = user
+    fake = fake_ai('多吃蔬菜')
+    first = wait_job(client, client.post('/api/chat', json={'message': '我今天吃得怎么样？'}))
+    second = wait_job(client, client.post('/api/chat', json={'message': '我今天吃得怎么样？'}))
+    assert first['job_id'] == second['job_id']
+    assert len(fake.calls) == 1
+
+
+def test_new_meal_invalidates_dedupe(app_module, user, fake_ai):
+    client, _ = user
+    fake = fake_ai('多吃蔬菜')
+    first = wait_job(client, client.post('/api/chat', json={'message': '今天的热量超了吗？'}))
+    meal_id = client.post('/api/meals', json=MEAL).get_json()['record']['id']
+    second = wait_job(client, client.post('/api/chat', json={'message': '今天的热量超了吗？'}))
+    assert second['job_id'] != first['job_id']
+
+    # 删除后上下文与第一次相同，复用第一次的回答
+    client.delete(f'/api/meals/{meal_id}')
+    third = wait_job(client, client.post('/api/chat', json={'message': '今天的热量超了吗？'}))
+    assert third['job_id'] == first['job_id']
+    assert len(fake.calls) == 2
+
+
+def test_stream_endpoint_sends_deltas_then_result(app_module, user, fake_ai):
+    import json
+    client, _ = user
+    fake_ai('晚餐可以加一份绿叶菜，减少油炸食品')
+    response = client.post('/api/chat/stream', json={'message': '晚餐怎么吃？'})
+    assert response.mimetype == 'text/event-stream'
+
+    events = []
+    for block in response.get_data(as_text=True).strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    names = [name for name, _ in events if name != 'ping']
+    assert names[0] == 'job' and names[-1] == 'result' and 'delta' in names
+    text = ''.join(data['text'] for name, data in events if name == 'delta')
+    assert text == '晚餐可以加一份绿叶菜，减少油炸食品'
@@ -0,0 +1,81 @@
+import threading
+
+from models import db, DailyNutritionSummary
+
+MEAL = {
+    'meal_type': '午餐',
+    'total_calories': 300,
+    'foods': [{'name': '米饭', 'quantity': '1碗', 'calories': 300, 'protein': 5, 'fat': 1, 'carbs': 60, 'fiber': 1}],
+}
+
+
+def summaries(app_module, user_id):
+    with app_module.app.app_context():
+        return [(s.meal_count, s.total_calories, round(s.protein, 1))
+                for s in DailyNutritionSummary.query.filter_by(user_id=user_id)]
+
+
+def test_concurrent_saves_on_a_new_day(app_module, user):
+    client, profile = user
+    barrier = threading.Barrier(8)
+    statuses = []
+
+    def save():
+        barrier.wait()
+        statuses.append(client.post('/api/meals', json=MEAL).status_code)
+
+    threads = [threading.Thread(target=save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 8
+    assert summaries(app_module, profile['id']) == [(8, 2400, 40.0)]
+
+
+def test_delete_removes_empty_summary(app_module, user):
+    client, profile = user
+    first = client.post('/api/meals', json=MEAL).get_json()['record']['id']
+    second = client.post('/api/meals', json=MEAL).get_json()['record']['id']
+    assert summaries(app_module, profile['id']) == [(2, 600, 10.0)]
+
+    client.delete(f'/api/meals/{first}')
+    assert summaries(app_module, profile['id']) == [(1, 300, 5.0)]
+    client.delete(f'/api/meals/{second}')
+    assert summaries(app_module, profile['id']) == []
+
+
+def test_rebuild_matches_incremental(app_module, user):
+    client, profile = user
+    for _ in range(3):
+        client.post('/api/meals', json=MEAL)
+    before = summaries(app_module, profile['id'])
+    with app_module.app.app_context():
+        from models import rebuild_daily_summaries
+        rebuild_daily_summaries(profile['id'])
+        db.session.commit()
+    assert summaries(app_module, profile['id']) == before
+
+
+def test_increment_from_another_worker_is_not_lost(app_module, user):
+    """会话中缓存的汇总已过期（其他进程刚累加过）时，本次累加仍基于数据库中的最新值"""
+    client, profile = user
+    client.post('/api/meals', json=MEAL)
+    with app_module.app.app_context():
+        from datetime import datetime
+        from models import MealRecord, local_date_of
+        key = (profile['id'], local_date_of(datetime.utcnow()))
+        cached = DailyNutritionSummary.query.get(key)
+        assert cached.meal_count == 1
+
+        # 另一个连接（模拟其他 worker）累加同一行
+        with db.engine.begin() as conn:
+            conn.execute(DailyNutritionSummary.__table__.update().where(
+                DailyNutritionSummary.user_id == key[0]
+            ).values(meal_count=DailyNutritionSummary.meal_count + 1))
+
+        DailyNutritionSummary.apply(MealRecord(user_id=profile['id'], total_calories=100,
+                                               created_at=datetime.utcnow()))
+        db.session.commit()
+    assert summaries(app_module, profile['id'])[0][0] == 3
@@ -0,0 +1,67 @@
+from conftest import register, make_friends
+
+MEAL = {'meal_type': '午餐', 'total_calories': 300, 'foods': [{'name': '米饭', 'quantity': '1碗', 'calories': 300}]}
+
+
+def post_meal(author):
+    response = author[0].post('/api/meals', json=MEAL)
+    assert response.status_code == 200, response.data
+    return response.get_json()['record']['id']
+
+
+def read_feed(client, limit):
+    """按游标翻完整个动态，返回每页的饮食记录 ID"""
+    pages, cursor = [], None
+    while True:
+        query = {'limit': limit}
+        if cursor:
+            query['cursor'] = cursor
+        response = client.get('/api/feed', query_string=query)
+        assert response.status_code == 200, response.data
+        pages.append([item['id'] for item in response.get_json()])
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return pages
+
+
+def test_feed_merges_friends_newest_first(app_module, user):
+    friends = [register(app_module) for _ in range(3)]
+    stranger = register(app_module)
+    for friend in friends:
+        make_friends(app_module, user, friend)
+    posted = [post_meal(friends[i % 3]) for i in range(7)]
+    post_meal(stranger)
+    post_meal(user)
+
+    pages = read_feed(user[0], 3)
+    assert pages == [posted[6:3:-1], posted[3:0:-1], posted[0:1]]
+
+
+def test_feed_merges_batches_of_friends(app_module, monkeypatch, user):
+    monkeypatch.setattr('pagination.MAX_UNION_ARMS', 2)
+    friends = [register(app_module) for _ in range(5)]
+    for friend in friends:
+        make_friends(app_module, user, friend)
+    posted = [post_meal(friend) for friend in friends + friends[:2]]
+
+    pages = read_feed(user[0], 4)
+    assert sum(pages, []) == posted[::-1]
+    assert [len(page) for page in pages] == [4, 3]
+
+
+def test_feed_items_carry_author_reactions_and_comments(app_module, user, other_user):
+    make_friends(app_module, user, other_user)
+    meal_id = post_meal(other_user)
+    user[0].post(f'/api/meals/{meal_id}/reaction', json={'type': 'like'})
+    for content in ('看起来不错', '少吃点米饭'):
+        user[0].post('/api/messages', json={'receiver_id': other_user[1]['id'], 'content': content, 'meal_id': meal_id})
+
+    item, = user[0].get('/api/feed').get_json()
+    assert (item['id'], item['user_id'], item['username']) == (meal_id, other_user[1]['id'], other_user[1]['username'])
+    assert (item['likes'], item['my_reaction'], item['comments']) == (1, 'like', 2)
+
+
+def test_empty_feed_and_invalid_cursor(app_module, user):
+    response = user[0].get('/api/feed')
+    assert response.get_json() == [] and 'X-Next-Cursor' not in response.headers
+    assert user[0].get('/api/feed', query_string={'cursor': '!!'}).status_code == 400
@@ -0,0 +1,28 @@
+import threading
+
+from greeting import GreetingService
+
+
+def test_concurrent_start_launches_one_refresh_thread(monkeypatch):
+    started = []
+    real_thread = threading.Thread
+
+    def fake_thread(*args, **kwargs):
+        thread = real_thread(target=lambda: None, name=kwargs.get('name'))
+        started.append(thread)
+        return thread
+
+    service = GreetingService(generate=lambda *args: [])
+    monkeypatch.setattr('greeting.threading.Thread', fake_thread)
+    barrier = threading.Barrier(8)
+
+    def start():
+        barrier.wait()
+        service.start()
+
+    callers = [real_thread(target=start) for _ in range(8)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert len(started) == 1
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+from jobs import JobQueue, QueueFull
+from models import db
+
+
+@pytest.fixture
+def queue(app_module, app_ctx):
+    queue = JobQueue(app_module.app, max_workers=2, max_pending=2, dedupe_window=60)
+    yield queue
+    queue._executor.shutdown(wait=True)
+
+
+def blocking_task(release):
+    def task(emit):
+        emit('部分')
+        release.wait(5)
+        return {'ok': True}, None
+    return task
+
+
+def test_duplicate_submit_attaches_to_running_job(queue):
+    release = threading.Event()
+    job_id, created = queue.submit(1, 'chat', 'k1', blocking_task(release))
+    again, created_again = queue.submit(1, 'chat', 'k1', blocking_task(release))
+    assert created and not created_again
+    assert again == job_id
+
+    # 其他用户的相同请求不共享
+    other, _ = queue.submit(2, 'chat', 'k1', blocking_task(release))
+    assert other != job_id
+    release.set()
+
+
+def test_finished_job_is_reused_within_window(queue):
+    release = threading.Event()
+    release.set()
+    job_id, _ = queue.submit(1, 'chat', 'k2', blocking_task(release))
+    assert [event for event, _ in queue.events(job_id)][-1] == 'result'
+    assert queue.submit(1, 'chat', 'k2', blocking_task(release)) == (job_id, False)
+
+
+def test_queue_full(queue):
+    release = threading.Event()
+    queue.submit(1, 'chat', 'a', blocking_task(release))
+    queue.submit(1, 'chat', 'b', blocking_task(release))
+    with pytest.raises(QueueFull):
+        queue.submit(1, 'chat', 'c', blocking_task(release))
+    release.set()
+
+
+def test_failed_insert_releases_dedupe_key_and_slot(queue, monkeypatch):
+    real_commit = db.session.commit
+    calls = []
+
+    def failing_commit():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('database is locked')
+        return real_commit()
+
+    monkeypatch.setattr(db.session, 'commit', failing_commit)
+    with pytest.raises(RuntimeError):
+        queue.submit(1, 'chat', 'k3', blocking_task(threading.Event()))
+    assert queue._active == {} and queue._live == {}
+
+    release = threading.Event()
+    release.set()
+    job_id, created = queue.submit(1, 'chat', 'k3', blocking_task(release))
+    assert created
+    assert [event for event, _ in queue.events(job_id)][-1] == 'result'
+
+
+def test_task_error_marks_job_failed(queue):
+    def broken(emit):
+        raise ValueError('模型不可用')
+
+    job_id, _ = queue.submit(1, 'chat', 'k4', broken)
+    events = list(queue.events(job_id))
+    assert events[-1] == ('error', {'error': '模型不可用'})
+    assert queue._active == {}
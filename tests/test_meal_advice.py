@@ -0,0 +1,37 @@
+import json
+
+from conftest import wait_job
+
+FOODS = [
+    {'name': '米饭', 'quantity': '1碗', 'calories': 232},
+    {'name': '米饭', 'quantity': '1碗', 'calories': None},
+]
+
+
+def test_cache_key_with_missing_calories(app_module):
+    key = app_module.advice_cache_key('午餐', FOODS)
+    assert key == app_module.advice_cache_key('午餐', list(reversed(FOODS)))
+
+
+def test_advice_runs_as_job(app_module, user, fake_ai):
+    client, _ = user
+    fake = fake_ai(json.dumps({'dietary_advice': '多吃蔬菜', 'health_score': 77}, ensure_ascii=False))
+    foods = [{'name': '馒头', 'quantity': '1个', 'calories': 220}]
+    job = wait_job(client, client.post('/api/meal-advice', json={'meal_type': '早餐', 'foods': foods}))
+    assert job['result']['advice_source'] == 'model'
+    assert job['result']['health_score'] == 77
+    assert len(fake.calls) == 1
+
+    # 第二次命中缓存，直接返回
+    response = client.post('/api/meal-advice', json={'meal_type': '早餐', 'foods': foods})
+    assert response.status_code == 200
+    assert response.get_json()['cached'] is True
+
+
+def test_non_object_reply_falls_back_to_rules(app_module, user, fake_ai):
+    client, _ = user
+    fake_ai('["不是", "对象"]')
+    foods = [{'name': '油条', 'quantity': '2根', 'calories': 466}]
+    job = wait_job(client, client.post('/api/meal-advice', json={'meal_type': '早餐', 'foods': foods}))
+    assert job['status'] == 'done'
+    assert job['result']['advice_source'] == 'rule'
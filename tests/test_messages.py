@@ -0,0 +1,131 @@
+from conftest import register, make_friends
+
+
+def send(sender, receiver, content):
+    response = sender[0].post('/api/messages', json={'receiver_id': receiver[1]['id'], 'content': content})
+    assert response.status_code == 200, response.data
+    return response.get_json()['message']
+
+
+def unread(client):
+    return client.get('/api/messages/unread').get_json()
+
+
+def test_thread_cursor_pagination(app_module, user, other_user):
+    make_friends(app_module, user, other_user)
+    sent = [send(user if i % 2 else other_user, other_user if i % 2 else user, f'第{i}条')['id'] for i in range(7)]
+
+    pages, cursor = [], None
+    while True:
+        query = {'friend_id': other_user[1]['id'], 'limit': 3}
+        if cursor:
+            query['cursor'] = cursor
+        response = user[0].get('/api/messages', query_string=query)
+        assert response.status_code == 200
+        pages.append([m['id'] for m in response.get_json()])
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+
+    # 每页按时间正序，游标指向更早的消息
+    assert pages == [sent[4:7], sent[1:4], sent[0:1]]
+
+
+def test_invalid_cursor_is_rejected(app_module, user, other_user):
+    make_friends(app_module, user, other_user)
+    send(user, other_user, '你好')
+    response = user[0].get('/api/messages', query_string={'friend_id': other_user[1]['id'], 'cursor': '!!'})
+    assert response.status_code == 400
+
+
+def test_unread_counts_per_conversation(app_module, user, other_user):
+    third = register(app_module)
+    make_friends(app_module, other_user, user)
+    make_friends(app_module, third, user)
+    send(other_user, user, '一')
+    second = send(other_user, user, '二')
+    send(third, user, '三')
+    send(user, other_user, '回复')
+
+    data = unread(user[0])
+    assert data['total'] == 3
+    assert data['conversations'] == {str(other_user[1]['id']): 2, str(third[1]['id']): 1}
+    # 自己发出的消息不计入自己的未读
+    assert unread(other_user[0])['total'] == 1
+
+    conversations = {c['friend_id']: c for c in user[0].get('/api/conversations').get_json()}
+    assert conversations[other_user[1]['id']]['unread'] == 2
+    assert conversations[other_user[1]['id']]['last_preview'] == '回复'
+
+    # 标记已读到第二条之前，之后到达的消息仍算未读
+    response = user[0].post('/api/messages/read', json={'friend_id': other_user[1]['id'], 'last_id': second['id'] - 1})
+    assert response.get_json()['conversations'][str(other_user[1]['id'])] == 1
+    response = user[0].post('/api/messages/read', json={'friend_id': other_user[1]['id']})
+    assert response.get_json() == {'total': 1, 'conversations': {str(third[1]['id']): 1}}
+
+
+def test_updates_merge_all_conversations_after_id(app_module, user, other_user):
+    third = register(app_module)
+    make_friends(app_module, other_user, user)
+    make_friends(app_module, third, user)
+    after_id = unread(user[0])['last_id']
+    ids = [send(other_user, user, '一')['id'], send(user, third, '二')['id'], send(third, user, '三')['id']]
+
+    data = user[0].get('/api/messages/updates', query_string={'after_id': after_id, 'timeout': 0}).get_json()
+    assert [m['id'] for m in data['messages']] == ids
+    assert data['last_id'] == ids[-1]
+    assert data['unread']['total'] == 2
+
+    data = user[0].get('/api/messages/updates', query_string={'after_id': ids[0], 'timeout': 0}).get_json()
+    assert [m['id'] for m in data['messages']] == ids[1:]
+    data = other_user[0].get('/api/messages/updates', query_string={'after_id': after_id, 'timeout': 0}).get_json()
+    assert [m['id'] for m in data['messages']] == ids[:1]
+
+
+def test_updates_merge_batches_of_conversations(app_module, monkeypatch, user):
+    monkeypatch.setattr('pagination.MAX_UNION_ARMS', 2)
+    friends = [register(app_module) for _ in range(5)]
+    for friend in friends:
+        make_friends(app_module, friend, user)
+    after_id = unread(user[0])['last_id']
+    ids = [send(friend, user, '你好')['id'] for friend in reversed(friends)]
+
+    with app_module.app.app_context():
+        updates = app_module.message_updates(user[1]['id'], after_id, limit=4)
+    assert [m['id'] for m in updates['messages']] == ids[:4]
+
+
+def test_conversation_list_merges_both_sides_newest_first(app_module):
+    # 先注册的用户 ID 较小：与 first 的会话中 user 在 high 一侧，与 last 的会话中在 low 一侧
+    first = register(app_module)
+    user = register(app_module)
+    last = register(app_module)
+    make_friends(app_module, first, user)
+    make_friends(app_module, last, user)
+    send(first, user, '一')
+    send(last, user, '二')
+
+    assert [c['friend_id'] for c in user[0].get('/api/conversations').get_json()] == [last[1]['id'], first[1]['id']]
+    send(user, first, '三')
+    assert [c['friend_id'] for c in user[0].get('/api/conversations').get_json()] == [first[1]['id'], last[1]['id']]
+
+
+def test_wait_releases_connection_after_every_poll(app_module, monkeypatch, user):
+    from models import db
+    monkeypatch.setattr(app_module.inbox, 'poll_interval', 0.05)
+    states = []
+    latest_message_id = app_module.latest_message_id
+
+    def spy(user_id):
+        states.append(db.session().in_transaction())
+        return latest_message_id(user_id)
+
+    monkeypatch.setattr(app_module, 'latest_message_id', spy)
+    with app_module.app.app_context():
+        db.session.execute(db.text('SELECT 1'))
+        assert not app_module.wait_for_messages(user[1]['id'], 10 ** 9, 0.3)
+        assert len(states) >= 3
+        # 每次兜底查询前都没有遗留事务，等待结束后也不占用连接
+        assert not any(states)
+        assert not db.session().in_transaction()
+        assert db.engine.pool.checkedout() == 0
@@ -0,0 +1,48 @@
+import migrations
+from models import db, ensure_columns
+
+
+def friendship_columns():
+    return {c['name'] for c in db.inspect(db.engine).get_columns('friendships')}
+
+
+def test_upgrade_drops_legacy_friendship_unread_columns(app_ctx):
+    # 模拟执行过旧版本 7、尚未执行迁移 11 的库
+    ensure_columns('friendships', [
+        ('unread_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('last_read_message_id', 'INTEGER NOT NULL DEFAULT 0')
+    ])
+    migrations.SchemaMigration.query.filter_by(version=11).delete()
+    db.session.commit()
+
+    assert migrations.upgrade() == [11]
+    assert not {'unread_count', 'last_read_message_id'} & friendship_columns()
+
+
+def test_unread_state_only_lives_on_conversations(app_ctx):
+    assert 7 not in [version for version, _, _ in migrations.MIGRATIONS]
+    assert not {'unread_count', 'last_read_message_id'} & friendship_columns()
+
+
+def test_plan_problem_flags_scans_and_temp_sorts():
+    assert migrations.plan_problem(['SCAN meal_records']) == '全表扫描'
+    assert migrations.plan_problem([
+        'SEARCH meal_records USING INDEX ix_meal_records_user_created_id (user_id=?)',
+        'USE TEMP B-TREE FOR ORDER BY'
+    ]) == '临时排序'
+    assert migrations.plan_problem(['SEARCH users USING INDEX ix_users_created_id (created_at<?)']) is None
+
+
+def test_hot_queries_use_indexes_without_temp_sorts(app_ctx):
+    problems = [(name, plan) for name, plan, problem in migrations.explain_hot_queries() if problem]
+    assert problems == []
+
+
+def test_message_pair_index_is_dropped(app_ctx):
+    migrations.create_index('ix_messages_pair_created', 'messages', ['from_user_id', 'to_user_id', 'created_at'])
+    migrations.SchemaMigration.query.filter_by(version=15).delete()
+    db.session.commit()
+
+    assert migrations.upgrade() == [15]
+    names = db.session.execute(db.text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars().all()
+    assert 'ix_messages_pair_created' not in names
@@ -0,0 +1,56 @@
+import pytest
+
+from nutrition import NutritionEngine, DEFAULT_FOODS
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return NutritionEngine(DEFAULT_FOODS)
+
+
+@pytest.mark.parametrize('description', ['牛肉面', '鸡蛋面', '鸡蛋炒饭', '青菜包子', '牛肉饺子10个'])
+def test_compound_dish_goes_to_model(engine, description):
+    analysis = engine.analyze(description)
+    assert not analysis.fully_resolved
+    assert analysis.unresolved == [description]
+
+
+def test_separate_foods_are_still_split(engine):
+    analysis = engine.analyze('两个鸡蛋和一根油条')
+    assert analysis.fully_resolved
+    assert [(f['name'], f['quantity']) for f in analysis.foods] == [('鸡蛋', '2个'), ('油条', '1根')]
+
+
+@pytest.mark.parametrize('description, grams', [('二两米饭', 100), ('2两米饭', 100), ('半两米饭', 25)])
+def test_liang_after_number_is_weight(engine, description, grams):
+    analysis = engine.analyze(description)
+    assert analysis.fully_resolved
+    assert analysis.foods[0]['quantity'] == f'{grams}g'
+    assert analysis.foods[0]['calories'] == round(116 * grams / 100)
+
+
+def test_liang_alone_is_a_count(engine):
+    analysis = engine.analyze('两个鸡蛋')
+    assert analysis.foods[0]['quantity'] == '2个'
+
+
+def test_millet_is_not_a_small_bowl_of_rice(engine):
+    analysis = engine.analyze('小米饭')
+    assert not analysis.foods
+    assert analysis.ambiguous[0]['food'] == '小米饭'
+
+
+def test_size_word_before_unit(engine):
+    analysis = engine.analyze('一小碗米饭')
+    assert analysis.foods[0]['quantity'] == '小碗'
+    assert analysis.foods[0]['calories'] == 174
+
+
+def test_local_result_without_api_key(app_module, user):
+    client, _ = user
+    response = client.post('/api/analyze-meal', json={'meal_type': '早餐', 'description': '两个鸡蛋'})
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'clear'
+
+    response = client.post('/api/analyze-meal', json={'meal_type': '早餐', 'description': '牛肉面'})
+    assert response.status_code == 500
@@ -0,0 +1,50 @@
+import threading
+
+from conftest import register, make_friends
+
+MEAL = {'meal_type': '午餐', 'total_calories': 300, 'foods': [{'name': '米饭', 'quantity': '1碗', 'calories': 300}]}
+
+
+def react(client, meal_id, reaction_type):
+    response = client.post(f'/api/meals/{meal_id}/reaction', json={'type': reaction_type})
+    assert response.status_code == 200, response.data
+    return response.get_json()
+
+
+def test_add_switch_and_remove(app_module, user, other_user):
+    make_friends(app_module, other_user, user)
+    meal_id = user[0].post('/api/meals', json=MEAL).get_json()['record']['id']
+
+    data = react(other_user[0], meal_id, 'like')
+    assert (data['action'], data['likes'], data['dislikes'], data['my_reaction']) == ('added', 1, 0, 'like')
+    data = react(other_user[0], meal_id, 'dislike')
+    assert (data['action'], data['likes'], data['dislikes']) == ('switched', 0, 1)
+    data = react(other_user[0], meal_id, 'dislike')
+    assert (data['action'], data['likes'], data['dislikes'], data['my_reaction']) == ('removed', 0, 0, None)
+
+
+def test_concurrent_likes_are_all_counted(app_module, user):
+    friends = [register(app_module) for _ in range(6)]
+    for friend in friends:
+        make_friends(app_module, friend, user)
+    meal_id = user[0].post('/api/meals', json=MEAL).get_json()['record']['id']
+    barrier = threading.Barrier(len(friends))
+
+    def like(friend):
+        barrier.wait()
+        react(friend[0], meal_id, 'like')
+
+    threads = [threading.Thread(target=like, args=(friend,)) for friend in friends]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    data = user[0].get(f'/api/meals/{meal_id}/reactions').get_json()
+    assert data['likes'] == len(friends)
+
+
+def test_only_friends_can_react(app_module, user, other_user):
+    meal_id = user[0].post('/api/meals', json=MEAL).get_json()['record']['id']
+    response = other_user[0].post(f'/api/meals/{meal_id}/reaction', json={'type': 'like'})
+    assert response.status_code == 403
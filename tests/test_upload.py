@@ -0,0 +1,52 @@
+import io
+
+from conftest import register
+
+
+class CountingStream(io.BytesIO):
+    """记录服务端实际读取的字节数"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.consumed += len(chunk)
+        return chunk
+
+
+def chunked_upload(client, stream, boundary='XBOUNDARY'):
+    """不带 Content-Length 的分块上传"""
+    return client.post('/api/analyze-meal-vision/upload', input_stream=stream, headers={
+        'Content-Type': f'multipart/form-data; boundary={boundary}',
+        'Transfer-Encoding': 'chunked'
+    }, environ_overrides={'wsgi.input_terminated': True})
+
+
+def multipart(data, boundary='XBOUNDARY'):
+    return (f'--{boundary}\r\nContent-Disposition: form-data; name="meal_type"\r\n\r\n午餐\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="meal.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+
+def test_chunked_upload_is_capped_while_reading(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'API_KEY', 'test-key')
+    monkeypatch.setattr(app_module, 'MAX_UPLOAD_SIZE', 1024)
+    monkeypatch.setitem(app_module.app.config, 'MAX_CONTENT_LENGTH', 1024 + 256)
+    client, _ = register(app_module)
+
+    stream = CountingStream(multipart(b'\xff' * 64 * 1024))
+    response = chunked_upload(client, stream)
+    assert response.status_code == 400
+    assert '图片过大' in response.get_json()['error']
+    # 超过上限即停止读取，没有把整个请求体读完
+    assert stream.consumed < 16 * 1024
+
+
+def test_oversized_json_body_is_rejected(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    client, _ = register(app_module)
+    response = client.post('/api/analyze-meal-vision', json={'meal_type': '午餐', 'image': 'A' * 4096})
+    assert response.status_code == 413
+    assert response.get_json()['error'] == '请求内容过大'